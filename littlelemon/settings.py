@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -49,7 +50,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Per-route latency, SQL, serializer/renderer time and response size,
+    # served at /api/metrics (littlelemonAPI/metrics.py) - first, so it
+    # times the whole stack and sees the compressed size
+    'littlelemonAPI.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Brotli/gzip above COMPRESSION_MIN_SIZE bytes (littlelemonAPI/compression.py)
+    'littlelemonAPI.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -57,6 +64,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'littlelemonAPI.querybudget.QueryBudgetMiddleware',
+    'littlelemonAPI.routers.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'littlelemon.urls'
@@ -87,9 +96,95 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # File-backed test database: the shared-cache in-memory default
+        # fails concurrent writers with "table is locked" instead of using
+        # SQLite's normal locking, which the threaded tests rely on
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Keeps the test run's menu version, throttle counters and snapshot files out
+# of BASE_DIR (see littlelemonAPI/testrunner.py)
+TEST_RUNNER = 'littlelemonAPI.testrunner.TempStateTestRunner'
+
+# Production profile for SQLite: LITTLELEMON_DB_PROFILE=production
+# - WAL, synchronous=NORMAL, busy_timeout, mmap and cache size PRAGMAs on every
+#   new connection (see littlelemonAPI/db.py)
+# - persistent connections with health checks
+# - write transactions start with BEGIN IMMEDIATE, so two transactions can't
+#   both read and then deadlock upgrading to a write lock (transaction_mode
+#   needs Django >= 5.1 - the Pipfile pins 5.2)
+DB_PROFILE = os.environ.get('LITTLELEMON_DB_PROFILE', 'development')
+
+SQLITE_PRODUCTION = {
+    'CONN_MAX_AGE': 600,
+    'CONN_HEALTH_CHECKS': True,
+    'OPTIONS': {
+        'transaction_mode': 'IMMEDIATE',
+        # Seconds; the same wait as PRAGMA busy_timeout, also covering BEGIN
+        'timeout': 5,
+    },
+    'PRAGMAS': {
+        # Readers don't block the writer and vice versa
+        'journal_mode': 'WAL',
+        # Safe with WAL: a crash can lose the last commits, never corrupt the file
+        'synchronous': 'NORMAL',
+        # Milliseconds to wait for a lock instead of "database is locked"
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        # Negative = KiB, i.e. 64 MiB of page cache per connection
+        'cache_size': -64 * 1024,
+        'temp_store': 'MEMORY',
+    },
+}
+
+if DB_PROFILE == 'production':
+    DATABASES['default'].update(SQLITE_PRODUCTION)
+
+# Read replicas for menu reads (see littlelemonAPI/routers.py)
+# LITTLELEMON_REPLICAS=2 adds replica1 and replica2 (db_replica1.sqlite3, ...);
+# `python manage.py sync_replicas` copies the primary into them
+REPLICA_DATABASES = []
+for number in range(1, int(os.environ.get('LITTLELEMON_REPLICAS', 0)) + 1):
+    alias = 'replica%d' % number
+    DATABASES[alias] = dict(
+        DATABASES['default'],
+        NAME=BASE_DIR / ('db_%s.sqlite3' % alias),
+        TEST={'MIRROR': 'default'},
+    )
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['littlelemonAPI.routers.ReplicaRouter']
+# Seconds a client's reads stay on the primary after it writes
+REPLICA_PIN_SECONDS = 5
+# Seconds a response read from a replica stays in the menu cache
+REPLICA_CACHE_TIMEOUT = 5
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered menu responses, invalidated by the menu version (see cache.py)
+    'menu': {
+        'BACKEND': 'littlelemonAPI.cache.LRULocMemCache',
+        'LOCATION': 'menu',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+}
+MENU_CACHE_ALIAS = 'menu'
+# Version of the cached menu responses, shared by every worker process on
+# the host (see littlelemonAPI/cache.py)
+MENU_VERSION_FILE = BASE_DIR / 'menu.version'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -136,6 +231,16 @@ INTERNAL_IPS = [
     '127.0.0.1'
 ]
 
+# Max SQL queries per API request before QueryBudgetMiddleware logs a warning
+# (raises instead when QUERY_BUDGET_STRICT is on)
+QUERY_BUDGET = 10
+QUERY_BUDGET_STRICT = False
+QUERY_BUDGET_PATHS = ['/api/']
+
+# Request metrics (littlelemonAPI/metrics.py): (route, method) pairs tracked
+# before the rest are counted under route="other"
+METRICS_MAX_ROUTES = 500
+
 # RENDERER
 REST_FRAMEWORK ={
     'DEFAULT_RENDERER_CLASSES': [
@@ -144,6 +249,14 @@ REST_FRAMEWORK ={
         'rest_framework_xml.renderers.XMLRenderer',
         'rest_framework_csv.renderers.CSVRenderer',
         'rest_framework_yaml.renderers.YAMLRenderer',
+        # Accept: application/msgpack
+        'littlelemonAPI.renderers.MessagePackRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'littlelemonAPI.renderers.MessagePackParser',
     ],
     # For built-in classes for filtering, searching and pagination
     'DEFAULT_FILTER_BACKENDS':[
@@ -155,10 +268,11 @@ REST_FRAMEWORK ={
     'PAGE_SIZE': 2,
 
     #Authentication classes
+    # Token and JWT lookups are cached in-process (littlelemonAPI/authentication.py)
     'DEFAULT_AUTHENTICATION_CLASSES':[
-        'rest_framework.authentication.TokenAuthentication',
+        'littlelemonAPI.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication'
+        'littlelemonAPI.authentication.CachedJWTAuthentication'
     ],
     'DEFAULT_THROTTLE_RATES':{
         'anon': '2/minute',
@@ -166,6 +280,31 @@ REST_FRAMEWORK ={
         'ten': '10/minute',
     },
 }
+# Throttle counters shared by every worker process on the host (see
+# littlelemonAPI/throttles.py) - rates come from DEFAULT_THROTTLE_RATES
+THROTTLE_STORE = BASE_DIR / 'throttle.sqlite3'
+
+# Authentication lookup cache: entry lifetime (seconds) and size per process.
+# The lifetime is the revocation window: a token deleted, a user deactivated
+# or a group changed in one worker process is still accepted by the others
+# for up to AUTH_CACHE_TTL seconds (the process making the change drops its
+# entries right away)
+AUTH_CACHE_TTL = 5
+AUTH_CACHE_MAX_ENTRIES = 10000
+
+# In-process category map (littlelemonAPI/categories.py): seconds between
+# checks for category changes made by other processes
+CATEGORY_CHECK_INTERVAL = 5
+
+# Smallest response body (bytes) worth compressing
+COMPRESSION_MIN_SIZE = 1024
+
+# Prebuilt menu files served by /api/snapshot/menu.<format>
+# (`python manage.py build_snapshot`, rebuilt after menu changes)
+SNAPSHOT_DIR = BASE_DIR / 'snapshots'
+# Hyperlinks in the snapshot point here
+SNAPSHOT_BASE_URL = 'http://localhost:8000'
+
 DJOSER = {
     "USER_ID_FIELD": "username",
     #"LOGIN_FIELD": "email" for using email instead
@@ -1,3 +1,10 @@
 from django.contrib import admin
 
+from .models import Category
+
 # Register your models here.
+# Saving a new tax rate reprices the category's items (see signals.py)
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ['title', 'slug', 'tax_rate']
+    list_editable = ['tax_rate']
@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate, pre_migrate
 
 
 class LittlelemonapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'littlelemonAPI'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .db import apply_pragmas
+        connection_created.connect(apply_pragmas, dispatch_uid='sqlite_pragmas')
+        from .search import drop_search_triggers, install_search_triggers
+        pre_migrate.connect(drop_search_triggers, sender=self)
+        post_migrate.connect(install_search_triggers, sender=self)
@@ -0,0 +1,102 @@
+from functools import wraps
+
+from django.core.paginator import InvalidPage
+from django.http import HttpResponse, HttpResponseNotAllowed
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, NotFound, Throttled
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from .authentication import aauthenticate
+from .metrics import timed
+
+# Async (ASGI) counterparts of the read-only @api_view machinery: the
+# request is authenticated and throttled without blocking the event loop,
+# then the view's data is rendered with the negotiated renderer.
+
+
+def get_renderers():
+    # The browsable API renders a form from a sync view instance, so it's
+    # left to the sync endpoints
+    return [renderer() for renderer in api_settings.DEFAULT_RENDERER_CLASSES
+            if not issubclass(renderer, BrowsableAPIRenderer)]
+
+
+async def initialize_request(request, throttle_classes):
+    drf_request = Request(request)
+    drf_request.user, drf_request.auth = await aauthenticate(request)
+    for throttle in (throttle_class() for throttle_class in throttle_classes):
+        if not await throttle.aallow_request(drf_request, None):
+            raise Throttled(throttle.wait())
+    return drf_request
+
+
+def render(request, data, status=200, headers=None):
+    """HttpResponse for data in the format the client asked for. Like DRF's
+    Response it carries accepted_renderer, so the response cache can tell
+    what it holds."""
+    negotiator = DefaultContentNegotiation()
+    renderers = get_renderers()
+    try:
+        renderer, media_type = negotiator.select_renderer(request, renderers)
+    except APIException:
+        renderer, media_type, data, status = renderers[0], renderers[0].media_type, \
+            {'detail': 'Could not satisfy the request Accept header.'}, 406
+    with timed('renderer'):
+        content = renderer.render(data, media_type, {'request': request})
+    content_type = media_type
+    if renderer.charset:
+        content_type = '%s; charset=%s' % (media_type, renderer.charset)
+    response = HttpResponse(content, status=status, content_type=content_type)
+    for header, value in (headers or {}).items():
+        response[header] = value
+    response.accepted_renderer = renderer
+    response.accepted_media_type = media_type
+    return response
+
+
+def async_api_view(throttle_classes=None):
+    """Read-only async equivalent of @api_view() + @throttle_classes(). The
+    view gets a DRF Request and returns data to render (not a Response)."""
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return HttpResponseNotAllowed(['GET', 'HEAD'])
+            drf_request = Request(request)
+            try:
+                drf_request = await initialize_request(
+                    request, api_settings.DEFAULT_THROTTLE_CLASSES if throttle_classes is None else throttle_classes)
+                return render(drf_request, await view_func(drf_request, *args, **kwargs))
+            except Exception as exc:
+                if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+                    # As APIView does with the first authentication class
+                    exc.auth_header = 'Token'
+                # DRF's own handler: 404s, permission and API errors
+                response = exception_handler(exc, {'request': drf_request, 'view': None})
+                if response is None:
+                    raise
+                headers = {header: response[header] for header in ('WWW-Authenticate', 'Retry-After')
+                           if header in response}
+                return render(drf_request, response.data, response.status_code, headers)
+        return wrapper
+    return decorator
+
+
+async def apaginate_queryset(paginator, queryset, request):
+    """PageNumberPagination.paginate_queryset() with the count and the page
+    fetched through the async ORM. The pagination class still builds the
+    response, e.g. paginator.get_paginated_response(data).data."""
+    django_paginator = paginator.django_paginator_class(queryset, paginator.get_page_size(request))
+    # count is a cached_property: filled in here so page() doesn't query
+    django_paginator.count = await queryset.acount()
+    page_number = paginator.get_page_number(request, django_paginator)
+    try:
+        page = django_paginator.page(page_number)
+    except InvalidPage as exc:
+        raise NotFound(paginator.invalid_page_message.format(page_number=page_number, message=str(exc)))
+    page.object_list = [obj async for obj in page.object_list]
+    paginator.page, paginator.request = page, request
+    return page.object_list
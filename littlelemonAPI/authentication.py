@@ -0,0 +1,204 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+# Resolved credentials are kept in-process for a short time. Writes in this
+# process invalidate them right away (see signals.py); other processes see
+# the change once the entry expires - so a revoked token, deactivated user
+# or group change takes up to AUTH_CACHE_TTL seconds to reach every worker.
+# Kept to a few seconds: under load that still saves nearly every lookup.
+AUTH_CACHE_TTL = 5
+AUTH_CACHE_MAX_ENTRIES = 10000
+
+
+class AuthCache:
+    """Bounded, thread-safe LRU cache with a TTL, indexed by user id so
+    every entry for a user can be dropped at once."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, user_id, value = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, user_id, value):
+        ttl = getattr(settings, 'AUTH_CACHE_TTL', AUTH_CACHE_TTL)
+        max_entries = getattr(settings, 'AUTH_CACHE_MAX_ENTRIES', AUTH_CACHE_MAX_ENTRIES)
+        with self._lock:
+            self._remove(key)
+            while len(self._entries) >= max_entries:
+                self._remove(next(iter(self._entries)))
+            self._entries[key] = (time.monotonic() + ttl, user_id, value)
+            self._keys_by_user.setdefault(user_id, set()).add(key)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._keys_by_user.get(entry[1])
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[entry[1]]
+
+
+auth_cache = AuthCache()
+
+
+def user_group_names(user):
+    """Group names of the user, loaded once and cached with the user."""
+    if not hasattr(user, '_group_names'):
+        user._group_names = frozenset(user.groups.values_list('name', flat=True))
+    return user._group_names
+
+
+async def auser_group_names(user):
+    if not hasattr(user, '_group_names'):
+        user._group_names = frozenset([name async for name in user.groups.values_list('name', flat=True)])
+    return user._group_names
+
+
+def cached_user(user):
+    # Every request gets its own copy, so nothing leaks between requests
+    return copy.copy(user)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that remembers token -> user + groups."""
+
+    def authenticate_credentials(self, key):
+        entry = auth_cache.get(('token', key))
+        if entry is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user').get(key=key)
+            except model.DoesNotExist:
+                raise AuthenticationFailed(_('Invalid token.'))
+            user_group_names(token.user)
+            entry = (token.user, token)
+            auth_cache.set(('token', key), token.user_id, entry)
+        return self.check_entry(entry)
+
+    async def aauthenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed(_('Invalid token header.'))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise AuthenticationFailed(_('Invalid token header. Token string should not contain invalid characters.'))
+
+        entry = auth_cache.get(('token', key))
+        if entry is None:
+            model = self.get_model()
+            try:
+                token = await model.objects.select_related('user').aget(key=key)
+            except model.DoesNotExist:
+                raise AuthenticationFailed(_('Invalid token.'))
+            await auser_group_names(token.user)
+            entry = (token.user, token)
+            auth_cache.set(('token', key), token.user_id, entry)
+        return self.check_entry(entry)
+
+    def check_entry(self, entry):
+        user, token = entry
+        if not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return (cached_user(user), token)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that remembers user id -> user + groups."""
+
+    def get_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        user = auth_cache.get(('jwt', user_id))
+        if user is None:
+            user = super().get_user(validated_token)
+            user_group_names(user)
+            auth_cache.set(('jwt', user_id), user.pk, user)
+        elif not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return cached_user(user)
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        # Signature and expiry checks are CPU only
+        validated_token = self.get_validated_token(raw_token)
+
+        user_id = self.get_user_id(validated_token)
+        user = auth_cache.get(('jwt', user_id))
+        if user is None:
+            try:
+                user = await self.user_model.objects.aget(**{jwt_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            await auser_group_names(user)
+            auth_cache.set(('jwt', user_id), user.pk, user)
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return cached_user(user), validated_token
+
+    @staticmethod
+    def get_user_id(validated_token):
+        try:
+            return validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+
+async def aauthenticate(request):
+    """Async counterpart of DEFAULT_AUTHENTICATION_CLASSES for the async
+    views: token, then JWT, then the session. Cached credentials are
+    resolved without leaving the event loop; misses use the async ORM.
+
+    The async views are read-only, so the session path needs no CSRF check.
+    """
+    for authenticator in (CachedTokenAuthentication(), CachedJWTAuthentication()):
+        result = await authenticator.aauthenticate(request)
+        if result is not None:
+            return result
+    user = await request.auser()
+    if user.is_active:
+        return user, None
+    return AnonymousUser(), None
@@ -0,0 +1,33 @@
+from django.conf import settings
+from rest_framework import serializers
+
+from .models import MenuItem
+from .serializers import MenuItemsSerializer
+
+# Most ids accepted by one batch lookup
+MENU_BATCH_MAX_IDS = 100
+
+NOT_FOUND = 'Not found.'
+
+
+def parse_ids(value):
+    """'1,2,3' -> [1, 2, 3], in the client's order (repeats kept)."""
+    max_ids = getattr(settings, 'MENU_BATCH_MAX_IDS', MENU_BATCH_MAX_IDS)
+    if not value:
+        raise serializers.ValidationError({'ids': ['This parameter is required.']})
+    try:
+        ids = [int(pk) for pk in value.split(',')]
+    except ValueError:
+        raise serializers.ValidationError({'ids': ['Expected a comma-separated list of ids.']})
+    if len(ids) > max_ids:
+        raise serializers.ValidationError({'ids': ['Ensure there are no more than %d ids.' % max_ids]})
+    return ids
+
+
+def menu_items_by_id(ids):
+    """Serialized items in the order of ids, with a not-found marker for
+    every id that doesn't exist. One query for the whole batch."""
+    found = MenuItem.objects.for_serializer().in_bulk(set(ids))
+    items = [found[pk] for pk in ids if pk in found]
+    data = iter(MenuItemsSerializer(items, many=True).data)
+    return [next(data) if pk in found else {'id': pk, 'detail': NOT_FOUND} for pk in ids]
@@ -0,0 +1,189 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .cache import bump_menu_version
+from .models import Category, MenuChange, MenuItem
+from .serializers import UNIQUE_MESSAGE, MenuItemsSerializer
+from .signals import batched_menu_writes
+
+# Largest batch accepted by the bulk endpoint
+BULK_MAX_ITEMS = 10000
+BULK_BATCH_SIZE = 500
+# Query budget of a bulk request: the fixed queries (auth, validation,
+# category touch) plus the writes and change log entries of every batch
+BULK_BASE_QUERIES = 20
+BULK_QUERIES_PER_BATCH = 10
+SWAP_MESSAGE = 'Swaps title/price with another item in the batch.'
+
+
+class BulkError(Exception):
+    """Per-item errors, aligned with the request body like DRF's many=True
+    errors (an empty dict for every valid item)."""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def check_batch(data):
+    if not isinstance(data, list):
+        raise serializers.ValidationError({'non_field_errors': ['Expected a list of items.']})
+    max_items = getattr(settings, 'BULK_MAX_ITEMS', BULK_MAX_ITEMS)
+    if len(data) > max_items:
+        raise serializers.ValidationError(
+            {'non_field_errors': ['Ensure this list has no more than %d items.' % max_items]})
+
+
+def bulk_query_budget(data):
+    batches = -(-len(data) // BULK_BATCH_SIZE) if isinstance(data, list) else 0
+    return BULK_BASE_QUERIES + BULK_QUERIES_PER_BATCH * max(batches, 1)
+
+
+def add_error(errors, index, field, message):
+    errors[index].setdefault(field, []).append(message)
+
+
+def validate_items(data, instances=None):
+    """Validates every item, then checks categories and title/price
+    uniqueness for the whole batch with one query each."""
+    child = MenuItemsSerializer()
+    errors = [{} for _ in data]
+    validated = [None] * len(data)
+    for index, item in enumerate(data):
+        child.instance = instances[index] if instances else None
+        try:
+            validated[index] = child.run_validation(item)
+        except serializers.ValidationError as exc:
+            errors[index] = serializers.as_serializer_error(exc)
+
+    valid = [index for index, attrs in enumerate(validated) if attrs is not None]
+
+    category_ids = {validated[index]['category_id'] for index in valid}
+    categories = Category.objects.in_bulk(category_ids)
+    for index in valid:
+        if validated[index]['category_id'] not in categories:
+            add_error(errors, index, 'category_id', 'Invalid category.')
+
+    own_ids = {index: instances[index].pk for index in valid} if instances else {}
+    batch_ids = set(own_ids.values())
+    titles = {validated[index]['title'] for index in valid}
+    taken = {}
+    for pk, title, price in MenuItem.objects.filter(title__in=titles).values_list('id', 'title', 'price'):
+        taken[(title, price)] = pk
+    seen = {}
+    for index in valid:
+        key = (validated[index]['title'], validated[index]['price'])
+        owner = taken.get(key)
+        # Items being updated in this batch may release their old title/price
+        if owner is not None and owner != own_ids.get(index) and owner not in batch_ids:
+            add_error(errors, index, 'non_field_errors', UNIQUE_MESSAGE)
+        elif key in seen:
+            add_error(errors, index, 'non_field_errors', UNIQUE_MESSAGE)
+        seen.setdefault(key, index)
+
+    if any(errors):
+        raise BulkError(errors)
+    return validated, categories
+
+
+def raise_conflicts(exc, data, instances=None):
+    """After an IntegrityError: another request took a title/price since
+    validate_items() ran. Reports it per item the same way, if it was that,
+    else re-raises exc."""
+    validate_items(data, instances)
+    raise exc
+
+
+def bulk_create_items(data):
+    check_batch(data)
+    validated, categories = validate_items(data)
+    items = [MenuItem(**attrs) for attrs in validated]
+    try:
+        with transaction.atomic():
+            MenuItem.objects.bulk_create(items, batch_size=BULK_BATCH_SIZE)
+            # bulk_create() doesn't send post_save
+            transaction.on_commit(bump_menu_version)
+    except IntegrityError as exc:
+        raise_conflicts(exc, data)
+    for item in items:
+        item.category = categories[item.category_id]
+    return items
+
+
+def order_updates(instances, validated):
+    """Splits an update batch into passes. The unique constraint is checked
+    row by row during an UPDATE, so an item taking over the title/price of
+    another item in the batch is written in the pass after that item's.
+    Swaps (cycles) can't be ordered and are reported per item."""
+    holders = {(item.title, item.price): index for index, item in enumerate(instances)}
+    # follower[i]: the item waiting for item i to release its title/price
+    follower = {}
+    for index, attrs in enumerate(validated):
+        holder = holders.get((attrs['title'], attrs['price']))
+        if holder is not None and holder != index:
+            follower[holder] = index
+    waiting = set(follower.values())
+    passes = []
+    ready = [index for index in range(len(instances)) if index not in waiting]
+    while ready:
+        passes.append([instances[index] for index in ready])
+        ready = [follower[index] for index in ready if index in follower]
+    done = {item.pk for batch in passes for item in batch}
+    if len(done) != len(instances):
+        raise BulkError([{} if item.pk in done else {'non_field_errors': [SWAP_MESSAGE]}
+                         for item in instances])
+    return passes
+
+
+def bulk_update_items(data):
+    check_batch(data)
+    ids = [item.get('id') if isinstance(item, dict) else None for item in data]
+    existing = MenuItem.objects.in_bulk([pk for pk in ids if isinstance(pk, int)])
+    missing = [{} if pk in existing else {'id': ['Not found.']} for pk in ids]
+    if any(missing):
+        raise BulkError(missing)
+    if len(set(ids)) != len(ids):
+        raise serializers.ValidationError({'non_field_errors': ['Duplicate ids in the batch.']})
+
+    instances = [existing[pk] for pk in ids]
+    validated, categories = validate_items(data, instances)
+    passes = order_updates(instances, validated)
+    now = timezone.now()
+    for item, attrs in zip(instances, validated):
+        for field, value in attrs.items():
+            setattr(item, field, value)
+        # bulk_update() skips auto_now
+        item.updated_at = now
+    try:
+        with transaction.atomic():
+            for batch in passes:
+                MenuItem.objects.bulk_update(
+                    batch, ['title', 'price', 'inventory', 'category', 'updated_at'], batch_size=BULK_BATCH_SIZE)
+            transaction.on_commit(bump_menu_version)
+    except IntegrityError as exc:
+        raise_conflicts(exc, data, instances)
+    for item in instances:
+        item.category = categories[item.category_id]
+    return instances
+
+
+def bulk_delete_items(ids):
+    check_batch(ids)
+    if not all(isinstance(pk, int) for pk in ids):
+        raise serializers.ValidationError({'non_field_errors': ['Expected a list of ids.']})
+    existing = dict(MenuItem.objects.filter(id__in=ids).values_list('id', 'category_id'))
+    errors = [{} if pk in existing else {'id': ['Not found.']} for pk in ids]
+    if any(errors):
+        raise BulkError(errors)
+    with transaction.atomic():
+        # The per-row post_delete receivers are skipped - what they do
+        # (change log, category touch, version bump) is done here once for
+        # the batch
+        with batched_menu_writes():
+            deleted, _ = MenuItem.objects.filter(id__in=existing).delete()
+        MenuChange.objects.record(MenuChange.ITEM, sorted(existing), MenuChange.DELETE)
+        Category.objects.filter(pk__in=set(existing.values())).update(updated_at=timezone.now())
+        transaction.on_commit(bump_menu_version)
+    return deleted
@@ -0,0 +1,173 @@
+import hashlib
+import os
+import threading
+import uuid
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.dispatch import Signal
+from django.http import HttpResponse
+
+from .metrics import timed
+from .routers import REPLICA_CACHE_TIMEOUT, current_replica
+
+# Cache holding rendered menu responses (see CACHES in settings)
+MENU_CACHE_ALIAS = 'menu'
+
+# Sent by bump_menu_version(), i.e. after any change to the menu
+menu_version_changed = Signal()
+
+# Renderers whose output depends on the user or the CSRF token
+UNCACHED_FORMATS = {'api'}
+
+
+class LRULocMemCache(LocMemCache):
+    """LocMemCache that evicts only the least recently used entry when full,
+    instead of culling a whole fraction of the cache at once."""
+
+    def _cull(self):
+        key, _ = self._cache.popitem()
+        del self._expire_info[key]
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def reset(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def as_dict(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+stats = CacheStats()
+
+
+def get_menu_cache():
+    return caches[getattr(settings, 'MENU_CACHE_ALIAS', MENU_CACHE_ALIAS)]
+
+
+# The menu version lives in a file every worker process on the host reads -
+# the cached responses are per process, but a write in one worker has to
+# invalidate them in all of them
+def get_menu_version_file():
+    return str(getattr(settings, 'MENU_VERSION_FILE', settings.BASE_DIR / 'menu.version'))
+
+
+def write_menu_version(path):
+    # A random version, so no process or restart ever reuses an old one.
+    # Written aside and renamed over the old file, so readers never see a
+    # partly written version
+    version = uuid.uuid4().hex
+    temp = '%s.%s' % (path, version)
+    with open(temp, 'w') as file:
+        file.write(version)
+    os.replace(temp, path)
+    return version
+
+
+def get_menu_version():
+    path = get_menu_version_file()
+    try:
+        with open(path) as file:
+            return file.read()
+    except FileNotFoundError:
+        return write_menu_version(path)
+
+
+def bump_menu_version(**kwargs):
+    """Invalidates every cached menu response, in every process. Run on
+    commit of MenuItem and Category saves and deletes; call it after bulk
+    writes too."""
+    version = write_menu_version(get_menu_version_file())
+    menu_version_changed.send(sender=None, version=version)
+    return version
+
+
+def make_cache_key(request, version):
+    # Path, query params and the Accept header (which picks the renderer)
+    query = '&'.join('%s=%s' % pair for pair in sorted(request.GET.lists()))
+    raw = '%s|%s|%s' % (request.path, query, request.META.get('HTTP_ACCEPT', ''))
+    return 'menu:response:%s:%s' % (version, hashlib.md5(raw.encode()).hexdigest())
+
+
+def is_cacheable(response):
+    if response.status_code != 200 or response.streaming:
+        return False
+    renderer = getattr(response, 'accepted_renderer', None)
+    return getattr(renderer, 'format', None) not in UNCACHED_FORMATS
+
+
+def cached_response(request):
+    """(key, cached response or None) for a GET/HEAD request."""
+    key = make_cache_key(request, get_menu_version())
+    entry = get_menu_cache().get(key)
+    if entry is None:
+        stats.miss()
+        return key, None
+    stats.hit()
+    content, status, headers = entry
+    response = HttpResponse(content, status=status)
+    for header, value in headers:
+        response[header] = value
+    response['X-Cache'] = 'HIT'
+    return key, response
+
+
+def store_response(key, response):
+    if is_cacheable(response):
+        if hasattr(response, 'render'):
+            with timed('renderer'):
+                response.render()
+        entry = (response.content, response.status_code, list(response.items()))
+        if current_replica() is None:
+            get_menu_cache().set(key, entry)
+        else:
+            # The replica may lag behind the version bump
+            get_menu_cache().set(key, entry, getattr(settings, 'REPLICA_CACHE_TIMEOUT', REPLICA_CACHE_TIMEOUT))
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+def cache_menu_response(view_func):
+    """Caches rendered GET responses until the menu version changes.
+
+    Works on sync and async views alike; the menu cache is in-process
+    memory and the version a small local file, so async views use them
+    without a thread hop."""
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await view_func(request, *args, **kwargs)
+            key, response = cached_response(request)
+            if response is not None:
+                return response
+            return store_response(key, await view_func(request, *args, **kwargs))
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view_func(request, *args, **kwargs)
+        key, response = cached_response(request)
+        if response is not None:
+            return response
+        return store_response(key, view_func(request, *args, **kwargs))
+    return wrapper
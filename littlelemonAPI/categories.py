@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .models import Category
+
+# Every category, kept in-process. There are only a handful and they rarely
+# change, but every menu item nests one - with the map in memory menu item
+# queries don't join the category table and category reads don't query it.
+# Writes in this process drop the map right away (see signals.py); writes in
+# other processes - and a map read inside a transaction that then rolled
+# back - are noticed by a version check, run at most every
+# CATEGORY_CHECK_INTERVAL seconds.
+CATEGORY_CHECK_INTERVAL = 5
+
+
+class CategoryMap:
+    """One loaded version of the category table."""
+    __slots__ = ('version', 'by_id', 'ids_by_title', 'categories', 'checked')
+
+    def __init__(self, categories):
+        self.categories = sorted(categories, key=lambda category: category.pk)
+        self.by_id = {category.pk: category for category in self.categories}
+        self.ids_by_title = {category.title: category.pk for category in self.categories}
+        self.version = version_of(self.categories)
+        self.checked = time.monotonic()
+
+    def get(self, pk):
+        return self.by_id.get(pk)
+
+    def id_for_title(self, title):
+        return self.ids_by_title.get(title)
+
+
+def version_of(categories):
+    # Same parts as categories_state (see conditional.py): any save moves
+    # max(updated_at), any delete the count
+    last = max((category.updated_at for category in categories), default=None)
+    max_id = max((category.pk for category in categories), default=None)
+    return (len(categories), last, max_id)
+
+
+def in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class CategoryRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._map = None
+        # Bumped by invalidate(), so a load that raced a write isn't kept
+        self._generation = 0
+
+    def invalidate(self, **kwargs):
+        with self._lock:
+            self._generation += 1
+            self._map = None
+
+    def is_fresh(self, categories):
+        interval = getattr(settings, 'CATEGORY_CHECK_INTERVAL', CATEGORY_CHECK_INTERVAL)
+        return categories is not None and time.monotonic() - categories.checked < interval
+
+    def current(self, verify=False):
+        """The CategoryMap, reloaded if the table changed since it was read."""
+        categories = self._map
+        if not verify and self.is_fresh(categories):
+            return categories
+        if categories is not None and in_event_loop():
+            # Async views call acurrent() first; past that a map a moment
+            # old beats SynchronousOnlyOperation
+            return categories
+        generation = self._generation
+        # From the primary: a lagging replica (see routers.py) would keep
+        # the map behind for every request, not just one
+        if categories is not None:
+            version = Category.objects.using('default').aggregate(
+                count=Count('id'), last=Max('updated_at'), max_id=Max('id'))
+            if (version['count'], version['last'], version['max_id']) == categories.version:
+                categories.checked = time.monotonic()
+                return categories
+        categories = CategoryMap(Category.objects.using('default'))
+        with self._lock:
+            if self._generation == generation:
+                self._map = categories
+        return categories
+
+    async def acurrent(self):
+        categories = self._map
+        if self.is_fresh(categories):
+            return categories
+        return await sync_to_async(self.current)()
+
+    def get(self, pk):
+        """The Category, or None. A miss re-checks the table, in case the
+        category was just created by another process."""
+        category = self.current().get(pk)
+        if category is None:
+            category = self.current(verify=True).get(pk)
+        return category
+
+    async def aget(self, pk):
+        category = (await self.acurrent()).get(pk)
+        if category is None:
+            category = (await sync_to_async(self.current)(verify=True)).get(pk)
+        return category
+
+    def id_for_title(self, title):
+        pk = self.current().id_for_title(title)
+        if pk is None:
+            pk = self.current(verify=True).id_for_title(title)
+        return pk
+
+    def all(self):
+        return self.current().categories
+
+
+category_registry = CategoryRegistry()
@@ -0,0 +1,56 @@
+from django.conf import settings
+from rest_framework import serializers
+
+from .models import Category, MenuChange, MenuItem
+from .serializers import CategorySerializer, MenuItemsSerializer
+
+# Change log entries per feed page
+CHANGES_PAGE_SIZE = 500
+CHANGES_MAX_PAGE_SIZE = 5000
+
+
+def parse_feed_params(params):
+    try:
+        since = int(params.get('since', 0))
+        limit = int(params.get('limit', CHANGES_PAGE_SIZE))
+    except ValueError:
+        raise serializers.ValidationError({'since': ['Expected integers for since and limit.']})
+    if since < 0 or limit < 1:
+        raise serializers.ValidationError({'since': ['since must be >= 0 and limit >= 1.']})
+    return since, min(limit, getattr(settings, 'CHANGES_MAX_PAGE_SIZE', CHANGES_MAX_PAGE_SIZE))
+
+
+def changes_since(since, limit=CHANGES_PAGE_SIZE):
+    """Everything created, updated or deleted after the cursor `since`.
+
+    The log keeps only the latest entry per object, so a page lists each
+    object once: its current representation, or its id under `deleted`.
+    Pass the returned `cursor` as the next `since`; `has_more` says whether
+    to fetch again right away. since=0 returns the whole catalog.
+
+    Cost is O(changes): one indexed range scan of the log plus one query per
+    kind for the changed rows.
+    """
+    entries = list(
+        MenuChange.objects.filter(seq__gt=since).order_by('seq')
+        .values_list('seq', 'kind', 'object_id', 'action')[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    changed = {MenuChange.ITEM: [], MenuChange.CATEGORY: []}
+    deleted = {MenuChange.ITEM: [], MenuChange.CATEGORY: []}
+    for seq, kind, object_id, action in entries:
+        (deleted if action == MenuChange.DELETE else changed)[kind].append(object_id)
+
+    categories = Category.objects.filter(pk__in=changed[MenuChange.CATEGORY]).order_by('id')
+    items = MenuItem.objects.for_serializer().filter(pk__in=changed[MenuChange.ITEM]).order_by('id')
+    return {
+        'cursor': entries[-1][0] if entries else since,
+        'has_more': has_more,
+        'categories': CategorySerializer(categories, many=True).data if changed[MenuChange.CATEGORY] else [],
+        'items': MenuItemsSerializer(items, many=True).data if changed[MenuChange.ITEM] else [],
+        'deleted': {
+            'categories': deleted[MenuChange.CATEGORY],
+            'items': deleted[MenuChange.ITEM],
+        },
+    }
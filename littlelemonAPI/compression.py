@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Responses smaller than this (bytes) are sent uncompressed - for short
+# bodies the CPU time costs more than the bytes saved
+COMPRESSION_MIN_SIZE = 1024
+BROTLI_QUALITY = 5
+
+re_accepts_brotli = _lazy_re_compile(r'\bbr\b')
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Brotli when the client accepts it (and the brotli package is
+    installed), gzip otherwise, for bodies of at least COMPRESSION_MIN_SIZE
+    bytes. Streaming responses (the exports) are always gzipped."""
+
+    def process_response(self, request, response):
+        if not response.streaming:
+            min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', COMPRESSION_MIN_SIZE)
+            if len(response.content) < min_size:
+                return response
+            accepts = request.META.get('HTTP_ACCEPT_ENCODING', '')
+            if brotli is not None and re_accepts_brotli.search(accepts):
+                return self.compress_brotli(response)
+        return super().process_response(request, response)
+
+    def compress_brotli(self, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        # Same as GZipMiddleware: the encoded body needs a weak ETag
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
@@ -0,0 +1,19 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    """connection_created hook: runs the PRAGMAS of the database's
+    DATABASES entry (see DB_PROFILE in settings.py) on every new SQLite
+    connection. Most PRAGMAs are per connection, so they can't be set once
+    in a migration."""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = connection.settings_dict.get('PRAGMAS') or {}
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+    logger.debug('Applied %s to %s', pragmas, connection.alias)
@@ -0,0 +1,170 @@
+from decimal import Decimal, InvalidOperation
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.settings import api_settings
+
+from .categories import category_registry
+from .search import search_menu_items
+
+
+def parse_decimal(value):
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(value)
+    if not number.is_finite():
+        raise ValueError(value)
+    return number
+
+
+class MenuItemQuerySpec:
+    """What clients may filter, search and sort menu items by, and the query
+    each combination turns into.
+
+    Filters and an ordering are only accepted together when one index (see
+    MenuItem.Meta.indexes) serves both - the filters narrow a range of it
+    and the ordering walks it (see combinations) - so no accepted request
+    sorts the table or walks a whole index to find the rows that match.
+    Anything else is a 400 instead of an arbitrary query. A search narrows
+    the rows through the full-text index first, so with ?search= any filter
+    and ordering may be combined: they only apply to the matches.
+    """
+    ordering_query_param = 'ordering'
+    search_query_param = 'search'
+    page_query_param = 'page'
+    page_size_query_param = 'perpage'
+    page_size = 2
+
+    # query param -> (lookup, parser). The category title is looked up in the
+    # category registry, so the filter is on category_id without a join; an
+    # unknown title gives None, i.e. category_id IS NULL - no items
+    filters = {
+        'category': ('category_id', category_registry.id_for_title),
+        'to_price': ('price__lte', parse_decimal),
+        'to_price_after_tax': ('price_after_tax__lte', parse_decimal),
+    }
+    ordering_fields = ['price', 'price_after_tax', 'inventory']
+    search_fields = ['title', 'category__title']
+    # (filter params, ordering fields) that can be used together, one index
+    # each. Without ?ordering= the first field of the first combination that
+    # takes the filters is used; with no filters either, items come in id
+    # order (the primary key)
+    combinations = [
+        # (category, price) and (price, id)
+        ({'category', 'to_price'}, ['price']),
+        # price_after_tax (+ rowid)
+        ({'to_price_after_tax'}, ['price_after_tax']),
+        # (inventory, id) - no filter has it as the leading column
+        (set(), ['inventory']),
+    ]
+    # Keyset pages of search results, which can't be paged by rank
+    default_ordering = 'price'
+
+    def __init__(self):
+        # Stable orderings - id breaks ties so every position is unique, which
+        # page numbers and cursors both rely on
+        self.orderings = {}
+        for field in self.ordering_fields:
+            self.orderings[field] = (field, 'id')
+            self.orderings['-' + field] = ('-' + field, '-id')
+
+    def get_filters(self, params):
+        """{lookup: value} for the filter params present, or a 400."""
+        lookups, errors = {}, {}
+        for param, (lookup, parse) in self.filters.items():
+            value = params.get(param)
+            if not value:
+                continue
+            try:
+                lookups[lookup] = parse(value)
+            except ValueError:
+                errors[param] = 'A valid number is required.'
+        if errors:
+            raise ValidationError(errors)
+        return lookups
+
+    def get_page(self, params):
+        """(page number, page size) from the params, or a 400."""
+        numbers, errors = {}, {}
+        for param, default in [(self.page_query_param, 1), (self.page_size_query_param, self.page_size)]:
+            try:
+                numbers[param] = int(params.get(param, default))
+            except (TypeError, ValueError):
+                errors[param] = 'A valid integer is required.'
+                continue
+            if numbers[param] < 1:
+                errors[param] = 'Ensure this value is greater than or equal to 1.'
+        if errors:
+            raise ValidationError(errors)
+        return numbers[self.page_query_param], numbers[self.page_size_query_param]
+
+    def get_ordering(self, params):
+        """The requested ordering (a key of orderings) or None."""
+        ordering = params.get(self.ordering_query_param)
+        if not ordering:
+            return None
+        ordering = ordering.strip()
+        if ordering not in self.orderings:
+            # Includes multi-field sorts: past the first field the index no
+            # longer gives the order
+            raise ValidationError({
+                self.ordering_query_param: 'Order by one of: %s' % ', '.join(self.orderings)})
+        return ordering
+
+    def resolve_ordering(self, params):
+        """The ordering to use for these params (a key of orderings), or None
+        to keep the search rank order - or the id order when nothing is
+        filtered. A 400 if the filters and the ordering can't be served by
+        one index."""
+        ordering = self.get_ordering(params)
+        if params.get(self.search_query_param):
+            return ordering
+        used = {param for param in self.filters if params.get(param)}
+        if not used:
+            return ordering
+        for filters, fields in self.combinations:
+            if not used <= filters:
+                continue
+            if ordering is None:
+                return fields[0]
+            if ordering.lstrip('-') in fields:
+                return ordering
+        if ordering is None:
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: "Filtering by %s together isn't supported."
+                % ', '.join(sorted(used))})
+        raise ValidationError({
+            self.ordering_query_param: "Ordering by %s can't be combined with filtering by %s."
+            % (ordering.lstrip('-'), ', '.join(sorted(used)))})
+
+    def filter_queryset(self, queryset, params, search_fields=None):
+        queryset = queryset.filter(**self.get_filters(params))
+        search = params.get(self.search_query_param)
+        if search:
+            # Ranked by relevance unless an ordering is given
+            queryset = search_menu_items(queryset, search, fields=search_fields or self.search_fields)
+        return queryset
+
+    def order_queryset(self, queryset, params):
+        ordering = self.resolve_ordering(params)
+        if ordering is not None:
+            return queryset.order_by(*self.orderings[ordering])
+        if params.get(self.search_query_param):
+            return queryset
+        return queryset.order_by('id')
+
+
+menu_item_query = MenuItemQuerySpec()
+
+
+class MenuItemOrderingFilter(OrderingFilter):
+    """OrderingFilter limited to menu_item_query's orderings: an id
+    tie-breaker is added and unknown fields are a 400 rather than being
+    silently dropped."""
+
+    def get_ordering(self, request, queryset, view):
+        ordering = menu_item_query.get_ordering(request.query_params)
+        if ordering is None:
+            return self.get_default_ordering(view)
+        return list(menu_item_query.orderings[ordering])
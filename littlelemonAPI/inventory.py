@@ -0,0 +1,81 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import bump_menu_version
+from .models import MenuChange, MenuItem
+
+# Upper bound of MenuItem.inventory (SmallIntegerField)
+MAX_INVENTORY = 32767
+
+
+class InsufficientStock(Exception):
+    def __init__(self, item_id, requested, available):
+        super().__init__('Item %s has %s in stock, %s requested' % (item_id, available, requested))
+        self.item_id = item_id
+        self.requested = requested
+        self.available = available
+
+
+class StockLimitExceeded(InsufficientStock):
+    pass
+
+
+def change_stock(item_id, delta):
+    """Adds delta (negative to reserve) to an item's inventory.
+
+    A single conditional UPDATE does the check and the write, so concurrent
+    callers can never oversell or lose an update, and no row is locked
+    while the application decides.
+    """
+    items = MenuItem.objects.filter(pk=item_id)
+    if delta < 0:
+        guarded = items.filter(inventory__gte=-delta)
+    else:
+        guarded = items.filter(inventory__lte=MAX_INVENTORY - delta)
+    if guarded.update(inventory=F('inventory') + delta, updated_at=timezone.now()):
+        return
+    available = items.values_list('inventory', flat=True).first()
+    if available is None:
+        raise MenuItem.DoesNotExist('No MenuItem matches the given query.')
+    if delta < 0:
+        raise InsufficientStock(item_id, -delta, available)
+    raise StockLimitExceeded(item_id, delta, available)
+
+
+def change_stock_many(changes):
+    """Applies {item_id: delta} all-or-nothing and returns {item_id: stock}."""
+    with transaction.atomic():
+        # Same order in every transaction so concurrent batches can't deadlock
+        for item_id in sorted(changes):
+            change_stock(item_id, changes[item_id])
+        stock = dict(MenuItem.objects.filter(pk__in=changes).values_list('id', 'inventory'))
+        # Queryset updates don't send post_save
+        MenuChange.objects.record(MenuChange.ITEM, sorted(changes))
+        transaction.on_commit(bump_menu_version)
+    return stock
+
+
+def reserve(item_id, quantity):
+    return change_stock_many({item_id: -quantity})[item_id]
+
+
+def release(item_id, quantity):
+    return change_stock_many({item_id: quantity})[item_id]
+
+
+def reserve_many(items):
+    """items: iterable of (item_id, quantity); repeated ids are summed."""
+    totals = Counter()
+    for item_id, quantity in items:
+        totals[item_id] -= quantity
+    return change_stock_many(totals)
+
+
+def release_many(items):
+    totals = Counter()
+    for item_id, quantity in items:
+        totals[item_id] += quantity
+    return change_stock_many(totals)
@@ -0,0 +1,359 @@
+import itertools
+import json
+import re
+import resource
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import resolve
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from littlelemonAPI import urls
+from littlelemonAPI.authentication import auth_cache
+from littlelemonAPI.cache import get_menu_cache
+from littlelemonAPI.models import Category, MenuItem
+from littlelemonAPI.querybudget import QueryCounter
+
+# Catalog sizes: MenuItem rows, spread over rows // 1000 categories (at least 10)
+SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+SEED_BATCH_SIZE = 5000
+PASSWORD = 'bench-pass-123'
+
+BASELINE_DIR = Path(__file__).resolve().parents[2] / 'benchmarks'
+# Relative change that counts as a regression, and noise floors below which
+# differences are ignored. Timings are compared on the median: p99 of a few
+# dozen requests on a shared machine is mostly noise
+TOLERANCE = 0.5
+LATENCY_FLOOR = 0.002
+MEMORY_FLOOR = 64
+
+
+class Route:
+    """One benchmarked request. path and data may be callables taking the
+    seeded ids, for requests that must differ (e.g. unique titles)."""
+
+    def __init__(self, name, path, method='GET', auth=None, accept=None, data=None, ok=(200,)):
+        self.name, self.path, self.method = name, path, method
+        self.auth, self.accept, self.data, self.ok = auth, accept, data, ok
+
+    def resolve(self, value, ids):
+        return value(ids) if callable(value) else value
+
+
+_unique = itertools.count()
+
+
+def unique(prefix):
+    return '%s %d' % (prefix, next(_unique))
+
+
+def new_item(ids):
+    return {'title': unique('Bench item'), 'price': '5.00', 'stock': 5, 'category_id': ids['category']}
+
+
+def created_ok(*extra):
+    return (200, 201) + extra
+
+
+ROUTES = [
+    # Renderers of the generic list view
+    Route('menu-items json', 'menu-items', accept='application/json'),
+    Route('menu-items xml', 'menu-items', accept='application/xml'),
+    Route('menu-items csv', 'menu-items', accept='text/csv'),
+    Route('menu-items yaml', 'menu-items', accept='application/yaml'),
+    Route('menu-items msgpack', 'menu-items', accept='application/msgpack'),
+    Route('menu-items html', 'menu-items', accept='text/html'),
+    Route('menu-items keyset', 'menu-items?pagination=keyset&ordering=-price'),
+    Route('menu-items create', 'menu-items', 'POST', data=new_item, ok=created_ok()),
+    Route('menu-items/<pk>', 'menu-items/{item}'),
+    # Rewrites the first seeded item with its own values
+    Route('menu-items/<pk> update', 'menu-items/{item}', 'PUT',
+          data=lambda ids: {'title': 'Item 0', 'price': '2.50', 'stock': 10000, 'category_id': ids['category']}),
+    Route('menu-items/bulk', 'menu-items/bulk', 'POST', auth='admin',
+          data=lambda ids: [new_item(ids) for _ in range(10)], ok=created_ok()),
+    Route('menu-items/<pk>/reserve', 'menu-items/{item}/reserve', 'POST', auth='token', data={'quantity': 1}),
+    Route('menu-items/<pk>/release', 'menu-items/{item}/release', 'POST', auth='token', data={'quantity': 1}),
+    Route('menu-items/reserve', 'menu-items/reserve', 'POST', auth='token',
+          data=lambda ids: {'items': [{'id': ids['item'], 'quantity': 1}]}),
+    Route('menu-items/release', 'menu-items/release', 'POST', auth='token',
+          data=lambda ids: {'items': [{'id': ids['item'], 'quantity': 1}]}),
+    Route('menu', 'menu'),
+    Route('menu/<id>', 'menu/{item}'),
+    Route('menu/batch', lambda ids: 'menu/batch?ids=%s' % ','.join(map(str, ids['items'][:50]))),
+    Route('menu/changes', 'menu/changes'),
+    Route('categories', 'categories'),
+    Route('categories create', 'categories', 'POST',
+          data=lambda ids: {'slug': 'bench-%d' % next(_unique), 'title': unique('Bench category')},
+          ok=created_ok()),
+    Route('category/<pk>', 'category/{category}'),
+    Route('menu-items-des', 'menu-items-des/?ordering=price&perpage=20&page=3'),
+    Route('menu-items-des create', 'menu-items-des/', 'POST', data=new_item, ok=created_ok()),
+    Route('menuhtml', 'menuhtml', accept='text/html'),
+    Route('welcome', 'welcome'),
+    Route('menu-items-csv', 'menu-items-csv'),
+    Route('menu-items-yaml', 'menu-items-yaml'),
+    Route('menu-items-csv-stream', 'menu-items-csv-stream'),
+    Route('menu-items-yaml-stream', 'menu-items-yaml-stream'),
+    Route('snapshot json', 'snapshot/menu.json'),
+    Route('snapshot csv gzip', 'snapshot/menu.csv'),
+    Route('async/menu', 'async/menu'),
+    Route('async/menu/<id>', 'async/menu/{item}'),
+    Route('async/menu-items', 'async/menu-items'),
+    Route('async/categories', 'async/categories'),
+    Route('async/category/<pk>', 'async/category/{category}'),
+    Route('async/throttle-check', 'async/throttle-check', ok=(200, 429)),
+    Route('metrics', 'metrics', auth='admin'),
+    Route('menu-items-view search', 'menu-items-view?search=item&ordering=price'),
+    Route('menu-items-view/<pk>', 'menu-items-view/{item}'),
+    # Authenticated and throttled paths
+    Route('secret token', 'secret/', auth='token'),
+    Route('secret jwt', 'secret/', auth='jwt'),
+    Route('api-token-auth', 'api-token-auth/', 'POST',
+          data={'username': 'bench-manager', 'password': PASSWORD}),
+    Route('manager-view', 'manager-view/', auth='token'),
+    Route('throttle-check', 'throttle-check', ok=(200, 429)),
+    Route('throttle-check-auth', 'throttle-check-auth', auth='token', ok=(200, 429)),
+    Route('menu-items-throttle', 'menu-items-throttle'),
+    Route('menu-items-throttle/<pk>', 'menu-items-throttle/{item}'),
+    Route('groups/manager/users', 'groups/manager/users', 'POST', auth='admin',
+          data={'username': 'bench-manager'}),
+]
+
+
+class Command(BaseCommand):
+    help = ('Drives every route in littlelemonAPI/urls.py with a concurrent '
+            'in-process client against a seeded scratch database, and reports '
+            'p50/p99 latency, requests/s, SQL queries per request and peak '
+            'memory per request. Compares with a stored baseline to flag '
+            'regressions. Concurrent writes need the production database '
+            'profile (LITTLELEMON_DB_PROFILE=production) to run without '
+            '"database is locked" errors.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=SIZES, default='1k', help='Catalog size')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per route')
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent client threads')
+        parser.add_argument('--routes', help='Only routes whose name matches this regex')
+        parser.add_argument('--warm', action='store_true',
+                            help='Let the menu response cache answer repeated GETs')
+        parser.add_argument('--baseline', help='Baseline file (default: benchmarks/baseline-<size>.json)')
+        parser.add_argument('--save-baseline', action='store_true', help='Store these results as the baseline')
+        parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+
+    def handle(self, *args, **options):
+        routes = [route for route in ROUTES if not options['routes'] or re.search(options['routes'], route.name)]
+
+        setup_test_environment(debug=False)
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with tempfile.TemporaryDirectory() as directory, override_settings(
+                    THROTTLE_STORE=Path(directory) / 'throttle.sqlite3',
+                    SNAPSHOT_DIR=directory, SNAPSHOT_BASE_URL='http://testserver'):
+                ids = self.seed(SIZES[options['size']])
+                if any(route.name.startswith('snapshot') for route in routes):
+                    started = time.perf_counter()
+                    call_command('build_snapshot', stdout=StringIO())
+                    self.stdout.write('Built the snapshot in %.1fs' % (time.perf_counter() - started))
+                if not options['routes']:
+                    self.check_coverage(ids)
+                results = self.run(routes, ids, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        baseline_path = Path(options['baseline'] or BASELINE_DIR / ('baseline-%s.json' % options['size']))
+        if options['save_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(
+                {'size': options['size'], 'db_profile': settings.DB_PROFILE, 'requests': options['requests'],
+                 'workers': options['workers'], 'routes': results},
+                indent=2, sort_keys=True) + '\n')
+            self.stdout.write('Baseline written to %s' % baseline_path)
+        elif baseline_path.exists():
+            baseline = json.loads(baseline_path.read_text())
+            if baseline.get('db_profile') != settings.DB_PROFILE:
+                # Write errors and latencies differ a lot between the profiles
+                self.stderr.write('The baseline was recorded with the %s database profile, this run used %s '
+                                  '(LITTLELEMON_DB_PROFILE)' % (baseline.get('db_profile'), settings.DB_PROFILE))
+            settings_changed = [
+                '--%s %s (baseline %s)' % (name, options[name], baseline.get(name))
+                for name in ('requests', 'workers') if baseline.get(name) != options[name]]
+            if settings_changed:
+                # Throughput, queries per request and errors all depend on them
+                self.stderr.write('Not compared with %s, the run settings differ: %s' % (
+                    baseline_path, ', '.join(settings_changed)))
+                return
+            regressions = self.compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('%d regression(s) against %s' % (len(regressions), baseline_path))
+            self.stdout.write('No regressions against %s' % baseline_path)
+
+    def check_coverage(self, ids):
+        # Every URL pattern of the app needs at least one benchmarked route
+        benchmarked = {resolve(self.path(route, ids)).route for route in ROUTES}
+        missing = sorted({'api/%s' % pattern.pattern for pattern in urls.urlpatterns} - benchmarked)
+        if missing:
+            self.stderr.write('Routes without a benchmark: %s' % ', '.join(missing))
+
+    def path(self, route, ids):
+        return '/api/' + route.resolve(route.path, ids).format(**ids).split('?')[0]
+
+    def seed(self, rows):
+        started = time.perf_counter()
+        category_count = max(10, rows // 1000)
+        categories = Category.objects.bulk_create(
+            [Category(slug='category-%d' % i, title='Category %d' % i) for i in range(category_count)])
+        for start in range(0, rows, SEED_BATCH_SIZE):
+            with transaction.atomic():
+                MenuItem.objects.bulk_create([
+                    MenuItem(title='Item %d' % i, price=Decimal('2.50') + i % 97,
+                             inventory=10000, category=categories[i % category_count])
+                    for i in range(start, min(rows, start + SEED_BATCH_SIZE))
+                ], batch_size=500)
+            if rows > SEED_BATCH_SIZE:
+                self.stdout.write('\rSeeded %d/%d rows' % (min(rows, start + SEED_BATCH_SIZE), rows), ending='')
+        if rows > SEED_BATCH_SIZE:
+            self.stdout.write('')
+
+        manager = User.objects.create_user('bench-manager', password=PASSWORD)
+        Group.objects.get_or_create(name='Manager')[0].user_set.add(manager)
+        admin = User.objects.create_superuser('bench-admin', password=PASSWORD)
+        self.stdout.write('Seeded %d items in %d categories in %.1fs' % (
+            rows, category_count, time.perf_counter() - started))
+
+        items = list(MenuItem.objects.order_by('id').values_list('id', flat=True)[:100])
+        return {
+            'item': items[0], 'items': items, 'category': categories[0].pk,
+            'auth': {
+                'token': 'Token %s' % Token.objects.create(user=manager).key,
+                'admin': 'Token %s' % Token.objects.create(user=admin).key,
+                'jwt': 'Bearer %s' % RefreshToken.for_user(manager).access_token,
+            },
+        }
+
+    def run(self, routes, ids, options):
+        self.stdout.write('%-28s %8s %8s %8s %8s %9s %7s' % (
+            'route', 'req/s', 'p50 ms', 'p99 ms', 'queries', 'peak KiB', 'errors'))
+        results = {}
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        for route in routes:
+            get_menu_cache().clear()
+            auth_cache.clear()
+            # One sequential request as warm-up (imports, caches), then one
+            # traced for its peak memory
+            client = self.client()
+            self.request(client, route, ids, 0, options)
+            tracemalloc.start()
+            self.request(client, route, ids, options['requests'] + 1, options)
+            peak = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+
+            local = threading.local()
+
+            def start_worker():
+                # Opened before anything is counted - the connection_created
+                # PRAGMAs (see db.py) aren't part of any request
+                connection.ensure_connection()
+                local.client = self.client()
+
+            def send(n):
+                return self.request(local.client, route, ids, n, options)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(options['workers'], initializer=start_worker) as pool:
+                samples = list(pool.map(send, range(1, options['requests'] + 1)))
+            elapsed = time.perf_counter() - started
+            connection.close()
+
+            latencies = [latency for latency, _, _ in samples]
+            percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+            result = {
+                'rps': round(len(samples) / elapsed, 1),
+                'p50': round(percentiles[49], 5),
+                'p99': round(percentiles[98], 5),
+                'queries': round(statistics.mean(queries for _, queries, _ in samples), 2),
+                'peak_kib': peak,
+                'errors': sum(1 for _, _, ok in samples if not ok),
+            }
+            results[route.name] = result
+            self.stdout.write('%-28s %8.1f %8.1f %8.1f %8.1f %9d %7d' % (
+                route.name, result['rps'], result['p50'] * 1000, result['p99'] * 1000,
+                result['queries'], result['peak_kib'], result['errors']))
+        self.stdout.write('Process peak RSS grew by %d KiB' % (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before))
+        return results
+
+    @staticmethod
+    def client():
+        # Server errors count as failed requests instead of stopping the run
+        return Client(raise_request_exception=False)
+
+    def request(self, client, route, ids, n, options):
+        path = '/api/' + route.resolve(route.path, ids).format(**ids)
+        if route.method == 'GET' and not options['warm']:
+            # A unique query string misses the response cache
+            path += ('&' if '?' in path else '?') + '_=%d' % n
+        extra = {}
+        if route.auth:
+            extra['HTTP_AUTHORIZATION'] = ids['auth'][route.auth]
+        if route.accept:
+            extra['HTTP_ACCEPT'] = route.accept
+        data = route.resolve(route.data, ids)
+
+        started = time.perf_counter()
+        with QueryCounter() as counter:
+            if data is None:
+                response = client.generic(route.method, path, **extra)
+            else:
+                response = client.generic(route.method, path, json.dumps(data),
+                                          content_type='application/json', **extra)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+                response.close()
+        latency = time.perf_counter() - started
+        return latency, counter.count, response.status_code in route.ok
+
+    def compare(self, results, baseline, tolerance):
+        regressions = []
+        for name, result in results.items():
+            base = baseline['routes'].get(name)
+            if base is None:
+                continue
+            checks = [
+                ('p50', result['p50'] > base['p50'] * (1 + tolerance)
+                 and result['p50'] - base['p50'] > LATENCY_FLOOR),
+                ('req/s', result['rps'] < base['rps'] * (1 - tolerance)
+                 and base['p50'] > LATENCY_FLOOR),
+                ('queries', result['queries'] > base['queries'] + 0.5),
+                ('peak memory', result['peak_kib'] > base['peak_kib'] * (1 + tolerance)
+                 and result['peak_kib'] - base['peak_kib'] > MEMORY_FLOOR),
+                ('errors', result['errors'] > base['errors']),
+            ]
+            for metric, regressed in checks:
+                if regressed:
+                    regressions.append((name, metric))
+                    self.stdout.write('REGRESSION %-28s %s (baseline %s, now %s)' % (
+                        name, metric, self.metric(base, metric), self.metric(result, metric)))
+        return regressions
+
+    @staticmethod
+    def metric(result, name):
+        key = {'req/s': 'rps', 'peak memory': 'peak_kib'}.get(name, name)
+        return result[key]
@@ -0,0 +1,103 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from littlelemonAPI.models import Category, MenuItem
+
+# (sync route, async route) - the same data from both
+ROUTES = [
+    ('/api/menu', '/api/async/menu'),
+    ('/api/menu/{item}', '/api/async/menu/{item}'),
+    ('/api/menu-items', '/api/async/menu-items'),
+    ('/api/categories', '/api/async/categories'),
+    ('/api/category/{category}', '/api/async/category/{category}'),
+]
+
+
+class Command(BaseCommand):
+    help = ('Concurrency of the sync views behind the WSGI handler (a thread '
+            'per request) vs the async views behind the ASGI handler (one event '
+            'loop), run in-process against a scratch test database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=500, help='Requests per route and handler')
+        parser.add_argument('--workers', type=int, default=8, help='WSGI threads')
+        parser.add_argument('--concurrency', type=int, default=64, help='ASGI requests in flight')
+        parser.add_argument('--cache', action='store_true',
+                            help='Let the menu response cache answer repeated requests')
+
+    def handle(self, *args, **options):
+        # DEBUG off as in production: no query log, no debug toolbar
+        setup_test_environment(debug=False)
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            ids = self.seed(options['rows'])
+            self.stdout.write('%-28s %-5s %9s %9s %9s' % ('route', 'mode', 'req/s', 'p50 ms', 'p99 ms'))
+            for sync_url, async_url in ROUTES:
+                sync_url, async_url = sync_url.format(**ids), async_url.format(**ids)
+                self.report(sync_url, 'wsgi', self.run_wsgi(sync_url, options))
+                self.report(async_url, 'asgi', asyncio.run(self.run_asgi(async_url, options)))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        self.stdout.write(
+            'Both handlers run in this process. The async ORM still runs each '
+            'query through sync_to_async on one database thread, so the ASGI '
+            'numbers show the cost of the event loop more than that of a '
+            'network database.')
+
+    def seed(self, rows):
+        category = Category.objects.create(slug='bench', title='Bench')
+        Category.objects.bulk_create(
+            [Category(slug='bench-%d' % i, title='Bench %d' % i) for i in range(10)])
+        MenuItem.objects.bulk_create(
+            [MenuItem(title='Item %d' % i, price=i % 50 + 1, inventory=100, category=category)
+             for i in range(rows)], batch_size=500)
+        return {'item': MenuItem.objects.values_list('id', flat=True).first(), 'category': category.pk}
+
+    def urls(self, url, options):
+        # A unique query string per request misses the response cache
+        for n in range(options['requests']):
+            yield url if options['cache'] else '%s?_=%d' % (url, n)
+
+    def run_wsgi(self, url, options):
+        def get(path):
+            started = time.perf_counter()
+            response = Client().get(path, HTTP_ACCEPT='application/json')
+            assert response.status_code == 200, (path, response.status_code)
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['workers']) as pool:
+            latencies = list(pool.map(get, self.urls(url, options)))
+        connection.close()
+        return latencies, time.perf_counter() - started
+
+    async def run_asgi(self, url, options):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def get(path):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(path, headers={'accept': 'application/json'})
+                assert response.status_code == 200, (path, response.status_code)
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(get(path) for path in self.urls(url, options)))
+        return latencies, time.perf_counter() - started
+
+    def report(self, url, mode, result):
+        latencies, elapsed = result
+        percentiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write('%-28s %-5s %9.0f %9.1f %9.1f' % (
+            url, mode, len(latencies) / elapsed, percentiles[49] * 1000, percentiles[98] * 1000))
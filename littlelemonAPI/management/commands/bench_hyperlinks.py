@@ -0,0 +1,64 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework import serializers
+from rest_framework.request import Request
+
+from littlelemonAPI.models import Category, MenuItem
+from littlelemonAPI.serializers import MenuHyperItemsSerializer
+from littlelemonAPI.tax import DEFAULT_TAX_RATE, price_after_tax
+
+
+# The serializer as it was: reverse() + build_absolute_uri() for every row
+class ReverseEveryRowSerializer(MenuHyperItemsSerializer):
+    serializer_related_field = serializers.HyperlinkedRelatedField
+
+
+class Command(BaseCommand):
+    help = ('Time to serialize a MenuHyperItemsSerializer list with the '
+            'category links reversed once per request vs once per row. The '
+            'output of both must be identical.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Runs per serializer; the best time is reported')
+
+    def handle(self, *args, **options):
+        items = self.make_items(options['rows'])
+        # As the views get it - a DRF request; localhost passes ALLOWED_HOSTS
+        request = Request(RequestFactory().get('/api/menu-items', HTTP_HOST='localhost:8000'))
+        results = {}
+        self.stdout.write('%d rows' % options['rows'])
+        self.stdout.write('%-16s %10s' % ('category links', 'ms'))
+        for name, serializer_class in [('reverse per row', ReverseEveryRowSerializer),
+                                       ('cached', MenuHyperItemsSerializer)]:
+            best = None
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                data = serializer_class(items, many=True, context={'request': request}).data
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = (data, best)
+            self.stdout.write('%-16s %10.1f' % (name, best * 1000))
+        (expected, slow), (data, fast) = results['reverse per row'], results['cached']
+        if data != expected:
+            raise CommandError('The cached links differ from reverse()')
+        self.stdout.write('%.1fx faster, identical output' % (slow / fast))
+
+    def make_items(self, rows):
+        # Unsaved instances - the benchmark needs no database
+        categories = [
+            Category(id=1, slug='food', title='Food'),
+            Category(id=2, slug='drinks', title='Drinks'),
+        ]
+        items = []
+        for i in range(1, rows + 1):
+            price = Decimal('2.50') + i % 40
+            items.append(MenuItem(
+                id=i, title='Menu item %d' % i, price=price,
+                price_after_tax=price_after_tax(price, DEFAULT_TAX_RATE),
+                inventory=i % 200, category=categories[i % 2]))
+        return items
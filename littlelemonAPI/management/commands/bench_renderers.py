@@ -0,0 +1,57 @@
+import gzip
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework.settings import api_settings
+
+from littlelemonAPI.compression import BROTLI_QUALITY, brotli
+from littlelemonAPI.models import Category, MenuItem
+from littlelemonAPI.serializers import MenuItemsSerializer
+from littlelemonAPI.tax import DEFAULT_TAX_RATE, price_after_tax
+
+
+class Command(BaseCommand):
+    help = ('Payload size and encode time of every configured renderer for a '
+            'MenuItemsSerializer list, raw and compressed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Renders per renderer; the best time is reported')
+
+    def handle(self, *args, **options):
+        data = MenuItemsSerializer(self.make_items(options['rows']), many=True).data
+        self.stdout.write('%d rows' % options['rows'])
+        self.stdout.write('%-10s %10s %10s %10s %10s' % ('format', 'bytes', 'gzip', 'brotli', 'encode ms'))
+        for renderer_class in api_settings.DEFAULT_RENDERER_CLASSES:
+            renderer = renderer_class()
+            # The browsable API is an HTML page around the JSON output
+            if renderer.format == 'api':
+                continue
+            best = None
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                content = renderer.render(data, renderer.media_type, {})
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            if isinstance(content, str):
+                content = content.encode()
+            brotli_size = len(brotli.compress(content, quality=BROTLI_QUALITY)) if brotli else '-'
+            self.stdout.write('%-10s %10d %10d %10s %10.1f' % (
+                renderer.format, len(content), len(gzip.compress(content, 6)), brotli_size, best * 1000))
+
+    def make_items(self, rows):
+        # Unsaved instances - the benchmark needs no database
+        categories = [
+            Category(id=1, slug='food', title='Food'),
+            Category(id=2, slug='drinks', title='Drinks'),
+        ]
+        items = []
+        for i in range(1, rows + 1):
+            price = Decimal('2.50') + i % 40
+            items.append(MenuItem(
+                id=i, title='Menu item %d' % i, price=price,
+                price_after_tax=price_after_tax(price, DEFAULT_TAX_RATE),
+                inventory=i % 200, category=categories[i % 2]))
+        return items
@@ -0,0 +1,100 @@
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+
+from littlelemonAPI.models import Category, MenuItem
+
+
+class Command(BaseCommand):
+    help = ('Mixed read/write throughput of the development SQLite settings '
+            'vs the production profile (settings.SQLITE_PRODUCTION).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--write-ratio', type=float, default=0.2,
+                            help='Share of operations that are read-then-write transactions')
+
+    def handle(self, *args, **options):
+        profiles = {
+            'development': {},
+            'production': settings.SQLITE_PRODUCTION,
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            for name, overrides in profiles.items():
+                alias = 'bench_%s' % name
+                self.add_database(alias, Path(directory) / ('%s.sqlite3' % name), overrides)
+                try:
+                    self.seed(alias, options['rows'])
+                    result = self.run(alias, options)
+                finally:
+                    connections[alias].close()
+                self.stdout.write(
+                    '%-12s %8.0f ops/s  reads %6d  writes %6d  locked errors %5d' % (
+                        name, result['ops'] / result['elapsed'], result['reads'],
+                        result['writes'], result['errors']))
+
+    def add_database(self, alias, path, overrides):
+        database = dict(settings.DATABASES['default'], NAME=str(path))
+        database.pop('TEST', None)
+        database.update(overrides)
+        connections.settings[alias] = connections.configure_settings(
+            {'default': settings.DATABASES['default'], alias: database})[alias]
+
+    def seed(self, alias, rows):
+        call_command('migrate', database=alias, verbosity=0)
+        category = Category.objects.using(alias).create(slug='bench', title='Bench')
+        MenuItem.objects.using(alias).bulk_create(
+            [MenuItem(title='Item %d' % i, price=i % 50 + 1, inventory=1000, category=category)
+             for i in range(rows)], batch_size=500)
+
+    def run(self, alias, options):
+        ids = list(MenuItem.objects.using(alias).values_list('id', flat=True))
+        deadline = time.monotonic() + options['seconds']
+        totals = {'reads': 0, 'writes': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def worker():
+            counts = {'reads': 0, 'writes': 0, 'errors': 0}
+            connection = connections[alias]
+            while time.monotonic() < deadline:
+                # Request boundary: what request_started/finished do
+                connection.close_if_unusable_or_obsolete()
+                try:
+                    if random.random() < options['write_ratio']:
+                        # Read-then-write: with a DEFERRED transaction two of
+                        # these can't both upgrade to the write lock
+                        with transaction.atomic(using=alias):
+                            item = MenuItem.objects.using(alias).get(pk=random.choice(ids))
+                            item.inventory = (item.inventory + 1) % 30000
+                            item.save(using=alias, update_fields=['inventory', 'updated_at'])
+                        counts['writes'] += 1
+                    else:
+                        start = random.randint(0, len(ids) - 50)
+                        list(MenuItem.objects.using(alias).for_serializer()
+                             .filter(id__in=ids[start:start + 50]))
+                        counts['reads'] += 1
+                except OperationalError:
+                    counts['errors'] += 1
+            connection.close()
+            with lock:
+                for key, value in counts.items():
+                    totals[key] += value
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        totals['elapsed'] = time.monotonic() - started
+        totals['ops'] = totals['reads'] + totals['writes']
+        return totals
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from littlelemonAPI.snapshot import build_snapshot, get_snapshot_dir
+
+
+class Command(BaseCommand):
+    help = 'Renders the menu in every snapshot format to SNAPSHOT_DIR.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Output directory (default: settings.SNAPSHOT_DIR)')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or get_snapshot_dir()
+        manifest = build_snapshot(directory)
+        for fmt, entry in manifest['formats'].items():
+            self.stdout.write('%-8s %s' % (fmt, entry['files']['identity']))
+        self.stdout.write('Snapshot written to %s' % directory)
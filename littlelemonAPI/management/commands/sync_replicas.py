@@ -0,0 +1,39 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from littlelemonAPI.routers import get_replicas
+
+
+class Command(BaseCommand):
+    help = ('Copies the primary SQLite database into the read replicas '
+            '(settings.REPLICA_DATABASES). Run it after writes, or from cron '
+            'at an interval below REPLICA_PIN_SECONDS.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append', dest='databases',
+                            help='Replica alias to sync (default: every replica)')
+
+    def handle(self, *args, **options):
+        aliases = options['databases'] or get_replicas()
+        if not aliases:
+            raise CommandError('No replicas configured, see REPLICA_DATABASES.')
+        primary = connections['default']
+        if primary.vendor != 'sqlite':
+            raise CommandError('sync_replicas only copies SQLite databases.')
+
+        primary.ensure_connection()
+        for alias in aliases:
+            replica = connections[alias]
+            if replica.settings_dict['NAME'] == primary.settings_dict['NAME']:
+                raise CommandError('%s is the primary database.' % alias)
+            # The online backup API copies a consistent snapshot while the
+            # primary stays writable; readers of the replica see the old or
+            # the new copy, never a mix
+            target = sqlite3.connect(str(replica.settings_dict['NAME']))
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write('Synced %s' % alias)
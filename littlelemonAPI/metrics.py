@@ -0,0 +1,258 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .querybudget import QueryCounter
+
+# Per-route request metrics kept in fixed-size in-process buckets and
+# exported in the Prometheus text format (see the metrics view). Recording
+# a request is a few perf_counter() calls and one short locked update, so
+# the middleware is cheap enough to stay on in production.
+
+# Upper bounds of the histogram buckets (+Inf is implicit)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Routes come from the URLconf, so their number is bounded; past this many
+# everything else is counted under "other"
+METRICS_MAX_ROUTES = 500
+UNMATCHED_ROUTE = 'unmatched'
+OTHER_ROUTE = 'other'
+# The method is client input too - anything but these is counted as "other"
+METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'])
+OTHER_METHOD = 'other'
+
+_sample = ContextVar('metrics_sample', default=None)
+
+
+class RequestSample:
+    """Timings collected while a request is being handled."""
+    __slots__ = ('serializer', 'renderer')
+
+    def __init__(self):
+        self.serializer = 0.0
+        self.renderer = 0.0
+
+
+@contextmanager
+def timed(kind):
+    """Adds the time spent in the block to the current request's
+    'serializer' or 'renderer' time. A no-op outside of a request."""
+    sample = _sample.get()
+    if sample is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(sample, kind, getattr(sample, kind) + time.perf_counter() - started)
+
+
+class TimedSerializerMixin:
+    """Counts building serializer.data as serializer time."""
+
+    @property
+    def data(self):
+        with timed('serializer'):
+            return super().data
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class RouteMetrics:
+    __slots__ = ('latency', 'queries', 'bytes', 'sql_seconds', 'serializer_seconds',
+                 'renderer_seconds', 'statuses')
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.bytes = Histogram(BYTES_BUCKETS)
+        self.sql_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.renderer_seconds = 0.0
+        self.statuses = {}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, route, method, status, duration, queries, sql_seconds,
+                serializer_seconds, renderer_seconds, size):
+        key = (route, method if method in METHODS else OTHER_METHOD)
+        with self._lock:
+            metrics = self._routes.get(key)
+            if metrics is None:
+                if len(self._routes) >= getattr(settings, 'METRICS_MAX_ROUTES', METRICS_MAX_ROUTES):
+                    key = (OTHER_ROUTE, key[1])
+                metrics = self._routes.setdefault(key, RouteMetrics())
+            metrics.latency.observe(duration)
+            metrics.queries.observe(queries)
+            if size is not None:
+                metrics.bytes.observe(size)
+            metrics.sql_seconds += sql_seconds
+            metrics.serializer_seconds += serializer_seconds
+            metrics.renderer_seconds += renderer_seconds
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+    def export(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            routes = sorted(self._routes.items())
+            snapshot = [(key, self.copy(metrics)) for key, metrics in routes]
+
+        lines = []
+        histograms = [
+            ('request_duration_seconds', 'Request latency.', 'latency'),
+            ('request_sql_queries', 'SQL queries per request.', 'queries'),
+            ('response_bytes', 'Response body size (streaming bodies are not counted).', 'bytes'),
+        ]
+        for name, help_text, attr in histograms:
+            name = 'littlelemon_' + name
+            lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s histogram' % name]
+            for (route, method), metrics in snapshot:
+                labels = 'route="%s",method="%s"' % (escape(route), method)
+                histogram = getattr(metrics, attr)
+                cumulative = 0
+                for bound, count in zip(histogram.bounds + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+                lines.append('%s_sum{%s} %s' % (name, labels, histogram.sum))
+                lines.append('%s_count{%s} %d' % (name, labels, cumulative))
+
+        counters = [
+            ('request_sql_seconds_total', 'Time spent in SQL queries.', 'sql_seconds'),
+            ('request_serializer_seconds_total', 'Time spent building serializer data.', 'serializer_seconds'),
+            ('request_renderer_seconds_total', 'Time spent rendering responses.', 'renderer_seconds'),
+        ]
+        for name, help_text, attr in counters:
+            name = 'littlelemon_' + name
+            lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s counter' % name]
+            for (route, method), metrics in snapshot:
+                lines.append('%s{route="%s",method="%s"} %s' % (
+                    name, escape(route), method, getattr(metrics, attr)))
+
+        name = 'littlelemon_responses_total'
+        lines += ['# HELP %s Responses by status code.' % name, '# TYPE %s counter' % name]
+        for (route, method), metrics in snapshot:
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append('%s{route="%s",method="%s",status="%d"} %d' % (
+                    name, escape(route), method, status, count))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def copy(metrics):
+        # Formatting happens outside the lock
+        copied = RouteMetrics()
+        for attr in ('latency', 'queries', 'bytes'):
+            source, target = getattr(metrics, attr), getattr(copied, attr)
+            target.counts, target.sum = list(source.counts), source.sum
+        copied.sql_seconds = metrics.sql_seconds
+        copied.serializer_seconds = metrics.serializer_seconds
+        copied.renderer_seconds = metrics.renderer_seconds
+        copied.statuses = dict(metrics.statuses)
+        return copied
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+def get_route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNMATCHED_ROUTE
+    return match.route or match.view_name or UNMATCHED_ROUTE
+
+
+def response_size(response):
+    if not response.streaming:
+        return len(response.content)
+    # FileResponse knows the size of the file
+    length = response.get('Content-Length')
+    return int(length) if length else None
+
+
+class MetricsMiddleware:
+    """Records latency, SQL queries and time, serializer and renderer time
+    and response size of every request, per route (see metrics.py). Place
+    it first so the latency covers the whole middleware stack and the size
+    is what goes on the wire."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _sample.set(RequestSample())
+        started = time.perf_counter()
+        try:
+            with QueryCounter() as counter:
+                response = self.get_response(request)
+            self.record(request, response, started, counter)
+        finally:
+            _sample.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        token = _sample.set(RequestSample())
+        started = time.perf_counter()
+        try:
+            # As with QueryBudgetMiddleware, queries the async ORM runs on
+            # another thread aren't counted
+            with QueryCounter() as counter:
+                response = await self.get_response(request)
+            self.record(request, response, started, counter)
+        finally:
+            _sample.reset(token)
+        return response
+
+    def process_template_response(self, request, response):
+        # Runs right before Django renders the response; responses rendered
+        # earlier (e.g. by the response cache) time themselves with timed()
+        sample = _sample.get()
+        if sample is not None and not response.is_rendered:
+            started = time.perf_counter()
+
+            def rendered(response):
+                sample.renderer += time.perf_counter() - started
+            response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, started, counter):
+        sample = _sample.get()
+        registry.observe(
+            get_route(request), request.method, response.status_code,
+            time.perf_counter() - started, counter.count, counter.time,
+            sample.serializer, sample.renderer, response_size(response))
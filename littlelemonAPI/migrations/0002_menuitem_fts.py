@@ -0,0 +1,56 @@
+from django.db import migrations
+
+# Only the table lives here: the triggers that fill it and keep it in sync
+# are (re)installed on post_migrate by littlelemonAPI.search, because SQLite
+# won't remake the menu item/category tables while triggers reference them.
+FORWARD = [
+    """CREATE VIRTUAL TABLE "littlelemonAPI_menuitem_fts" USING fts5(
+        title, category_title, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )""",
+]
+
+BACKWARD = [
+    'DROP TRIGGER IF EXISTS "littlelemonAPI_menuitem_fts_ai"',
+    'DROP TRIGGER IF EXISTS "littlelemonAPI_menuitem_fts_au"',
+    'DROP TRIGGER IF EXISTS "littlelemonAPI_menuitem_fts_ad"',
+    'DROP TRIGGER IF EXISTS "littlelemonAPI_category_fts_au"',
+    'DROP TABLE IF EXISTS "littlelemonAPI_menuitem_fts"',
+]
+
+
+def fts5_available(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if cursor.fetchone()[0]:
+            return True
+        # Some builds load FTS5 without advertising the compile option
+        cursor.execute("SELECT 1 FROM pragma_module_list WHERE name = 'fts5'")
+        return cursor.fetchone() is not None
+
+
+def create_search_index(apps, schema_editor):
+    # Other backends use icontains lookups instead (see search.py)
+    if not fts5_available(schema_editor.connection):
+        return
+    for sql in FORWARD:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in BACKWARD:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('littlelemonAPI', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
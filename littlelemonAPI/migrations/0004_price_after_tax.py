@@ -0,0 +1,41 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+
+
+# Copied from littlelemonAPI/tax.py as it was when this migration was
+# written, so later changes there can't change what the migration does
+def price_after_tax(price, rate):
+    return (price * (1 + rate)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def fill_price_after_tax(apps, schema_editor):
+    Category = apps.get_model('littlelemonAPI', 'Category')
+    MenuItem = apps.get_model('littlelemonAPI', 'MenuItem')
+    rates = dict(Category.objects.values_list('id', 'tax_rate'))
+    items = list(MenuItem.objects.only('id', 'price', 'category_id'))
+    for item in items:
+        item.price_after_tax = price_after_tax(item.price, rates[item.category_id])
+    MenuItem.objects.bulk_update(items, ['price_after_tax'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('littlelemonAPI', '0003_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='tax_rate',
+            field=models.DecimalField(decimal_places=4, default=Decimal('0.10'), max_digits=5),
+        ),
+        migrations.AddField(
+            model_name='menuitem',
+            name='price_after_tax',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=8, db_index=True),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_price_after_tax, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:23
+
+from django.db import migrations, models
+
+
+def seed_change_log(apps, schema_editor):
+    # Existing rows become the log's first entries, so a client syncing
+    # from scratch gets the whole catalog from the feed
+    Category = apps.get_model('littlelemonAPI', 'Category')
+    MenuItem = apps.get_model('littlelemonAPI', 'MenuItem')
+    MenuChange = apps.get_model('littlelemonAPI', 'MenuChange')
+    entries = [
+        MenuChange(kind='category', object_id=pk)
+        for pk in Category.objects.order_by('id').values_list('id', flat=True)
+    ] + [
+        MenuChange(kind='menuitem', object_id=pk)
+        for pk in MenuItem.objects.order_by('id').values_list('id', flat=True)
+    ]
+    MenuChange.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('littlelemonAPI', '0004_price_after_tax'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('menuitem', 'Menu item'), ('category', 'Category')], max_length=16)),
+                ('object_id', models.IntegerField()),
+                ('action', models.CharField(choices=[('upsert', 'Created or updated'), ('delete', 'Deleted')], default='upsert', max_length=8)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'object_id'], name='littlelemon_kind_057841_idx')],
+            },
+        ),
+        migrations.RunPython(seed_change_log, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def rename_duplicates(apps, schema_editor):
+    # Rows that would violate the new unique constraints keep their data
+    # under a distinct title: "<title> (<id>)"
+    Category = apps.get_model('littlelemonAPI', 'Category')
+    MenuItem = apps.get_model('littlelemonAPI', 'MenuItem')
+    seen = set()
+    for category in Category.objects.order_by('id'):
+        if category.title in seen:
+            category.title = '%s (%d)' % (category.title, category.pk)
+            category.save(update_fields=['title'])
+        seen.add(category.title)
+    seen = set()
+    for pk, title, price in MenuItem.objects.order_by('id').values_list('id', 'title', 'price'):
+        if (title, price) in seen:
+            title = '%s (%d)' % (title, pk)
+            MenuItem.objects.filter(pk=pk).update(title=title)
+        seen.add((title, price))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('littlelemonAPI', '0005_menuchange'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='title',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='menuitem',
+            index=models.Index(fields=['category', 'price'], name='menuitem_category_price_idx'),
+        ),
+        migrations.AlterField(
+            model_name='menuitem',
+            name='category',
+            field=models.ForeignKey(db_index=False, default=1, on_delete=django.db.models.deletion.PROTECT, to='littlelemonAPI.category'),
+        ),
+        migrations.AddIndex(
+            model_name='menuitem',
+            index=models.Index(fields=['price', 'id'], name='menuitem_price_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='menuitem',
+            index=models.Index(fields=['inventory', 'id'], name='menuitem_inventory_id_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='menuitem',
+            constraint=models.UniqueConstraint(fields=('title', 'price'), name='menuitem_title_price_unique'),
+        ),
+    ]
@@ -1,15 +1,131 @@
 from django.db import models
 
+from .tax import DEFAULT_TAX_RATE, fill_prices_after_tax, price_after_tax
+
 # Create your models here.
 class Category(models.Model):
     slug = models.SlugField()
-    title = models.CharField(max_length=255)
+    title = models.CharField(max_length=255, unique=True)
+    # Sales tax of every item in the category, e.g. 0.10 = 10%
+    tax_rate = models.DecimalField(max_digits=5, decimal_places=4, default=DEFAULT_TAX_RATE)
+    # Drives ETag/Last-Modified for conditional GETs (see conditional.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self) -> str:
         return self.title
 
+class MenuItemQuerySet(models.QuerySet):
+    # The nested category comes from the in-process registry (see
+    # categories.py) - menu item queries read menu item columns only
+    def for_serializer(self):
+        return self.all()
+
+    # bulk_create()/bulk_update() skip save() - price_after_tax is filled in
+    # here for the whole batch, with one query for the category rates
+    # They don't send post_save either, so they record the change log
+    # entries themselves (see MenuChange)
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        fill_prices_after_tax(objs, self.tax_rates(objs))
+        objs = super().bulk_create(objs, *args, **kwargs)
+        MenuChange.objects.record(MenuChange.ITEM, [obj.pk for obj in objs])
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if {'price', 'category', 'category_id'} & set(fields):
+            fill_prices_after_tax(objs, self.tax_rates(objs))
+            fields = [*fields, 'price_after_tax']
+        updated = super().bulk_update(objs, fields, *args, **kwargs)
+        MenuChange.objects.record(MenuChange.ITEM, [obj.pk for obj in objs])
+        return updated
+
+    def tax_rates(self, objs):
+        category_ids = {obj.category_id for obj in objs}
+        return dict(Category.objects.filter(pk__in=category_ids).values_list('id', 'tax_rate'))
+
 class MenuItem(models.Model):
     title = models.CharField(max_length=255)
     price = models.DecimalField(max_digits=6, decimal_places=2)
+    # price with the category's tax, stored so it can be filtered, sorted
+    # and indexed in SQL. Kept in sync by save(), bulk_create()/bulk_update()
+    # and Category saves (see signals.py)
+    price_after_tax = models.DecimalField(max_digits=8, decimal_places=2, editable=False, db_index=True)
     inventory = models.SmallIntegerField()
-    category = models.ForeignKey(Category, on_delete=models.PROTECT, default=1)
+    # Indexed by (category, price) below, which also serves lookups by category
+    category = models.ForeignKey(Category, on_delete=models.PROTECT, default=1, db_index=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = MenuItemQuerySet.as_manager()
+
+    class Meta:
+        # Filters by category (+ price) and the keyset pagination orderings,
+        # with id as the tie-breaker
+        indexes = [
+            models.Index(fields=['category', 'price'], name='menuitem_category_price_idx'),
+            models.Index(fields=['price', 'id'], name='menuitem_price_id_idx'),
+            models.Index(fields=['inventory', 'id'], name='menuitem_inventory_id_idx'),
+        ]
+        # Enforced by the database, so concurrent writes can't both pass a
+        # SELECT-based check (see UniqueConstraintMixin in serializers.py)
+        constraints = [
+            models.UniqueConstraint(fields=['title', 'price'], name='menuitem_title_price_unique'),
+        ]
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'price', 'category', 'category_id'} & set(update_fields):
+            self.price_after_tax = price_after_tax(self.price, self.category_tax_rate())
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'price_after_tax'}
+        super().save(*args, **kwargs)
+
+    def category_tax_rate(self):
+        # The category if it's loaded, else the in-process registry (see
+        # categories.py, which reads the table on a miss) - saving an item
+        # by category_id doesn't query the category
+        if not MenuItem.category.is_cached(self):
+            from .categories import category_registry
+            category = category_registry.get(self.category_id)
+            if category is not None:
+                return category.tax_rate
+        return self.category.tax_rate
+
+
+class MenuChangeManager(models.Manager):
+    # Rows per DELETE/INSERT, below SQLite's parameter limit
+    batch_size = 500
+
+    def record(self, kind, ids, action=None):
+        """Appends one entry per id and drops the older entries of the same
+        objects, so the log holds only the latest change of each object and
+        stays about the size of the catalog (plus tombstones)."""
+        action = action or self.model.UPSERT
+        ids = list(ids)
+        for start in range(0, len(ids), self.batch_size):
+            batch = ids[start:start + self.batch_size]
+            self.filter(kind=kind, object_id__in=batch).delete()
+            self.bulk_create([self.model(kind=kind, object_id=pk, action=action) for pk in batch])
+
+# Change log behind the delta-sync feed (see changes.py). Written by the
+# MenuItem/Category signals and by the write paths that skip them
+# (bulk_create/bulk_update, inventory updates, repricing)
+class MenuChange(models.Model):
+    ITEM = 'menuitem'
+    CATEGORY = 'category'
+    KIND_CHOICES = [(ITEM, 'Menu item'), (CATEGORY, 'Category')]
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+    ACTION_CHOICES = [(UPSERT, 'Created or updated'), (DELETE, 'Deleted')]
+
+    # Increases with every change - the feed's cursor
+    seq = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=8, choices=ACTION_CHOICES, default=UPSERT)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = MenuChangeManager()
+
+    class Meta:
+        indexes = [models.Index(fields=['kind', 'object_id'])]
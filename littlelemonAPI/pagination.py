@@ -0,0 +1,183 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .filters import menu_item_query
+from .models import MenuItem
+
+
+class MenuItemKeysetPagination(BasePagination):
+    """Keyset (cursor) pagination for menu items.
+
+    Pages are fetched with a WHERE on the last seen (value, id) pair instead
+    of COUNT(*) + OFFSET, so every page costs the same no matter how deep the
+    client pages. Cursors are opaque to the client.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'perpage'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    mode_query_param = 'pagination'
+
+    # Stable orderings - id breaks ties so every position is unique. The same
+    # allow-list as the ?ordering= of page-number pages (see filters.py)
+    orderings = menu_item_query.orderings
+    default_ordering = menu_item_query.default_ordering
+
+    @classmethod
+    def is_requested(cls, request):
+        params = request.query_params
+        return cls.cursor_query_param in params or params.get(cls.mode_query_param) == 'keyset'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request)
+        fields = self.orderings[self.ordering]
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor['r']
+        if reverse:
+            order = [self.flip(field) for field in fields]
+        else:
+            order = list(fields)
+        queryset = queryset.order_by(*order)
+        if cursor is not None:
+            queryset = queryset.filter(self.position_filter(order, cursor['v']))
+
+        # Fetch one extra row to find out whether there is another page
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        if page_size < 1:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param)
+        if ordering and ordering not in self.orderings:
+            raise ValidationError({
+                self.ordering_query_param: 'Keyset pagination supports ordering by one of: %s'
+                % ', '.join(self.orderings)
+            })
+        # Also checks it fits the filters, and picks the default for them.
+        # Search results (which can't be paged by rank) and unfiltered
+        # requests get default_ordering
+        return menu_item_query.resolve_ordering(request.query_params) or self.default_ordering
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def position_filter(self, order, values):
+        # (a, id) > (x, y)  ==  a > x OR (a = x AND id > y)
+        (field, id_field), (value, pk) = order, values
+        name, lookup = self.lookup(field)
+        id_name, id_lookup = self.lookup(id_field)
+        return Q(**{'%s__%s' % (name, lookup): value}) | Q(
+            **{name: value, '%s__%s' % (id_name, id_lookup): pk})
+
+    @staticmethod
+    def lookup(field):
+        if field.startswith('-'):
+            return field[1:], 'lt'
+        return field, 'gt'
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    def encode_cursor(self, item, reverse):
+        field = self.orderings[self.ordering][0].lstrip('-')
+        position = {'o': self.ordering, 'v': [str(getattr(item, field)), item.pk], 'r': reverse}
+        token = urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode()).decode()
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.cursor_query_param, token.rstrip('='))
+        return remove_query_param(url, self.mode_query_param)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if token is None:
+            return None
+        try:
+            token += '=' * (-len(token) % 4)
+            cursor = json.loads(urlsafe_b64decode(token.encode()))
+            value, pk = cursor['v']
+            if cursor['o'] != self.ordering:
+                raise ValueError
+            # The value goes into a WHERE - it has to be valid for the field
+            field = MenuItem._meta.get_field(self.orderings[self.ordering][0].lstrip('-'))
+            value = field.to_python(value)
+            if value is None or (isinstance(value, Decimal) and not value.is_finite()):
+                raise ValueError
+            cursor['v'] = [value, int(pk)]
+            cursor['r'] = bool(cursor['r'])
+        except (TypeError, ValueError, KeyError, InvalidOperation, DjangoValidationError):
+            raise NotFound('Invalid cursor')
+        return cursor
+
+
+class MenuItemPagination(PageNumberPagination):
+    """Page numbers by default; keyset pagination when the client opts in
+    with ?pagination=keyset (or follows a cursor link)."""
+    keyset_class = MenuItemKeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.keyset_class.is_requested(request):
+            self.keyset = self.keyset_class()
+            self.display_page_controls = False
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.keyset = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
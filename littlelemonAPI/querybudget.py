@@ -0,0 +1,120 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Default number of SQL queries a single request may run. An endpoint going
+# over it usually means a query is being issued per row (N+1).
+DEFAULT_QUERY_BUDGET = 10
+DEFAULT_QUERY_BUDGET_PATHS = ['/api/']
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    """Counts (and times) the SQL queries run on every configured database
+    while active."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self._wrappers = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - started
+
+    def __enter__(self):
+        for alias in connections:
+            wrapper = connections[alias].execute_wrapper(self)
+            wrapper.__enter__()
+            self._wrappers.append(wrapper)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        while self._wrappers:
+            self._wrappers.pop().__exit__(exc_type, exc_value, traceback)
+
+
+def get_query_budget(view_func=None):
+    # A view can declare its own budget with the @query_budget decorator
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None:
+        budget = getattr(settings, 'QUERY_BUDGET', DEFAULT_QUERY_BUDGET)
+    return budget
+
+
+def query_budget(budget):
+    """Overrides the per-request query budget for a single view."""
+    def decorator(view_func):
+        view_func.query_budget = budget
+        return view_func
+    return decorator
+
+
+def set_query_budget(request, budget):
+    """Sets the budget of the current request from inside the view, for
+    views whose query count depends on the request (e.g. bulk writes)."""
+    # DRF's Request wraps the HttpRequest the middleware sees
+    getattr(request, '_request', request).query_budget = budget
+
+
+class QueryBudgetMiddleware:
+    """Logs (or raises, with QUERY_BUDGET_STRICT) when a request runs more
+    SQL queries than its budget allows."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.applies(request):
+            return self.get_response(request)
+        with QueryCounter() as counter:
+            response = self.get_response(request)
+        self.check(request, counter.count)
+        return response
+
+    async def __acall__(self, request):
+        # Async views run their queries through sync_to_async on another
+        # thread's connection, so only queries made from this thread count
+        if not self.applies(request):
+            return await self.get_response(request)
+        with QueryCounter() as counter:
+            response = await self.get_response(request)
+        self.check(request, counter.count)
+        return response
+
+    def applies(self, request):
+        paths = getattr(settings, 'QUERY_BUDGET_PATHS', DEFAULT_QUERY_BUDGET_PATHS)
+        return request.path.startswith(tuple(paths))
+
+    def check(self, request, count):
+        # The request's own budget (see set_query_budget), else the resolved
+        # view's, if it has one (see query_budget)
+        budget = getattr(request, 'query_budget', None)
+        if budget is None:
+            match = getattr(request, 'resolver_match', None)
+            budget = get_query_budget(match.func if match else None)
+        if count <= budget:
+            return
+        message = '%s %s ran %d SQL queries (budget %d)' % (
+            request.method, request.path, count, budget)
+        if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
@@ -0,0 +1,50 @@
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# MessagePack: the same data as the JSON renderer (Decimal -> float,
+# datetime -> ISO string, ...) in a compact binary encoding
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+
+# Same conversions as DRF's JSON output for types MessagePack doesn't know
+_encoder = JSONEncoder()
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = MSGPACK_MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_encoder.default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.UnpackException) as exc:
+            raise ParseError('MessagePack parse error - %s' % exc)
+
+
+class PrometheusRenderer(BaseRenderer):
+    """Prometheus text exposition format. The view returns the text (see
+    metrics.py); an error response ({"detail": ...}) is written as its
+    message in plain text."""
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict) and 'detail' in data:
+            data = '%s\n' % data['detail']
+        if data is None:
+            return b''
+        return str(data).encode(self.charset)
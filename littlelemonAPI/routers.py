@@ -0,0 +1,135 @@
+import contextvars
+import random
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# Reads of these apps' models may be served by a replica
+REPLICA_APPS = {'littlelemonAPI'}
+
+# After a write the client's reads stay on the primary for this many seconds
+# (the replication lag we accept), tracked with a cookie
+REPLICA_PIN_SECONDS = 5
+PIN_COOKIE = 'db_primary_until'
+
+# Cached responses read from a replica expire after this many seconds, so
+# a lagging replica can't keep stale content under a new menu version
+REPLICA_CACHE_TIMEOUT = 5
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Replica alias chosen for the current request, None = primary
+_replica = contextvars.ContextVar('replica', default=None)
+
+
+def get_replicas():
+    return list(getattr(settings, 'REPLICA_DATABASES', []))
+
+
+def current_replica():
+    return _replica.get()
+
+
+def is_pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def pin_to_primary(response):
+    seconds = getattr(settings, 'REPLICA_PIN_SECONDS', REPLICA_PIN_SECONDS)
+    response.set_cookie(PIN_COOKIE, '%.3f' % (time.time() + seconds), max_age=seconds, httponly=True)
+
+
+def iter_with_replica(alias, iterator):
+    # Streaming content is generated after the view returns
+    iterator = iter(iterator)
+    while True:
+        token = _replica.set(alias)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _replica.reset(token)
+        yield chunk
+
+
+def replica_reads(view_func):
+    """Serves safe-method requests of the view from a replica, unless the
+    client wrote recently (see ReplicaPinMiddleware)."""
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            replicas = get_replicas()
+            if request.method not in SAFE_METHODS or not replicas or is_pinned(request):
+                return await view_func(request, *args, **kwargs)
+            token = _replica.set(random.choice(replicas))
+            try:
+                return await view_func(request, *args, **kwargs)
+            finally:
+                _replica.reset(token)
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        replicas = get_replicas()
+        if request.method not in SAFE_METHODS or not replicas or is_pinned(request):
+            return view_func(request, *args, **kwargs)
+
+        alias = random.choice(replicas)
+        token = _replica.set(alias)
+        try:
+            response = view_func(request, *args, **kwargs)
+        finally:
+            _replica.reset(token)
+        if response.streaming:
+            response.streaming_content = iter_with_replica(alias, response.streaming_content)
+        return response
+    return wrapper
+
+
+class ReplicaRouter:
+    """Routes reads to the replica picked by replica_reads; everything else,
+    and every read after a write in the same request, goes to the primary."""
+
+    def db_for_read(self, model, **hints):
+        alias = _replica.get()
+        if alias is not None and model._meta.app_label in REPLICA_APPS:
+            return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Read-your-writes within the request
+        if _replica.get() is not None:
+            _replica.set(None)
+        return None
+
+
+class ReplicaPinMiddleware:
+    """Read-your-writes across requests: after an unsafe request the client's
+    reads stay on the primary until the replicas have caught up."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS and get_replicas():
+            pin_to_primary(response)
+        return response
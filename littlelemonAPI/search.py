@@ -0,0 +1,146 @@
+import re
+
+from django.db import connections
+from django.db.models import Q
+from rest_framework.filters import SearchFilter
+
+# SQLite FTS5 index over menu item title + category title. Migration 0002
+# creates the table; the triggers keeping it in sync are installed after every
+# migrate run (see install_search_triggers). Other database backends fall
+# back to icontains lookups.
+FTS_TABLE = 'littlelemonAPI_menuitem_fts'
+
+# Django field lookup -> FTS column
+FTS_COLUMNS = {
+    'title': 'title',
+    'category__title': 'category_title',
+}
+
+TRIGGERS = {
+    'littlelemonAPI_menuitem_fts_ai': """
+        CREATE TRIGGER IF NOT EXISTS "littlelemonAPI_menuitem_fts_ai"
+        AFTER INSERT ON "littlelemonAPI_menuitem" BEGIN
+            INSERT INTO "littlelemonAPI_menuitem_fts" (rowid, title, category_title)
+            VALUES (new.id, new.title,
+                    (SELECT title FROM "littlelemonAPI_category" WHERE id = new.category_id));
+        END""",
+    'littlelemonAPI_menuitem_fts_au': """
+        CREATE TRIGGER IF NOT EXISTS "littlelemonAPI_menuitem_fts_au"
+        AFTER UPDATE OF title, category_id ON "littlelemonAPI_menuitem" BEGIN
+            UPDATE "littlelemonAPI_menuitem_fts"
+            SET title = new.title,
+                category_title = (SELECT title FROM "littlelemonAPI_category" WHERE id = new.category_id)
+            WHERE rowid = new.id;
+        END""",
+    'littlelemonAPI_menuitem_fts_ad': """
+        CREATE TRIGGER IF NOT EXISTS "littlelemonAPI_menuitem_fts_ad"
+        AFTER DELETE ON "littlelemonAPI_menuitem" BEGIN
+            DELETE FROM "littlelemonAPI_menuitem_fts" WHERE rowid = old.id;
+        END""",
+    'littlelemonAPI_category_fts_au': """
+        CREATE TRIGGER IF NOT EXISTS "littlelemonAPI_category_fts_au"
+        AFTER UPDATE OF title ON "littlelemonAPI_category" BEGIN
+            UPDATE "littlelemonAPI_menuitem_fts" SET category_title = new.title
+            WHERE rowid IN (SELECT id FROM "littlelemonAPI_menuitem" WHERE category_id = new.id);
+        END""",
+}
+
+REBUILD = [
+    'DELETE FROM "littlelemonAPI_menuitem_fts"',
+    """INSERT INTO "littlelemonAPI_menuitem_fts" (rowid, title, category_title)
+       SELECT m.id, m.title, c.title FROM "littlelemonAPI_menuitem" m
+       JOIN "littlelemonAPI_category" c ON c.id = m.category_id""",
+]
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_enabled = {}
+
+
+def fts_enabled(using='default'):
+    if using not in _enabled:
+        connection = connections[using]
+        _enabled[using] = (
+            connection.vendor == 'sqlite'
+            and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _enabled[using]
+
+
+def drop_search_triggers(using='default', **kwargs):
+    """Drops the sync triggers before migrations run.
+
+    SQLite refuses to remake (drop + rename) the menu item or category table
+    while a trigger references it, which every AlterField/AddField with a
+    default does.
+    """
+    _enabled.pop(using, None)
+    if not fts_enabled(using):
+        return
+    with connections[using].cursor() as cursor:
+        for name in TRIGGERS:
+            cursor.execute('DROP TRIGGER IF EXISTS "%s"' % name)
+
+
+def install_search_triggers(using='default', **kwargs):
+    """Recreates the sync triggers after migrations and reindexes whenever
+    one was missing, so rows written in between are picked up."""
+    _enabled.pop(using, None)
+    if not fts_enabled(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN (%s)"
+            % ', '.join(['%s'] * len(TRIGGERS)), list(TRIGGERS))
+        existing = {row[0] for row in cursor.fetchall()}
+        if existing == set(TRIGGERS):
+            return
+        for sql in TRIGGERS.values():
+            cursor.execute(sql)
+        for sql in REBUILD:
+            cursor.execute(sql)
+
+
+def build_match(terms, fields):
+    # Every term has to match (implicit AND) as a prefix, so results update
+    # on each keystroke. Terms are quoted so FTS operators can't be injected.
+    columns = ' '.join(FTS_COLUMNS[field] for field in fields)
+    query = ' '.join('"%s"*' % term for term in terms)
+    return '{%s} : (%s)' % (columns, query)
+
+
+def search_menu_items(queryset, search, fields=('title', 'category__title')):
+    """Filters menu items by search text, best matches first."""
+    terms = TOKEN_RE.findall(search)
+    if not terms or not fts_enabled(queryset.db) or not set(fields) <= set(FTS_COLUMNS):
+        return fallback_search(queryset, search, fields)
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[
+            '"%s".rowid = "littlelemonAPI_menuitem"."id"' % FTS_TABLE,
+            '"%s" MATCH %%s' % FTS_TABLE,
+        ],
+        params=[build_match(terms, fields)],
+        select={'search_rank': 'bm25("%s")' % FTS_TABLE},
+        order_by=['search_rank', 'id'],
+    )
+
+
+def fallback_search(queryset, search, fields):
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{'%s__icontains' % field: search})
+    return queryset.filter(condition)
+
+
+class MenuItemSearchFilter(SearchFilter):
+    """SearchFilter backed by the FTS index, ranked by relevance."""
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        if not search_fields or not search_terms:
+            return queryset
+        if not fts_enabled(queryset.db) or not set(search_fields) <= set(FTS_COLUMNS):
+            return super().filter_queryset(request, queryset, view)
+        return search_menu_items(queryset, ' '.join(search_terms), search_fields)
@@ -1,127 +1,220 @@
 from rest_framework import serializers
 from .models import MenuItem
 from .models import Category
-from decimal import Decimal
+import sys
+from operator import attrgetter
+from django.core.paginator import Page
+from django.db import IntegrityError, models, transaction
+from .metrics import TimedSerializerMixin
+from .categories import category_registry
 
 # For data sanitization
 import bleach
 
-# Unique validator - uniqueness of a single field, i.e. no duplicates
-from rest_framework.validators import UniqueValidator
-
-# UniqueTogether validator - uniqueness of combination of two fields
-from rest_framework.validators import UniqueTogetherValidator
-
 class MenuItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = MenuItem
         fields = ['id', 'title', 'price', 'inventory']
 
-""" class MenuItemsSerializer(serializers.Serializer):
-    id = serializers.IntegerField()
-    title = serializers.CharField(max_length=255)
-    price = serializers.DecimalField(max_digits=255, decimal_places=2)
-    inventory = serializers.IntegerField() """
-
-class CategorySerializer(serializers.ModelSerializer):
+UNIQUE_MESSAGE = 'The fields title, price must make a unique set.'
+
+# Uniqueness is enforced by the database constraints (see models.py) rather
+# than a SELECT before every write, which could also race. The write runs in
+# a savepoint and an IntegrityError becomes the same 400 the validator gave.
+class UniqueConstraintMixin:
+    def save(self, **kwargs):
+        try:
+            with transaction.atomic():
+                return super().save(**kwargs)
+        except IntegrityError:
+            errors = self.unique_errors()
+            if not errors:
+                raise
+            raise serializers.ValidationError(errors)
+
+    def unique_errors(self):
+        # {field: [message]} if the IntegrityError was a known unique
+        # constraint, else None and the error is re-raised
+        return None
+
+    def current(self, field):
+        # The value being written, or the instance's for partial updates
+        return self.validated_data.get(field, getattr(self.instance, field, None))
+
+    def others(self, model):
+        return model.objects.exclude(pk=getattr(self.instance, 'pk', None))
+
+# Request metrics: time spent building .data is reported as serializer time
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
+
+class CategorySerializer(UniqueConstraintMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields =['id', 'slug','title']
+        list_serializer_class = TimedListSerializer
+        # Unique in the database - no UniqueValidator query
+        extra_kwargs = {'title': {'validators': []}}
+
+    def unique_errors(self):
+        if self.others(Category).filter(title=self.current('title')).exists():
+            return {'title': ['category with this title already exists.']}
         
+# Nested category output (same as CategorySerializer) from the in-process
+# registry by category_id, so the item query needs no join (see categories.py)
+class RegistryCategoryField(serializers.Field):
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', 'category_id')
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        # One registry read per serializer, not per row
+        categories = getattr(self, '_categories', None)
+        if categories is None:
+            categories = self._categories = category_registry.current()
+        category = categories.get(value) or category_registry.get(value)
+        if category is None:
+            return None
+        return {'id': category.pk, 'slug': category.slug, 'title': category.title}
+
+# Read-only fast path for MenuItemsSerializer(many=True): builds the same
+# output as the full field machinery straight from values_list() tuples
+# (or attributes, for lists of instances) with accessors compiled once.
+class MenuItemsListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    value_fields = ('id', 'title', 'price', 'inventory', 'price_after_tax', 'category_id')
+    instance_getter = attrgetter('id', 'title', 'price', 'inventory', 'price_after_tax', 'category_id')
+
+    def to_representation(self, data):
+        # Subclasses may add or change fields - use the generic path for them
+        if type(self.child) is not MenuItemsSerializer:
+            return super().to_representation(data)
+
+        price_to_representation = self.child.fields['price'].to_representation
+        category_to_representation = self.child.fields['category'].to_representation
+        # Built once per category and copied per row (shared dicts would be
+        # written as YAML aliases)
+        categories = {}
+        rows = []
+        for pk, title, price, inventory, after_tax, category_id in self.rows(data):
+            if category_id not in categories:
+                categories[category_id] = category_to_representation(category_id)
+            category = categories[category_id]
+            rows.append({
+                'id': pk,
+                'title': title,
+                'price': price_to_representation(price),
+                'stock': inventory,
+                'price_after_tax': after_tax,
+                'category': dict(category) if category is not None else None,
+            })
+        return rows
+
+    def rows(self, data):
+        if isinstance(data, Page):
+            data = data.object_list
+        if isinstance(data, models.Manager):
+            data = data.all()
+        # extra() selects (search rank) can't be combined with values_list()
+        if isinstance(data, models.QuerySet) and not data.query.extra:
+            return data.values_list(*self.value_fields)
+        return map(self.instance_getter, data)
+
 # Easier way:
-class MenuItemsSerializer(serializers.ModelSerializer):
+class MenuItemsSerializer(UniqueConstraintMixin, TimedSerializerMixin, serializers.ModelSerializer):
     price_after_tax = serializers.SerializerMethodField(method_name='calculate_tax')
-    # category = serializers.StringRelatedField()
-    # More efficient:
-    category = CategorySerializer(read_only=True)
+    # Nested category without a join - from the in-process category registry
+    category = RegistryCategoryField()
     category_id = serializers.IntegerField(write_only=True)
-     
-     # OPTION 1: Validation of price field
-    #price = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=2)
     stock = serializers.IntegerField(source='inventory')
 
-    # OPTION 3: Using validate_field() method
-    """ def validate_price(self,value):
-        if(value < 2):
-            raise serializers.ValidationError('Price should not be less than 2.0')
-        
-    def validate_stock(self, value):
-        if(value < 0):
-            raise serializers.ValidationError("Stock cannot be negative")  """
-    
-    # OPTION 4: Using the validate() method
     def validate(self, attrs):
-         # OPTION 2: Data sanitization title
+        # Data sanitization of the title
         attrs['title'] = bleach.clean(attrs['title'])
         if(attrs['price']<2):
             raise serializers.ValidationError('Price should not be less than 2.00')
-          # This has a key error!!
-        """ if(attrs['stock']<0):
-            raise serializers.ValidationError('Stock cannot be a negative value') """
         return super().validate(attrs)
 
-    # HYPERLINK RELATED FIELD
-    """ category = serializers.HyperlinkedRelatedField(
-        queryset = Category.objects.all(),
-        view_name='category-detail'
-    ) """
-
-    # OPTION 2 - Unique validation of title field
-    """ title = serializers.CharField(
-        max_length = 255,
-
-        # Unique validator
-        validators = [UniqueValidator(queryset=MenuItem.objects.all())]
-    )
- """
-    #OPTION 1: Data sanitization on title using bleach
-    """ def validate_title(self,value):
-        return bleach.clean(value) """
-
-
     class Meta:
         model = MenuItem
         fields =['id', 'title', 'price', 'stock','price_after_tax', 'category', 'category_id']
-        # OR to display categories
-        #depth = 1
-
-        # OPTION 2 - validation of price field
-        """ extra_kwargs = {
-        'price': {'min_value': 2},
-        'stock':{'source':'inventory', 'min_value': 0}
-         } """
-        
-        # OPTION 1: Unique validation of title field
-        """ extra_kwargs = {
-            'title':{
-                'validators': [
-                    UniqueValidator(
-                        queryset=MenuItem.objects.all()
-                    )
-                ]
-            }
-        }
-        """
-
-        # Unique together validator - combination of price + title should be unique items
-        validators = [
-            UniqueTogetherValidator(
-                queryset=MenuItem.objects.all(),
-                fields = ['title', 'price']
-            ),
-        ]
+        list_serializer_class = MenuItemsListSerializer
+        # Title + price must be unique - a UniqueConstraint on MenuItem,
+        # see UniqueConstraintMixin
+        validators = []
 
 
+    # Stored on the item, quantized with the category's rate (see tax.py)
     def calculate_tax(self, product:MenuItem):
-        return product.price * Decimal(1.1)
+        return product.price_after_tax
+
+    def unique_errors(self):
+        if self.others(MenuItem).filter(title=self.current('title'), price=self.current('price')).exists():
+            return {'non_field_errors': [UNIQUE_MESSAGE]}
+
+# Inventory reservation - see inventory.py
+class StockChangeSerializer(serializers.Serializer):
+    quantity = serializers.IntegerField(min_value=1, max_value=32767)
+
+class StockBatchItemSerializer(StockChangeSerializer):
+    id = serializers.IntegerField()
+
+class StockBatchSerializer(serializers.Serializer):
+    items = StockBatchItemSerializer(many=True, allow_empty=False)
+
+# HyperlinkedRelatedField that reverses the URL pattern a few times per request
+# (per view name and format) and formats the link of every row into it,
+# instead of a reverse() + build_absolute_uri() per row
+class CachedHyperlinkedRelatedField(serializers.HyperlinkedRelatedField):
+    def get_url(self, obj, view_name, request, format):
+        # Unsaved objects will not yet have a valid URL.
+        if hasattr(obj, 'pk') and obj.pk in (None, ''):
+            return None
+        lookup_value = getattr(obj, self.lookup_field)
+        template = None
+        if type(lookup_value) is int:
+            template = self.get_url_template(view_name, request, format)
+        if template is None:
+            return super().get_url(obj, view_name, request, format)
+        prefix, suffix = template
+        return '%s%d%s' % (prefix, lookup_value, suffix)
+
+    def get_url_template(self, view_name, request, format):
+        # One field instance serves every row of a list, within one request
+        if getattr(self, '_template_request', None) is not request:
+            self._template_request, self._url_templates = request, {}
+        key = (view_name, format)
+        if key not in self._url_templates:
+            self._url_templates[key] = self.build_url_template(view_name, request, format)
+        return self._url_templates[key]
+
+    def build_url_template(self, view_name, request, format):
+        # The links for 1 and 2 differ in exactly one character - the value -
+        # and what's around it is the template. It's only kept if it also
+        # gives the link for a many-digit value, i.e. the URL pattern takes
+        # any integer; anything else (None) goes through reverse() per row
+        first, second, largest = [
+            self.reverse(view_name, kwargs={self.lookup_url_kwarg: value}, request=request, format=format)
+            for value in (1, 2, sys.maxsize)]
+        differ = [index for index, (a, b) in enumerate(zip(first, second)) if a != b]
+        if len(first) != len(second) or len(differ) != 1:
+            return None
+        prefix, suffix = first[:differ[0]], first[differ[0] + 1:]
+        if largest != '%s%d%s' % (prefix, sys.maxsize, suffix):
+            return None
+        return prefix, suffix
 
 # Alt for HyperlinksSerializer
-class MenuHyperItemsSerializer(serializers.HyperlinkedModelSerializer):
+class MenuHyperItemsSerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
     stock = serializers.IntegerField(source='inventory')
     price_after_tax = serializers.SerializerMethodField(method_name='calculate_tax')
+    # category links are formatted from one reversed URL per request
+    serializer_related_field = CachedHyperlinkedRelatedField
 
     class Meta:
         model = MenuItem
         fields =['id', 'title', 'price', 'stock','price_after_tax', 'category']
+        list_serializer_class = TimedListSerializer
+    # Stored on the item, quantized with the category's rate (see tax.py)
     def calculate_tax(self, product:MenuItem):
-        return product.price * Decimal(1.1)
+        return product.price_after_tax
@@ -0,0 +1,134 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from .authentication import auth_cache
+from .cache import bump_menu_version, menu_version_changed
+from .categories import category_registry
+from .models import Category, MenuChange, MenuItem
+from .snapshot import mark_stale
+from .tax import refresh_prices_after_tax
+
+
+# Set while a bulk write runs (see bulk.py): it records the change log,
+# touches the categories and bumps the menu version once for the whole
+# batch, so the per-row receivers below skip that work
+_batched = ContextVar('menu_writes_batched', default=False)
+
+
+@contextmanager
+def batched_menu_writes():
+    token = _batched.set(True)
+    try:
+        yield
+    finally:
+        _batched.reset(token)
+
+
+@receiver([post_save, post_delete], sender=MenuItem, dispatch_uid='menuitem_cache_version')
+@receiver([post_save, post_delete], sender=Category, dispatch_uid='category_cache_version')
+def menu_changed(sender, **kwargs):
+    if _batched.get():
+        return
+    # After commit - a response cached under the new version before then
+    # would hold the old rows (or the rolled back ones)
+    transaction.on_commit(bump_menu_version)
+
+
+# In-process category map (see categories.py) - dropped now for this
+# transaction and again after commit, so no load from before the commit
+# survives
+@receiver([post_save, post_delete], sender=Category, dispatch_uid='category_registry')
+def category_changed(sender, **kwargs):
+    category_registry.invalidate()
+    transaction.on_commit(category_registry.invalidate)
+
+
+# Prebuilt menu files (see snapshot.py) are rebuilt on the next read
+@receiver(menu_version_changed, dispatch_uid='menu_snapshot_stale')
+def snapshot_stale(sender, **kwargs):
+    # After commit, so a rebuild can't read the old rows and still be
+    # considered fresh
+    transaction.on_commit(mark_stale)
+
+
+@receiver(post_save, sender=Category, dispatch_uid='category_tax_rate')
+def reprice_category(sender, instance, created, update_fields=None, **kwargs):
+    # Items store their after-tax price - recompute them for the new rate
+    if created or (update_fields is not None and 'tax_rate' not in update_fields):
+        return
+    # The items' change log entries are written by category_saved
+    refresh_prices_after_tax(MenuItem.objects.filter(category=instance), instance.tax_rate)
+
+
+# Change log for the delta-sync feed (see changes.py)
+@receiver(post_save, sender=MenuItem, dispatch_uid='menuitem_change_log')
+def item_saved(sender, instance, **kwargs):
+    MenuChange.objects.record(MenuChange.ITEM, [instance.pk])
+
+
+@receiver(post_delete, sender=MenuItem, dispatch_uid='menuitem_change_log_delete')
+def item_deleted(sender, instance, **kwargs):
+    if _batched.get():
+        return
+    MenuChange.objects.record(MenuChange.ITEM, [instance.pk], MenuChange.DELETE)
+
+
+@receiver(post_save, sender=Category, dispatch_uid='category_change_log')
+def category_saved(sender, instance, created, **kwargs):
+    MenuChange.objects.record(MenuChange.CATEGORY, [instance.pk])
+    if not created:
+        # Items nest their category (and its tax rate sets their price)
+        MenuChange.objects.record(
+            MenuChange.ITEM, MenuItem.objects.filter(category=instance).values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Category, dispatch_uid='category_change_log_delete')
+def category_deleted(sender, instance, **kwargs):
+    MenuChange.objects.record(MenuChange.CATEGORY, [instance.pk], MenuChange.DELETE)
+
+
+@receiver(post_delete, sender=MenuItem, dispatch_uid='menuitem_touch_category')
+def touch_category(sender, instance, **kwargs):
+    if _batched.get():
+        return
+    # A deleted item doesn't move max(updated_at) - touch its category so
+    # If-Modified-Since on the menu still sees the change
+    Category.objects.filter(pk=instance.category_id).update(updated_at=timezone.now())
+
+
+# Authentication lookup cache (see authentication.py)
+@receiver(post_delete, sender=Token, dispatch_uid='token_auth_cache')
+def token_deleted(sender, instance, **kwargs):
+    auth_cache.invalidate(('token', instance.key))
+
+
+@receiver([post_save, post_delete], sender=User, dispatch_uid='user_auth_cache')
+def user_changed(sender, instance, **kwargs):
+    auth_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=BlacklistedToken, dispatch_uid='blacklist_auth_cache')
+def token_blacklisted(sender, instance, **kwargs):
+    auth_cache.invalidate_user(instance.token.user_id)
+
+
+@receiver(m2m_changed, sender=User.groups.through, dispatch_uid='groups_auth_cache')
+def groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        auth_cache.invalidate_user(instance.pk)
+    elif pk_set is None:
+        # group.user_set.clear() - the removed users aren't known any more
+        auth_cache.clear()
+    else:
+        for user_id in pk_set:
+            auth_cache.invalidate_user(user_id)
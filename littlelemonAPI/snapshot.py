@@ -0,0 +1,243 @@
+import copy
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.http import HttpRequest
+from rest_framework.renderers import JSONRenderer
+from rest_framework_csv.renderers import CSVRenderer
+from rest_framework_xml.renderers import XMLRenderer
+from rest_framework_yaml.renderers import YAMLRenderer
+
+from .compression import brotli
+from .renderers import MessagePackRenderer
+from .streaming import menu_export_rows
+
+logger = logging.getLogger(__name__)
+
+# Prebuilt menu files (see build_snapshot). The menu changes a few times a
+# day but is read constantly, so every format is rendered - and compressed -
+# once per change and then served straight from disk.
+SNAPSHOT_DIR = 'snapshots'
+# Hyperlinks in the snapshot point at this host
+SNAPSHOT_BASE_URL = 'http://localhost:8000'
+
+FORMATS = {
+    'json': JSONRenderer,
+    'xml': XMLRenderer,
+    'csv': CSVRenderer,
+    'yaml': YAMLRenderer,
+    'msgpack': MessagePackRenderer,
+}
+
+# Content-Encoding -> (file suffix, compress). Maximum compression: it runs
+# once per menu change, outside any request (see compress_snapshot)
+ENCODINGS = {'gzip': ('.gz', lambda content: gzip.compress(content, 9))}
+if brotli is not None:
+    ENCODINGS['br'] = ('.br', lambda content: brotli.compress(content, quality=11))
+
+MANIFEST = 'manifest.json'
+# Rewritten with a new token after every committed menu change; a snapshot
+# built with another token is stale. (A token rather than the mtime, which
+# is too coarse on some filesystems.)
+STALE_MARKER = 'stale'
+
+_build_lock = threading.Lock()
+_manifest_cache = {}
+
+
+def get_snapshot_dir():
+    return Path(getattr(settings, 'SNAPSHOT_DIR', settings.BASE_DIR / SNAPSHOT_DIR))
+
+
+def marker_token(directory):
+    try:
+        return (directory / STALE_MARKER).read_text()
+    except FileNotFoundError:
+        return ''
+
+
+def mark_stale():
+    directory = get_snapshot_dir()
+    if directory.is_dir():
+        write_atomic(directory / STALE_MARKER, uuid.uuid4().hex.encode())
+
+
+def write_atomic(path, content):
+    # Readers see the old file or the new one, never a partial write
+    fd, temp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as file:
+        file.write(content)
+    os.replace(temp, path)
+
+
+class SnapshotRequest(HttpRequest):
+    """GET /api/menu on SNAPSHOT_BASE_URL - only used to build the
+    serializers' absolute hyperlinks. The host comes from settings, not a
+    client, so it isn't checked against ALLOWED_HOSTS."""
+
+    def __init__(self, base_url):
+        super().__init__()
+        base = urlsplit(base_url)
+        self.method = 'GET'
+        self.path = self.path_info = '/api/menu'
+        self.base_scheme, self.base_host = base.scheme, base.netloc
+
+    def _get_scheme(self):
+        return self.base_scheme
+
+    def get_host(self):
+        return self.base_host
+
+
+def snapshot_request():
+    return SnapshotRequest(getattr(settings, 'SNAPSHOT_BASE_URL', SNAPSHOT_BASE_URL))
+
+
+def render(fmt, data=None):
+    """(content, content type) of the menu in one format."""
+    if data is None:
+        data = list(menu_export_rows(snapshot_request()))
+    renderer = FORMATS[fmt]()
+    content = renderer.render(data, renderer.media_type, {})
+    if isinstance(content, str):
+        content = content.encode(renderer.charset or 'utf-8')
+    content_type = renderer.media_type
+    if renderer.charset:
+        content_type += '; charset=%s' % renderer.charset
+    return content, content_type
+
+
+def build_snapshot(directory=None, compress=True):
+    """Renders the menu in every format to content-addressed files and
+    switches the manifest to them. Returns the manifest.
+
+    With compress=False the compressed variants are left out (unless an
+    earlier build already wrote them) - compress_snapshot() adds them."""
+    directory = Path(directory or get_snapshot_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+    marker = marker_token(directory)
+    previous = read_manifest(directory)
+
+    data = list(menu_export_rows(snapshot_request()))
+    manifest = {'marker': marker, 'formats': {}}
+    for fmt in FORMATS:
+        content, content_type = render(fmt, data)
+        etag = hashlib.md5(content).hexdigest()
+        name = 'menu-%s.%s' % (etag, fmt)
+        # Unchanged formats keep their files
+        if not (directory / name).exists():
+            write_atomic(directory / name, content)
+        files = {'identity': name}
+        for encoding, (suffix, _) in ENCODINGS.items():
+            if (directory / (name + suffix)).exists():
+                files[encoding] = name + suffix
+        manifest['formats'][fmt] = {'content_type': content_type, 'etag': etag, 'files': files}
+
+    if compress:
+        add_compressed(directory, manifest)
+    write_atomic(directory / MANIFEST, json.dumps(manifest).encode())
+    remove_unused(directory, [manifest, previous])
+    return manifest
+
+
+def add_compressed(directory, manifest):
+    for entry in manifest['formats'].values():
+        name = entry['files']['identity']
+        for encoding, (suffix, compress) in ENCODINGS.items():
+            if encoding not in entry['files']:
+                write_atomic(directory / (name + suffix), compress((directory / name).read_bytes()))
+                entry['files'][encoding] = name + suffix
+
+
+def compress_snapshot(directory):
+    """Adds the missing compressed variants to the current snapshot. Until
+    they're there the uncompressed files are served (gzipped on the fly by
+    CompressionMiddleware)."""
+    directory = Path(directory)
+    with _build_lock:
+        try:
+            manifest = read_manifest(directory)
+            if manifest is None:
+                return
+            # A copy - the cached one may be in use by other requests
+            manifest = copy.deepcopy(manifest)
+            add_compressed(directory, manifest)
+            write_atomic(directory / MANIFEST, json.dumps(manifest).encode())
+        except Exception:
+            logger.exception('Menu snapshot compression failed')
+
+
+def start_compression(directory):
+    thread = threading.Thread(target=compress_snapshot, args=(directory,), daemon=True)
+    thread.start()
+    return thread
+
+
+def remove_unused(directory, manifests):
+    # Files of the previous manifest stay for requests still reading them
+    keep = {MANIFEST, STALE_MARKER}
+    for manifest in manifests:
+        for entry in (manifest or {}).get('formats', {}).values():
+            keep.update(entry['files'].values())
+    for path in directory.iterdir():
+        if path.name.startswith('menu-') and path.name not in keep:
+            path.unlink(missing_ok=True)
+
+
+def read_manifest(directory):
+    path = directory / MANIFEST
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _manifest_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, json.loads(path.read_bytes()))
+        _manifest_cache[path] = cached
+    return cached[1]
+
+
+def current_manifest():
+    """The manifest to serve from, rebuilt first if missing or stale. While
+    one thread rebuilds a stale snapshot the others keep serving it.
+
+    The request only renders the formats; compressing them (the slow part)
+    runs in a background thread afterwards."""
+    directory = get_snapshot_dir()
+    manifest = read_manifest(directory)
+    if manifest is not None and manifest['marker'] == marker_token(directory):
+        return manifest
+    rebuilt = False
+    if _build_lock.acquire(blocking=manifest is None):
+        try:
+            manifest = read_manifest(directory)
+            if manifest is None or manifest['marker'] != marker_token(directory):
+                manifest = build_snapshot(directory, compress=False)
+                rebuilt = True
+        except Exception:
+            if manifest is None:
+                raise
+            logger.exception('Menu snapshot rebuild failed, serving the previous one')
+        finally:
+            _build_lock.release()
+    if rebuilt and any(set(ENCODINGS) - set(entry['files']) for entry in manifest['formats'].values()):
+        start_compression(directory)
+    return manifest
+
+
+def choose_encoding(request, files):
+    accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    for encoding in ('br', 'gzip'):
+        if encoding in files and re.search(r'\b%s\b' % encoding, accepted):
+            return encoding
+    return 'identity'
@@ -0,0 +1,49 @@
+from django.conf import settings
+from rest_framework_csv.renderers import CSVStreamingRenderer
+from rest_framework_yaml.encoders import SafeDumper
+from rest_framework_yaml.renderers import YAMLRenderer
+import yaml
+
+from .models import MenuItem
+from .serializers import MenuHyperItemsSerializer
+
+# Rows fetched from the database per round trip while streaming
+EXPORT_CHUNK_SIZE = 2000
+
+
+def menu_export_rows(request):
+    """Yields serialized menu items one at a time.
+
+    The queryset is read with .iterator() so only one chunk of model
+    instances is alive at once, and a single serializer instance is reused
+    for every row.
+    """
+    chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', EXPORT_CHUNK_SIZE)
+    serializer = MenuHyperItemsSerializer(context={'request': request})
+    # The hyperlinked category only needs category_id, so no join here
+    for item in MenuItem.objects.order_by('id').iterator(chunk_size=chunk_size):
+        yield serializer.to_representation(item)
+
+
+def stream_csv(rows, header):
+    # Same columns as CSVRenderer, which sorts the flattened keys
+    renderer = CSVStreamingRenderer()
+    return renderer.render(rows, renderer_context={'header': sorted(header)})
+
+
+def stream_yaml(rows):
+    # Dumping each item as a one-element list concatenates into the same
+    # document YAMLRenderer produces for the whole list
+    renderer = YAMLRenderer
+    empty = True
+    for row in rows:
+        empty = False
+        yield yaml.dump(
+            [row],
+            encoding=renderer.charset,
+            Dumper=SafeDumper,
+            allow_unicode=not renderer.ensure_ascii,
+            default_flow_style=renderer.default_flow_style,
+        )
+    if empty:
+        yield yaml.dump([], encoding=renderer.charset, Dumper=SafeDumper)
@@ -0,0 +1,45 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db.models import Case, DecimalField, Value, When
+
+# Used by categories that don't set their own rate (Category.tax_rate)
+DEFAULT_TAX_RATE = Decimal('0.10')
+CENTS = Decimal('0.01')
+
+# Prices per UPDATE statement when a whole category is repriced
+REFRESH_BATCH_SIZE = 500
+
+
+def price_after_tax(price, rate):
+    """Exact decimal price * (1 + rate), rounded half-up to cents."""
+    if not isinstance(price, Decimal):
+        # Through str() so a float price keeps its shortest repr, not its
+        # binary expansion
+        price = Decimal(str(price))
+    return (price * (1 + rate)).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def fill_prices_after_tax(items, rates):
+    """Sets price_after_tax on every item from {category_id: rate}, computing
+    each distinct (price, rate) pair once."""
+    computed = {}
+    for item in items:
+        key = (item.price, rates[item.category_id])
+        if key not in computed:
+            computed[key] = price_after_tax(*key)
+        item.price_after_tax = computed[key]
+
+
+def refresh_prices_after_tax(queryset, rate):
+    """Recomputes price_after_tax for every item in the queryset at the given
+    rate: one UPDATE per REFRESH_BATCH_SIZE distinct prices, mapping price
+    to its after-tax price with CASE, instead of one query per row."""
+    prices = sorted(set(queryset.values_list('price', flat=True)))
+    updated = 0
+    for start in range(0, len(prices), REFRESH_BATCH_SIZE):
+        batch = prices[start:start + REFRESH_BATCH_SIZE]
+        updated += queryset.filter(price__in=batch).update(price_after_tax=Case(
+            *[When(price=price, then=Value(price_after_tax(price, rate))) for price in batch],
+            output_field=DecimalField(max_digits=8, decimal_places=2),
+        ))
+    return updated
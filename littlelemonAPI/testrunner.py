@@ -0,0 +1,27 @@
+import tempfile
+from pathlib import Path
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TempStateTestRunner(DiscoverRunner):
+    """Runs the tests with the files shared by the worker processes (menu
+    version, throttle counters, menu snapshot) in a temporary directory, so
+    a test run never touches the ones under BASE_DIR."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.state_dir = tempfile.TemporaryDirectory(prefix='littlelemon-test-')
+        directory = Path(self.state_dir.name)
+        self.state_settings = override_settings(
+            MENU_VERSION_FILE=directory / 'menu.version',
+            THROTTLE_STORE=directory / 'throttle.sqlite3',
+            SNAPSHOT_DIR=directory / 'snapshots',
+        )
+        self.state_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.state_settings.disable()
+        self.state_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
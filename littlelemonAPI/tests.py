@@ -1,3 +1,1759 @@
-from django.test import TestCase
+import gzip
+import itertools
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import warnings
+from base64 import urlsafe_b64encode
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+import msgpack
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.core.paginator import Paginator, UnorderedObjectListWarning
+from django.conf import settings
+from django.db import IntegrityError, connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.authtoken.models import Token
+from rest_framework.relations import Hyperlink, HyperlinkedRelatedField
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.reverse import reverse as drf_reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import bulk, compression, inventory, metrics, routers, snapshot, tax, views
+from .authentication import auth_cache
+from .cache import LRULocMemCache, get_menu_cache, get_menu_version, stats as cache_stats, write_menu_version
+from .categories import category_registry
+from .filters import menu_item_query
+from .models import Category, MenuChange, MenuItem
+from .pagination import MenuItemKeysetPagination
+from .views import MenuItemsViewSet
+from .querybudget import QueryBudgetExceeded, QueryCounter
+from .throttles import SlidingWindowStore
+from .serializers import (CachedHyperlinkedRelatedField, CategorySerializer, MenuHyperItemsSerializer,
+                          MenuItemsListSerializer, MenuItemsSerializer)
+from .search import install_search_triggers, fallback_search, fts_enabled, search_menu_items
 
 # Create your tests here.
+class MenuTestMixin:
+    def make_items(self, count, category=None, start=0):
+        # Run the on-commit hooks (menu version bump) as a committed write would
+        with self.captureOnCommitCallbacks(execute=True):
+            category = category or Category.objects.create(slug='food', title='Food')
+            return [
+                MenuItem.objects.create(
+                    title='Item %d' % i, price=Decimal('2.50') + i, inventory=10, category=category)
+                for i in range(start, start + count)
+            ]
+
+    def count_queries(self, url, **extra):
+        with QueryCounter() as counter:
+            response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200, url)
+        return counter.count
+
+
+class QueryBudgetTest(MenuTestMixin, TestCase):
+    list_urls = [
+        '/api/menu-items',
+        '/api/menu',
+        '/api/menu-items-des/?perpage=50',
+        '/api/menuhtml',
+        '/api/menu-items-csv',
+        '/api/menu-items-yaml',
+        '/api/menu-items-view',
+        '/api/menu-items-throttle',
+    ]
+
+    def test_list_query_count_does_not_grow_with_rows(self):
+        category = Category.objects.create(slug='food', title='Food')
+        self.make_items(1, category)
+        small = {url: self.count_queries(url) for url in self.list_urls}
+        self.make_items(5, Category.objects.create(slug='drinks', title='Drinks'), start=1)
+        for url in self.list_urls:
+            self.assertEqual(self.count_queries(url), small[url], url)
+
+    def test_detail_views_query_once(self):
+        item = self.make_items(1)[0]
+        category_registry.current()
+        # The object itself (+ the ETag lookup where conditional GETs are on);
+        # the nested category comes from the registry
+        for url, queries in [('/api/menu-items/%d', 2), ('/api/menu/%d', 2), ('/api/menu-items-view/%d', 1)]:
+            self.assertEqual(self.count_queries(url % item.pk), queries, url)
+
+    @override_settings(QUERY_BUDGET=0, QUERY_BUDGET_STRICT=True)
+    def test_strict_budget_raises(self):
+        self.make_items(1)
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get('/api/menu-items')
+
+    @override_settings(QUERY_BUDGET=0)
+    def test_budget_logs_by_default(self):
+        self.make_items(1)
+        with self.assertLogs('littlelemonAPI.querybudget', 'WARNING'):
+            self.client.get('/api/menu-items')
+
+
+class KeysetPaginationTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        category = Category.objects.create(slug='food', title='Food')
+        # Duplicate prices so the id tie-breaker matters
+        self.items = [
+            MenuItem.objects.create(title='Item %d' % i, price=Decimal(2 + i // 2), inventory=i % 3,
+                                    category=category)
+            for i in range(7)
+        ]
+
+    def walk(self, url):
+        ids, links = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+            links.append(url)
+        return ids, links
+
+    def expected(self, *ordering):
+        return list(MenuItem.objects.order_by(*ordering).values_list('id', flat=True))
+
+    def test_walks_every_row_once_in_order(self):
+        for url, ordering in [
+            ('/api/menu-items-des/?pagination=keyset', ('price', 'id')),
+            ('/api/menu-items-des/?pagination=keyset&ordering=-price&perpage=3', ('-price', '-id')),
+            ('/api/menu-items-view?pagination=keyset&ordering=inventory', ('inventory', 'id')),
+            ('/api/menu-items-throttle?pagination=keyset&ordering=-inventory', ('-inventory', '-id')),
+        ]:
+            ids, _ = self.walk(url)
+            self.assertEqual(ids, self.expected(*ordering), url)
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.client.get('/api/menu-items-des/?pagination=keyset').data
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual(back['results'], first['results'])
+
+    def test_page_queries_do_not_depend_on_depth(self):
+        url = '/api/menu-items-view?pagination=keyset'
+        _, links = self.walk(url)
+        deepest = links[-2]
+        self.assertEqual(self.count_queries(url), self.count_queries(deepest))
+
+    def test_rejects_bad_cursor_and_ordering(self):
+        self.assertEqual(self.client.get('/api/menu-items-des/?cursor=garbage').status_code, 404)
+        self.assertEqual(
+            self.client.get('/api/menu-items-des/?pagination=keyset&ordering=title').status_code, 400)
+
+    def test_rejects_tampered_cursor_values(self):
+        def cursor(position):
+            return urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+        for ordering, value in [('price', 'abc'), ('price', 'Infinity'), ('price', None), ('price', [1]),
+                                ('inventory', '1.5x'), ('-inventory', {'a': 1})]:
+            token = cursor({'o': ordering, 'v': [value, 1], 'r': False})
+            url = '/api/menu-items-des/?ordering=%s&cursor=%s' % (ordering, token)
+            self.assertEqual(self.client.get(url).status_code, 404, (ordering, value))
+        token = cursor({'o': 'price', 'v': ['3.50', 1], 'r': False})
+        self.assertEqual(self.client.get('/api/menu-items-des/?cursor=%s' % token).status_code, 200)
+
+    def test_page_number_pagination_is_still_default(self):
+        response = self.client.get('/api/menu-items-view')
+        self.assertEqual(response.data['count'], 7)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.food = Category.objects.create(slug='food', title='Food')
+        self.drinks = Category.objects.create(slug='drinks', title='Drinks')
+        self.pizza = MenuItem.objects.create(title='Pizza', price=5, inventory=1, category=self.food)
+        self.pizza_bbq = MenuItem.objects.create(
+            title='Pizza Barbecue Pizza', price=6, inventory=1, category=self.food)
+        self.soda = MenuItem.objects.create(title='Soda', price=2, inventory=1, category=self.drinks)
+
+    def search(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        rows = response.data['results'] if isinstance(response.data, dict) else response.data
+        return [row['title'] for row in rows]
+
+    def test_uses_fts_index(self):
+        self.assertTrue(fts_enabled())
+        sql = str(search_menu_items(MenuItem.objects.all(), 'piz').query)
+        self.assertIn('MATCH', sql)
+
+    def test_prefix_search_ranked(self):
+        self.assertEqual(self.search('/api/menu-items-des/?search=piz&perpage=10'),
+                         ['Pizza Barbecue Pizza', 'Pizza'])
+        self.assertEqual(self.search('/api/menu-items-des/?search=barb piz'), ['Pizza Barbecue Pizza'])
+
+    def test_viewset_searches_category_title(self):
+        self.assertEqual(self.search('/api/menu-items-view?search=drink'), ['Soda'])
+        # menu_items_des only searches the item title
+        self.assertEqual(self.search('/api/menu-items-des/?search=drink'), [])
+
+    def test_explicit_ordering_replaces_rank(self):
+        self.assertEqual(self.search('/api/menu-items-view?search=pizza&ordering=price'),
+                         ['Pizza', 'Pizza Barbecue Pizza'])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.soda.title = 'Lemonade'
+        self.soda.save()
+        self.drinks.title = 'Beverages'
+        self.drinks.save()
+        self.pizza.delete()
+        self.assertEqual(self.search('/api/menu-items-view?search=lemon'), ['Lemonade'])
+        self.assertEqual(self.search('/api/menu-items-view?search=bever'), ['Lemonade'])
+        self.assertEqual(self.search('/api/menu-items-view?search=soda'), [])
+        self.assertEqual(self.search('/api/menu-items-des/?search=pizza&perpage=10'),
+                         ['Pizza Barbecue Pizza'])
+
+    def test_operators_are_quoted(self):
+        self.assertEqual(self.search('/api/menu-items-des/?search=pizza OR "soda" NEAR(x)'), [])
+
+    def test_missing_triggers_are_reinstalled(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER "littlelemonAPI_menuitem_fts_ai"')
+        install_search_triggers()
+        MenuItem.objects.create(title='Tiramisu', price=4, inventory=1, category=self.food)
+        self.assertEqual(self.search('/api/menu-items-view?search=tira'), ['Tiramisu'])
+
+    def test_fallback_without_index(self):
+        items = fallback_search(MenuItem.objects.all(), 'izz', ['title'])
+        self.assertEqual(set(items), {self.pizza, self.pizza_bbq})
+
+
+class ResponseCacheTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        cache_stats.reset()
+        self.item = self.make_items(1)[0]
+
+    def test_second_read_is_served_from_cache(self):
+        first = self.client.get('/api/menu')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        # Only the menu item ETag aggregate runs (categories: the registry)
+        with self.assertNumQueries(1):
+            second = self.client.get('/api/menu')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], first['Content-Type'])
+        self.assertEqual(cache_stats.as_dict(), {'hits': 1, 'misses': 1})
+
+    def test_key_includes_query_params_and_renderer(self):
+        self.client.get('/api/menu-items')
+        self.assertEqual(self.client.get('/api/menu-items?page=2')['X-Cache'], 'MISS')
+        xml = self.client.get('/api/menu-items', HTTP_ACCEPT='application/xml')
+        self.assertEqual(xml['X-Cache'], 'MISS')
+        self.assertTrue(xml['Content-Type'].startswith('application/xml'))
+
+    def test_writes_invalidate(self):
+        url = '/api/menu/%d' % self.item.pk
+        self.client.get(url)
+        self.item.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['title'], 'Renamed')
+
+        self.client.get('/api/category/%d' % self.item.category_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.filter(pk=self.item.category_id).get().save()
+        self.assertEqual(self.client.get('/api/category/%d' % self.item.category_id)['X-Cache'], 'MISS')
+
+    def test_version_moves_after_commit(self):
+        version = get_menu_version()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.item.save()
+        self.assertEqual(get_menu_version(), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_menu_version(), version)
+
+    def test_version_is_shared_between_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'menu.version')
+            with override_settings(MENU_VERSION_FILE=path):
+                self.client.get('/api/menu')
+                self.assertEqual(self.client.get('/api/menu')['X-Cache'], 'HIT')
+                # A write in another worker process
+                process = multiprocessing.get_context('fork').Process(target=write_menu_version, args=(path,))
+                process.start()
+                process.join()
+                self.assertEqual(process.exitcode, 0)
+                self.assertEqual(self.client.get('/api/menu')['X-Cache'], 'MISS')
+
+    def test_post_and_browsable_api_bypass_cache(self):
+        self.client.get('/api/menu-items', HTTP_ACCEPT='text/html')
+        self.assertEqual(self.client.get('/api/menu-items', HTTP_ACCEPT='text/html')['X-Cache'], 'MISS')
+        response = self.client.post('/api/menu-items', {
+            'title': 'New', 'price': '5.00', 'stock': 3, 'category_id': self.item.category_id})
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('X-Cache', response)
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = LRULocMemCache('lru-test', {'OPTIONS': {'MAX_ENTRIES': 2}})
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+
+class ConditionalGetTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.item = self.make_items(2)[0]
+
+    def test_unchanged_poll_gets_304_without_serializing(self):
+        for url in ['/api/menu', '/api/menu-items', '/api/categories',
+                    '/api/menu/%d' % self.item.pk, '/api/menu-items/%d' % self.item.pk,
+                    '/api/category/%d' % self.item.category_id]:
+            first = self.client.get(url)
+            self.assertIn('ETag', first, url)
+            self.assertIn('Last-Modified', first, url)
+            with mock.patch.object(MenuItemsSerializer, 'to_representation') as items, \
+                    mock.patch.object(CategorySerializer, 'to_representation') as categories:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+                self.assertEqual(response.status_code, 304, url)
+                response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+                self.assertEqual(response.status_code, 304, url)
+            items.assert_not_called()
+            categories.assert_not_called()
+
+    def test_etag_changes_on_write(self):
+        etag = self.client.get('/api/menu')['ETag']
+        self.item.inventory = 0
+        self.item.save()
+        self.assertEqual(self.client.get('/api/menu', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get('/api/menu')['ETag']
+        self.item.delete()
+        self.assertEqual(self.client.get('/api/menu', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_depends_on_query_and_renderer(self):
+        etag = self.client.get('/api/menu-items')['ETag']
+        self.assertNotEqual(self.client.get('/api/menu-items?page=2')['ETag'], etag)
+        self.assertNotEqual(self.client.get('/api/menu-items', HTTP_ACCEPT='application/xml')['ETag'], etag)
+
+    def test_category_change_invalidates_nested_item(self):
+        url = '/api/menu/%d' % self.item.pk
+        etag = self.client.get(url)['ETag']
+        self.item.category.title = 'Mains'
+        self.item.category.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_missing_object_and_writes_unaffected(self):
+        self.assertEqual(self.client.get('/api/menu/999').status_code, 404)
+        response = self.client.put('/api/menu-items/%d' % self.item.pk, {
+            'title': 'Changed', 'price': '9.00', 'stock': 1, 'category_id': self.item.category_id,
+        }, content_type='application/json', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 200)
+
+
+class StreamingExportTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+
+    def assertStreamMatches(self, stream_url, url):
+        response = self.client.get(stream_url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), self.client.get(url).content)
+
+    def test_csv_stream_matches_csv_export(self):
+        self.make_items(5)
+        self.assertStreamMatches('/api/menu-items-csv-stream', '/api/menu-items-csv')
+
+    def test_yaml_stream_matches_yaml_export(self):
+        self.make_items(5)
+        self.assertStreamMatches('/api/menu-items-yaml-stream', '/api/menu-items-yaml')
+        with self.captureOnCommitCallbacks(execute=True):
+            MenuItem.objects.all().delete()
+        self.assertStreamMatches('/api/menu-items-yaml-stream', '/api/menu-items-yaml')
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_yields_one_row_at_a_time(self):
+        self.make_items(5)
+        content = iter(self.client.get('/api/menu-items-csv-stream').streaming_content)
+        # Header row goes out before any item has been read
+        self.assertEqual(next(content), b'category,id,price,price_after_tax,stock,title\r\n')
+        self.assertEqual(len(list(content)), 5)
+
+
+class FastListSerializerTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        food = Category.objects.create(slug='food', title='Food')
+        drinks = Category.objects.create(slug='drinks', title='Drinks & Co')
+        for title, price, inventory, category in [
+            ('Pizza', '2.5', 2, food), ('Crème brûlée', '10', 0, food), ('Soda', '1.55', 400, drinks),
+            ('Beef <b>Steak</b>', '9999.99', -3, food), ('Tea', '0.01', 1, drinks),
+        ]:
+            MenuItem.objects.create(title=title, price=Decimal(price), inventory=inventory, category=category)
+
+    def slow(self, items):
+        # The generic DRF path, one full child serialization per row
+        return [MenuItemsSerializer(item).data for item in items]
+
+    def assertSameOutput(self, data, items):
+        fast = MenuItemsSerializer(data, many=True).data
+        slow = self.slow(items)
+        self.assertEqual(fast, slow)
+        self.assertEqual([list(row) for row in fast], [list(row) for row in slow])
+        self.assertEqual(JSONRenderer().render(fast), JSONRenderer().render(slow))
+
+    def test_queryset(self):
+        queryset = MenuItem.objects.for_serializer().order_by('id')
+        self.assertSameOutput(queryset, list(queryset))
+
+    def test_manager_and_list_of_instances(self):
+        items = list(MenuItem.objects.order_by('id'))
+        self.assertSameOutput(items, items)
+        self.assertSameOutput(MenuItem.objects, list(MenuItem.objects.all()))
+
+    def test_django_page_and_empty(self):
+        page = Paginator(MenuItem.objects.order_by('-price'), 2).page(2)
+        self.assertSameOutput(page, list(page))
+        self.assertSameOutput(MenuItem.objects.none(), [])
+
+    def test_search_queryset_uses_instances(self):
+        queryset = search_menu_items(MenuItem.objects.for_serializer(), 'pizza')
+        self.assertSameOutput(queryset, list(queryset))
+
+    def test_values_path_queries_once(self):
+        # Menu item columns only - categories come from the registry
+        category_registry.current()
+        with self.assertNumQueries(1):
+            MenuItemsSerializer(MenuItem.objects.all(), many=True).data
+
+    def test_endpoints_match_generic_path(self):
+        urls = ['/api/menu-items-des/?perpage=10', '/api/menu-items-view?page=2',
+                '/api/menu-items?page=1', '/api/menu-items-des/?pagination=keyset']
+        for url in urls:
+            fast = self.client.get(url).content
+            with mock.patch.object(MenuItemsListSerializer, 'to_representation',
+                                   serializers.ListSerializer.to_representation):
+                get_menu_cache().clear()
+                self.assertEqual(self.client.get(url).content, fast, url)
+
+    def test_subclasses_use_generic_path(self):
+        class Subclass(MenuItemsSerializer):
+            extra = serializers.SerializerMethodField()
+
+            def get_extra(self, product):
+                return 'x'
+
+            class Meta(MenuItemsSerializer.Meta):
+                fields = MenuItemsSerializer.Meta.fields + ['extra']
+
+        self.assertEqual(Subclass(MenuItem.objects.all(), many=True).data[0]['extra'], 'x')
+
+
+class BulkMenuItemsTest(MenuTestMixin, TestCase):
+    url = '/api/menu-items/bulk'
+
+    def setUp(self):
+        self.category = Category.objects.create(slug='food', title='Food')
+        self.existing = MenuItem.objects.create(title='Pizza', price=5, inventory=1, category=self.category)
+        self.client.force_login(User.objects.create_superuser('admin', password='secret-pass-123'))
+
+    def send(self, method, data):
+        return getattr(self.client, method)(self.url, data, content_type='application/json')
+
+    def payload(self, count, start=0):
+        return [{'title': 'Dish %d' % i, 'price': '%d.50' % (i + 2), 'stock': i,
+                 'category_id': self.category.pk} for i in range(start, start + count)]
+
+    def test_create_uses_constant_queries(self):
+        category_registry.current()
+        # (up to SQLite's bound-parameter limit per INSERT batch)
+        with QueryCounter() as small:
+            self.assertEqual(self.send('post', self.payload(2)).status_code, 201)
+        with QueryCounter() as large:
+            response = self.send('post', self.payload(100, start=2))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(small.count, large.count)
+        self.assertEqual(MenuItem.objects.count(), 103)
+        self.assertEqual(response.data[0]['category']['title'], 'Food')
+        self.assertEqual(response.data[0], MenuItemsSerializer(MenuItem.objects.get(pk=response.data[0]['id'])).data)
+
+    def test_create_reports_per_item_errors_and_writes_nothing(self):
+        data = self.payload(5)
+        data[0].update(title='Pizza', price='5.00')
+        data[1]['price'] = '1.00'
+        data[2]['category_id'] = 999
+        data[4].update(title=data[3]['title'], price=data[3]['price'])
+        response = self.send('post', data)
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual(errors[0], {'non_field_errors': ['The fields title, price must make a unique set.']})
+        self.assertIn('non_field_errors', errors[1])
+        self.assertEqual(errors[2], {'category_id': ['Invalid category.']})
+        self.assertEqual(errors[3], {})
+        self.assertEqual(errors[4], {'non_field_errors': ['The fields title, price must make a unique set.']})
+        self.assertEqual(MenuItem.objects.count(), 1)
+
+    def test_titles_are_sanitized(self):
+        data = self.payload(1)
+        data[0]['title'] = '<script>x</script>'
+        self.send('post', data)
+        self.assertEqual(MenuItem.objects.get(price='2.50').title, '&lt;script&gt;x&lt;/script&gt;')
+
+    def test_update(self):
+        other = MenuItem.objects.create(title='Soda', price=2, inventory=1, category=self.category)
+        # An item can take over the title/price another item in the batch
+        # releases, in either order
+        response = self.send('put', [
+            {'id': self.existing.pk, 'title': 'Soda', 'price': '2.00', 'stock': 9, 'category_id': self.category.pk},
+            {'id': other.pk, 'title': 'Water', 'price': '3.00', 'stock': 3, 'category_id': self.category.pk},
+        ])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.title, self.existing.inventory), ('Soda', 9))
+        self.assertGreater(self.existing.updated_at, other.updated_at)
+
+        response = self.send('put', [{'id': 999, 'title': 'x', 'price': '3', 'stock': 1, 'category_id': 1}])
+        self.assertEqual(response.json(), [{'id': ['Not found.']}])
+
+    def test_update_rejects_swaps(self):
+        other = MenuItem.objects.create(title='Soda', price=2, inventory=1, category=self.category)
+        third = MenuItem.objects.create(title='Water', price=3, inventory=1, category=self.category)
+        response = self.send('put', [
+            {'id': self.existing.pk, 'title': 'Soda', 'price': '2.00', 'stock': 9, 'category_id': self.category.pk},
+            {'id': other.pk, 'title': 'Pizza', 'price': '5.00', 'stock': 3, 'category_id': self.category.pk},
+            {'id': third.pk, 'title': 'Juice', 'price': '3.00', 'stock': 3, 'category_id': self.category.pk},
+        ])
+        self.assertEqual(response.status_code, 400)
+        swap = {'non_field_errors': ['Swaps title/price with another item in the batch.']}
+        self.assertEqual(response.json(), [swap, swap, {}])
+        self.assertEqual(MenuItem.objects.get(pk=third.pk).title, 'Water')
+
+    def test_update_chain_runs_in_passes(self):
+        self.send('post', self.payload(4))
+        items = list(MenuItem.objects.exclude(pk=self.existing.pk).order_by('price'))
+        # Each item takes the title/price of the next one, the last a new one
+        data = [{'id': item.pk, 'title': following.title, 'price': str(following.price), 'stock': 1,
+                 'category_id': self.category.pk} for item, following in zip(items, items[1:])]
+        data.append({'id': items[-1].pk, 'title': 'New', 'price': '9.00', 'stock': 1, 'category_id': self.category.pk})
+        response = self.send('put', data)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([item.title for item in MenuItem.objects.exclude(pk=self.existing.pk).order_by('pk')],
+                         ['Dish 1', 'Dish 2', 'Dish 3', 'New'])
+
+    def test_query_budget_grows_with_the_batch(self):
+        # Six batches - well over a fixed budget
+        with self.assertNoLogs('littlelemonAPI.querybudget', 'WARNING'):
+            self.assertEqual(self.send('post', self.payload(3000)).status_code, 201)
+            ids = list(MenuItem.objects.exclude(pk=self.existing.pk).values_list('id', flat=True))
+            self.assertEqual(self.send('delete', ids).json(), {'deleted': 3000})
+
+    def test_delete(self):
+        other = MenuItem.objects.create(title='Soda', price=2, inventory=1, category=self.category)
+        self.assertEqual(self.send('delete', [self.existing.pk, 999]).json(), [{}, {'id': ['Not found.']}])
+        self.assertEqual(self.send('delete', [self.existing.pk, other.pk]).json(), {'deleted': 2})
+        self.assertFalse(MenuItem.objects.exists())
+
+    def test_delete_runs_no_per_row_queries(self):
+        self.send('post', self.payload(200))
+        touched = Category.objects.get().updated_at
+        ids = list(MenuItem.objects.exclude(pk=self.existing.pk).values_list('id', flat=True))
+        with QueryCounter() as small:
+            self.assertEqual(self.send('delete', ids[:2]).json(), {'deleted': 2})
+        with QueryCounter() as large:
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.assertEqual(self.send('delete', ids[2:]).json(), {'deleted': 198})
+        # The collector deletes 100 rows per statement; nothing else grows
+        self.assertEqual(large.count, small.count + 1)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(list(MenuItem.objects.all()), [self.existing])
+        self.assertEqual(MenuChange.objects.filter(action=MenuChange.DELETE).count(), 200)
+        self.assertGreater(Category.objects.get().updated_at, touched)
+
+    def test_writes_invalidate_response_cache(self):
+        get_menu_cache().clear()
+        self.client.get('/api/menu')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.send('post', self.payload(1))
+        response = self.client.get('/api/menu')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.data), 2)
+
+    def test_admin_only(self):
+        self.client.logout()
+        self.assertEqual(self.send('post', self.payload(1)).status_code, 401)
+        self.client.force_login(User.objects.create_user('alice', password='secret-pass-123'))
+        self.assertEqual(self.send('delete', [self.existing.pk]).status_code, 403)
+        self.assertTrue(MenuItem.objects.filter(pk=self.existing.pk).exists())
+
+    @override_settings(BULK_MAX_ITEMS=2)
+    def test_rejects_non_lists_and_oversized_batches(self):
+        self.assertEqual(self.send('post', {'title': 'x'}).status_code, 400)
+        self.assertEqual(self.send('post', self.payload(3)).status_code, 400)
+
+
+class InventoryReservationTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(slug='food', title='Food')
+        self.pizza = MenuItem.objects.create(title='Pizza', price=5, inventory=5, category=category)
+        self.soda = MenuItem.objects.create(title='Soda', price=2, inventory=1, category=category)
+        self.client.force_login(User.objects.create_user('alice', password='secret-pass-123'))
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type='application/json')
+
+    def test_requires_authentication(self):
+        self.client.logout()
+        for url, data in [('/api/menu-items/%d/reserve' % self.pizza.pk, {'quantity': 1}),
+                          ('/api/menu-items/%d/release' % self.pizza.pk, {'quantity': 1}),
+                          ('/api/menu-items/reserve', {'items': [{'id': self.pizza.pk, 'quantity': 1}]}),
+                          ('/api/menu-items/release', {'items': [{'id': self.pizza.pk, 'quantity': 1}]})]:
+            self.assertEqual(self.post(url, data).status_code, 401, url)
+        self.assertEqual(self.stock(self.pizza), 5)
+
+    def stock(self, item):
+        item.refresh_from_db()
+        return item.inventory
+
+    def test_reserve_and_release(self):
+        response = self.post('/api/menu-items/%d/reserve' % self.pizza.pk, {'quantity': 3})
+        self.assertEqual(response.json(), {'id': self.pizza.pk, 'stock': 2})
+        response = self.post('/api/menu-items/%d/release' % self.pizza.pk, {'quantity': 1})
+        self.assertEqual(response.json(), {'id': self.pizza.pk, 'stock': 3})
+
+    def test_rejects_oversell(self):
+        response = self.post('/api/menu-items/%d/reserve' % self.pizza.pk, {'quantity': 6})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['available'], 5)
+        self.assertEqual(self.stock(self.pizza), 5)
+        response = self.post('/api/menu-items/%d/release' % self.pizza.pk, {'quantity': 32767})
+        self.assertEqual(response.status_code, 409)
+
+    def test_validation_and_missing_item(self):
+        self.assertEqual(self.post('/api/menu-items/%d/reserve' % self.pizza.pk, {'quantity': 0}).status_code, 400)
+        self.assertEqual(self.post('/api/menu-items/999/reserve', {'quantity': 1}).status_code, 404)
+
+    def test_batch_is_all_or_nothing(self):
+        response = self.post('/api/menu-items/reserve', {'items': [
+            {'id': self.pizza.pk, 'quantity': 2}, {'id': self.soda.pk, 'quantity': 2}]})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['id'], self.soda.pk)
+        self.assertEqual((self.stock(self.pizza), self.stock(self.soda)), (5, 1))
+
+        response = self.post('/api/menu-items/reserve', {'items': [
+            {'id': self.pizza.pk, 'quantity': 2}, {'id': self.soda.pk, 'quantity': 1},
+            {'id': self.pizza.pk, 'quantity': 1}]})
+        self.assertEqual(response.json(), {'items': [
+            {'id': self.pizza.pk, 'stock': 2}, {'id': self.soda.pk, 'stock': 0}]})
+        response = self.post('/api/menu-items/release', {'items': [{'id': self.soda.pk, 'quantity': 4}]})
+        self.assertEqual(response.json(), {'items': [{'id': self.soda.pk, 'stock': 4}]})
+
+    def test_bumps_menu_version(self):
+        version = get_menu_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.reserve(self.pizza.pk, 1)
+        self.assertNotEqual(get_menu_version(), version)
+
+
+class InventoryConcurrencyTest(TransactionTestCase):
+    threads = 8
+    attempts = 25
+
+    def test_concurrent_reservations_never_oversell(self):
+        category = Category.objects.create(slug='food', title='Food')
+        item = MenuItem.objects.create(title='Pizza', price=5, inventory=100, category=category)
+        barrier = threading.Barrier(self.threads)
+        results = Counter()
+
+        def worker():
+            barrier.wait()
+            try:
+                for _ in range(self.attempts):
+                    try:
+                        inventory.reserve(item.pk, 1)
+                        results['reserved'] += 1
+                    except inventory.InsufficientStock:
+                        results['rejected'] += 1
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.threads) as executor:
+            for future in [executor.submit(worker) for _ in range(self.threads)]:
+                future.result()
+
+        item.refresh_from_db()
+        self.assertEqual(results['reserved'], 100)
+        self.assertEqual(results['rejected'], self.threads * self.attempts - 100)
+        self.assertEqual(item.inventory, 0)
+
+
+def throttle_worker(args):
+    path, hits = args
+    store = SlidingWindowStore(path)
+    return sum(store.hit('shared', 15, 60, 30.0)[0] for _ in range(hits))
+
+
+class SharedThrottleTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'throttle.sqlite3')
+        self.store = SlidingWindowStore(self.path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_sliding_window(self):
+        self.assertEqual([self.store.hit('k', 5, 60, 10.0)[0] for _ in range(6)], [True] * 5 + [False])
+        allowed, wait = self.store.hit('k', 5, 60, 59.0)
+        self.assertFalse(allowed)
+        # Half-way through the next window half of the old hits still count
+        self.assertEqual([self.store.hit('k', 5, 60, 90.0)[0] for _ in range(3)], [True, True, False])
+        # Two windows later everything has expired
+        self.assertEqual([self.store.hit('k', 5, 60, 300.0)[0] for _ in range(5)], [True] * 5)
+
+    def test_wait_time(self):
+        for _ in range(5):
+            self.store.hit('k', 5, 60, 0.0)
+        allowed, wait = self.store.hit('k', 5, 60, 30.0)
+        self.assertFalse(allowed)
+        # Allowed again once 5 * (1 - elapsed) <= 4, 12s into the next window
+        self.assertAlmostEqual(wait, 42.0)
+        self.assertTrue(self.store.hit('k', 5, 60, 30.0 + wait)[0])
+
+    def test_counters_shared_across_processes(self):
+        with multiprocessing.get_context('fork').Pool(4) as pool:
+            allowed = pool.map(throttle_worker, [(self.path, 10)] * 4)
+        self.assertEqual(sum(allowed), 15)
+
+    def test_constant_memory_per_key(self):
+        for second in range(100):
+            self.store.hit('k', 1000, 10, float(second))
+        rows = self.store.connect().execute('SELECT COUNT(*) FROM throttle').fetchone()[0]
+        self.assertEqual(rows, 1)
+
+    def test_views_use_shared_store(self):
+        with override_settings(THROTTLE_STORE=self.path):
+            statuses = [self.client.get('/api/throttle-check').status_code for _ in range(3)]
+            self.assertEqual(statuses, [200, 200, 429])
+            self.assertIn('Retry-After', self.client.get('/api/throttle-check'))
+
+
+class AuthCacheTest(TestCase):
+    def setUp(self):
+        auth_cache.clear()
+        self.user = User.objects.create_user('alice', password='secret-pass-123')
+        self.token = Token.objects.create(user=self.user)
+        self.managers = Group.objects.create(name='Manager')
+        self.auth = {'HTTP_AUTHORIZATION': 'Token %s' % self.token.key}
+
+    def manager_view(self, **auth):
+        return self.client.get('/api/manager-view/', **auth)
+
+    def test_token_lookup_and_groups_are_cached(self):
+        self.managers.user_set.add(self.user)
+        self.assertEqual(self.manager_view(**self.auth).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.manager_view(**self.auth).status_code, 200)
+
+    def test_group_membership_changes_invalidate(self):
+        self.assertEqual(self.manager_view(**self.auth).status_code, 403)
+        admin = User.objects.create_superuser('admin', password='secret-pass-123')
+        admin_auth = {'HTTP_AUTHORIZATION': 'Token %s' % Token.objects.create(user=admin).key}
+        response = self.client.post('/api/groups/manager/users', {'username': 'alice'}, **admin_auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.manager_view(**self.auth).status_code, 200)
+        self.user.groups.remove(self.managers)
+        self.assertEqual(self.manager_view(**self.auth).status_code, 403)
+
+    def test_deleted_token_and_inactive_user_are_rejected(self):
+        self.assertEqual(self.manager_view(**self.auth).status_code, 403)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.manager_view(**self.auth).status_code, 401)
+        self.token.delete()
+        self.assertEqual(self.manager_view(**self.auth).status_code, 401)
+
+    def test_jwt_user_lookup_is_cached(self):
+        self.managers.user_set.add(self.user)
+        refresh = RefreshToken.for_user(self.user)
+        auth = {'HTTP_AUTHORIZATION': 'Bearer %s' % refresh.access_token}
+        self.assertEqual(self.manager_view(**auth).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.manager_view(**auth).status_code, 200)
+
+        response = self.client.post('/api/token/blacklist/', {'refresh': str(refresh)})
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(2):
+            self.manager_view(**auth)
+
+    def test_revocation_in_another_process_applies_after_the_ttl(self):
+        self.manager_view(**self.auth)
+        # Deleted as another worker would - this process isn't told
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM authtoken_token WHERE key = %s', [self.token.key])
+        self.assertEqual(self.manager_view(**self.auth).status_code, 403)
+        later = time.monotonic() + settings.AUTH_CACHE_TTL + 1
+        with mock.patch('littlelemonAPI.authentication.time.monotonic', return_value=later):
+            self.assertEqual(self.manager_view(**self.auth).status_code, 401)
+
+    @override_settings(AUTH_CACHE_TTL=0)
+    def test_entries_expire(self):
+        self.manager_view(**self.auth)
+        with self.assertNumQueries(2):
+            self.manager_view(**self.auth)
+
+    @override_settings(AUTH_CACHE_MAX_ENTRIES=2)
+    def test_cache_is_bounded(self):
+        for key in range(5):
+            auth_cache.set(key, key, 'value')
+        self.assertEqual([auth_cache.get(key) for key in range(5)], [None, None, None, 'value', 'value'])
+
+
+class TestRunnerTest(TestCase):
+    def test_shared_state_files_are_outside_base_dir(self):
+        for name in ['MENU_VERSION_FILE', 'THROTTLE_STORE', 'SNAPSHOT_DIR']:
+            path = os.path.abspath(getattr(settings, name))
+            self.assertFalse(path.startswith(os.path.abspath(settings.BASE_DIR) + os.sep), name)
+
+
+class SQLiteProfileTest(TestCase):
+    def connect(self, path, **overrides):
+        database = dict(settings.DATABASES['default'], NAME=path, **overrides)
+        alias = 'profile_test'
+        database = connections.configure_settings(
+            {'default': settings.DATABASES['default'], alias: database})[alias]
+        wrapper = connections.create_connection('default').__class__(database, alias)
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA %s' % name)
+            return cursor.fetchone()[0]
+
+    def test_production_pragmas_are_applied_on_connect(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = self.connect(os.path.join(directory, 'db.sqlite3'), **settings.SQLITE_PRODUCTION)
+            self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+            self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)
+            self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 5000)
+            self.assertEqual(self.pragma(wrapper, 'cache_size'), -65536)
+            self.assertEqual(wrapper.transaction_mode, 'IMMEDIATE')
+            wrapper.close()
+
+    def test_development_keeps_sqlite_defaults(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = self.connect(os.path.join(directory, 'db.sqlite3'))
+            self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'delete')
+            wrapper.close()
+
+
+# The test database has no real replica, so 'default' stands in for one and
+# the router's decisions are recorded: 'default' = replica, None = primary
+@override_settings(REPLICA_DATABASES=['default'])
+class ReplicaRouterTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.category = Category.objects.create(slug='food', title='Food')
+        self.make_items(3, self.category)
+        self.router = routers.ReplicaRouter()
+
+    def routed(self, method, url, **kwargs):
+        decisions = []
+        db_for_read = routers.ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            alias = db_for_read(router, model, **hints)
+            decisions.append((model, alias))
+            return alias
+
+        with mock.patch.object(routers.ReplicaRouter, 'db_for_read', record):
+            response = getattr(self.client, method)(url, **kwargs)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response, decisions
+
+    def test_safe_reads_go_to_replica(self):
+        for url in ['/api/menu-items', '/api/menu', '/api/menu-items-csv-stream']:
+            response, decisions = self.routed('get', url)
+            self.assertEqual(response.status_code, 200)
+            with self.subTest(url=url):
+                self.assertTrue(decisions)
+                self.assertEqual({alias for _, alias in decisions}, {'default'})
+        # Served from the category registry, which the reads above loaded
+        response, decisions = self.routed('get', '/api/categories')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(decisions, [])
+
+    def test_other_views_stay_on_primary(self):
+        response, decisions = self.routed('get', '/api/menu-items/1')
+        self.assertEqual({alias for _, alias in decisions}, {None})
+
+    def test_client_stays_on_primary_after_write(self):
+        admin = User.objects.create_superuser('admin', password='secret')
+        self.client.force_login(admin)
+        response = self.client.post('/api/menu-items', {
+            'title': 'New', 'price': '2.00', 'stock': 5, 'category_id': self.category.pk})
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+
+        response, decisions = self.routed('get', '/api/menu-items')
+        self.assertEqual({alias for _, alias in decisions}, {None})
+
+        self.client.cookies[routers.PIN_COOKIE] = '0'
+        response, decisions = self.routed('get', '/api/menu-items')
+        self.assertEqual({alias for _, alias in decisions}, {'default'})
+
+    def test_write_switches_request_to_primary(self):
+        token = routers._replica.set('replica')
+        try:
+            self.assertEqual(self.router.db_for_read(MenuItem), 'replica')
+            self.assertIsNone(self.router.db_for_read(User))
+            self.router.db_for_write(MenuItem)
+            self.assertIsNone(self.router.db_for_read(MenuItem))
+        finally:
+            routers._replica.reset(token)
+
+    def test_replica_responses_expire_from_cache(self):
+        with mock.patch.object(LRULocMemCache, 'set', autospec=True) as cache_set:
+            self.client.get('/api/menu-items')
+        timeouts = [call.args[3] if len(call.args) > 3 else None for call in cache_set.call_args_list]
+        self.assertEqual(timeouts, [routers.REPLICA_CACHE_TIMEOUT])
+
+
+# Backups wait for the source connection to finish its transaction
+class SyncReplicasTest(TransactionTestCase):
+    def test_copies_primary_into_replica(self):
+        Category.objects.create(slug='food', title='Food')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'replica.sqlite3')
+            replica = dict(settings.DATABASES['default'], NAME=path)
+            with mock.patch.dict(connections.settings, {'replica': replica}):
+                call_command('sync_replicas', database=['replica'], stdout=StringIO())
+            target = sqlite3.connect(path)
+            try:
+                titles = target.execute('SELECT title FROM "littlelemonAPI_category"').fetchall()
+            finally:
+                target.close()
+        self.assertEqual(titles, [('Food',)])
+
+
+class TaxTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.food = Category.objects.create(slug='food', title='Food')
+        self.drinks = Category.objects.create(slug='drinks', title='Drinks', tax_rate=Decimal('0.20'))
+
+    def test_price_after_tax_is_exact_and_quantized(self):
+        self.assertEqual(tax.price_after_tax(Decimal('2.25'), Decimal('0.10')), Decimal('2.48'))
+        self.assertEqual(tax.price_after_tax(Decimal('5.50'), Decimal('0.10')), Decimal('6.05'))
+        self.assertEqual(tax.price_after_tax(2.5, Decimal('0.20')), Decimal('3.00'))
+
+    def test_stored_on_save_and_bulk_writes(self):
+        item = MenuItem.objects.create(title='Pizza', price=Decimal('2.25'), inventory=1, category=self.food)
+        self.assertEqual(item.price_after_tax, Decimal('2.48'))
+
+        created = MenuItem.objects.bulk_create([
+            MenuItem(title='Cola', price=Decimal('2.25'), inventory=1, category=self.drinks),
+            MenuItem(title='Soup', price=Decimal('3.00'), inventory=1, category=self.food),
+        ])
+        self.assertEqual([obj.price_after_tax for obj in created], [Decimal('2.70'), Decimal('3.30')])
+
+        item.category = self.drinks
+        item.save(update_fields=['category'])
+        item.refresh_from_db()
+        self.assertEqual(item.price_after_tax, Decimal('2.70'))
+
+    def test_save_takes_the_rate_from_the_registry(self):
+        category_registry.current()
+        with CaptureQueriesContext(connection) as queries:
+            item = MenuItem.objects.create(title='Cola', price=Decimal('2.25'), inventory=1, category_id=self.drinks.pk)
+        self.assertEqual(item.price_after_tax, Decimal('2.70'))
+        self.assertFalse([query for query in queries if 'FROM "littlelemonAPI_category"' in query['sql']])
+        # A rate change drops the registry's map
+        self.drinks.tax_rate = Decimal('0.10')
+        self.drinks.save()
+        item = MenuItem.objects.create(title='Tea', price=Decimal('2.25'), inventory=1, category_id=self.drinks.pk)
+        self.assertEqual(item.price_after_tax, Decimal('2.48'))
+
+    def test_rate_change_reprices_category_in_one_update(self):
+        self.make_items(20, self.food)
+        self.food.tax_rate = Decimal('0.05')
+        # Category UPDATE + distinct prices + one CASE UPDATE, then the change
+        # log: category entry (2) + item ids + item entries (2)
+        with self.assertNumQueries(8):
+            self.food.save(update_fields=['tax_rate'])
+        for price, after_tax in MenuItem.objects.values_list('price', 'price_after_tax'):
+            self.assertEqual(after_tax, tax.price_after_tax(price, Decimal('0.05')))
+
+    def test_api_output_filtering_and_sorting(self):
+        self.make_items(3, self.food)
+        # 3.40 sorts below Item 1 (3.50) by price, above it after tax
+        MenuItem.objects.create(title='Wine', price=Decimal('3.40'), inventory=1, category=self.drinks)
+
+        data = self.client.get('/api/menu-items-view', {
+            'ordering': '-price_after_tax', 'pagination': 'keyset', 'perpage': 10}).json()
+        self.assertEqual(
+            [(item['title'], item['price_after_tax']) for item in data['results']],
+            [('Item 2', 4.95), ('Wine', 4.08), ('Item 1', 3.85), ('Item 0', 2.75)])
+
+        data = self.client.get('/api/menu-items-des/', {'to_price_after_tax': '3.90', 'perpage': 10}).json()
+        self.assertEqual(sorted(item['title'] for item in data), ['Item 0', 'Item 1'])
+
+
+class BatchLookupTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.items = self.make_items(3)
+
+    def test_results_follow_request_order_with_not_found_markers(self):
+        a, b, c = [item.pk for item in self.items]
+        response = self.client.get('/api/menu/batch', {'ids': '%d,999,%d,%d' % (c, a, c)})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([item['id'] for item in data], [c, 999, a, c])
+        self.assertEqual(data[1], {'id': 999, 'detail': 'Not found.'})
+        self.assertEqual(data[0], self.client.get('/api/menu/%d' % c).json())
+
+    def test_one_query_for_the_batch(self):
+        ids = ','.join(str(item.pk) for item in self.items)
+        # menu_state (2) + the items
+        self.assertEqual(self.count_queries('/api/menu/batch?ids=%s' % ids), 3)
+
+    @override_settings(MENU_BATCH_MAX_IDS=2)
+    def test_invalid_and_oversized_batches(self):
+        for ids in ['', '1,x', '1,2,3']:
+            with self.subTest(ids=ids):
+                self.assertEqual(self.client.get('/api/menu/batch', {'ids': ids}).status_code, 400)
+
+
+class ChangeFeedTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(slug='food', title='Food')
+        self.items = self.make_items(3, self.category)
+
+    def feed(self, since=0, **params):
+        response = self.client.get('/api/menu/changes', {'since': since, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_initial_sync_returns_catalog(self):
+        data = self.feed()
+        self.assertEqual([item['id'] for item in data['items']], [item.pk for item in self.items])
+        self.assertEqual([category['id'] for category in data['categories']], [self.category.pk])
+        self.assertEqual(data['deleted'], {'categories': [], 'items': []})
+        self.assertFalse(data['has_more'])
+        self.assertEqual(self.feed(data['cursor'])['items'], [])
+
+    def test_changes_since_cursor_with_tombstones(self):
+        cursor = self.feed()['cursor']
+        first, second, third = self.items
+        deleted_pk = third.pk
+        second.price = Decimal('9.00')
+        second.save()
+        third.delete()
+        inventory.reserve(first.pk, 1)
+        MenuItem.objects.bulk_create([MenuItem(title='New', price=3, inventory=1, category=self.category)])
+
+        data = self.feed(cursor)
+        self.assertEqual(
+            [(item['title'], item['stock']) for item in data['items']],
+            [('Item 0', 9), ('Item 1', 10), ('New', 1)])
+        self.assertEqual(data['deleted'], {'categories': [], 'items': [deleted_pk]})
+
+    def test_log_keeps_latest_entry_per_object(self):
+        item = self.items[0]
+        for price in ['4.00', '5.00', '6.00']:
+            item.price = Decimal(price)
+            item.save()
+        self.assertEqual(MenuChange.objects.filter(kind=MenuChange.ITEM, object_id=item.pk).count(), 1)
+
+    def test_paging_and_query_count(self):
+        data = self.feed(limit=2)
+        self.assertTrue(data['has_more'])
+        # log page + items (no category changed on this page)
+        with self.assertNumQueries(2):
+            data = self.feed(data['cursor'], limit=2)
+        self.assertFalse(data['has_more'])
+        self.assertEqual(len(data['items']), 2)
+
+    def test_category_change_resends_its_items(self):
+        cursor = self.feed()['cursor']
+        self.category.title = 'Mains'
+        self.category.save()
+        data = self.feed(cursor)
+        self.assertEqual([category['title'] for category in data['categories']], ['Mains'])
+        self.assertEqual(len(data['items']), 3)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/menu/changes', {'since': 'x'}).status_code, 400)
+
+
+class MessagePackTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.category = Category.objects.create(slug='food', title='Food')
+        self.items = self.make_items(2, self.category)
+
+    def test_negotiated_by_accept(self):
+        url = '/api/menu/batch?ids=%d,%d' % (self.items[0].pk, self.items[1].pk)
+        response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), self.client.get(url).json())
+
+    def test_parses_request_body(self):
+        admin = User.objects.create_superuser('admin', password='secret')
+        self.client.force_login(admin)
+        body = msgpack.packb({'title': 'Soup', 'price': '3.00', 'stock': 4, 'category_id': self.category.pk})
+        response = self.client.post('/api/menu-items', body, content_type='application/msgpack')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(MenuItem.objects.get(title='Soup').inventory, 4)
+
+        response = self.client.post('/api/menu-items', b'\xc1', content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
+
+
+class CompressionTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.items = self.make_items(30)
+
+    def test_large_responses_are_compressed(self):
+        plain = self.client.get('/api/menu')
+        self.assertNotIn('Content-Encoding', plain)
+
+        response = self.client.get('/api/menu', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertTrue(response['ETag'].startswith('W/'))
+
+        if compression.brotli is not None:
+            response = self.client.get('/api/menu', HTTP_ACCEPT_ENCODING='gzip, br')
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertEqual(compression.brotli.decompress(response.content), plain.content)
+
+    def test_small_responses_are_not(self):
+        response = self.client.get('/api/menu/%d' % self.items[0].pk, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_streaming_exports_are_gzipped(self):
+        response = self.client.get('/api/menu-items-csv-stream', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(gzip.decompress(b''.join(response.streaming_content)).startswith(b'category,'))
+
+
+class MenuSnapshotTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(SNAPSHOT_DIR=directory.name, SNAPSHOT_BASE_URL='http://testserver')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.items = self.make_items(3)
+        call_command('build_snapshot', stdout=StringIO())
+
+    def test_serves_prebuilt_files_without_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/snapshot/menu.json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data, json.loads(self.client.get('/api/menu', HTTP_ACCEPT='application/json').content))
+
+        for fmt in ['xml', 'csv', 'yaml', 'msgpack']:
+            with self.subTest(fmt=fmt):
+                self.assertEqual(self.client.get('/api/snapshot/menu.%s' % fmt).status_code, 200)
+        self.assertEqual(self.client.get('/api/snapshot/menu.txt').status_code, 404)
+
+    @override_settings(SNAPSHOT_BASE_URL='https://menu.example.com:8443', ALLOWED_HOSTS=[])
+    def test_links_point_at_the_base_url(self):
+        data = json.loads(snapshot.render('json')[0])
+        self.assertEqual(data[0]['category'],
+                         'https://menu.example.com:8443/api/category/%d' % self.items[0].category_id)
+
+    def test_etag_and_precompressed_variants(self):
+        response = self.client.get('/api/snapshot/menu.csv')
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/snapshot/menu.csv', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        gzipped = self.client.get('/api/snapshot/menu.csv', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+        self.assertNotEqual(gzipped['ETag'], etag)
+        self.assertEqual(gzip.decompress(b''.join(gzipped.streaming_content)),
+                         b''.join(response.streaming_content))
+
+    def test_rebuilt_after_a_change(self):
+        etag = self.client.get('/api/snapshot/menu.json')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.items[0].delete()
+        with mock.patch.object(snapshot, 'start_compression'):
+            response = self.client.get('/api/snapshot/menu.json')
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))), 2)
+        # Only the current and the previous snapshot are kept
+        files = [name for name in os.listdir(settings.SNAPSHOT_DIR) if name.startswith('menu-')]
+        self.assertLessEqual(len(files), 2 * len(snapshot.FORMATS) * (1 + len(snapshot.ENCODINGS)))
+
+    def test_files_removed_after_reading_the_manifest(self):
+        old = snapshot.current_manifest()
+        for item in self.items[:2]:
+            with self.captureOnCommitCallbacks(execute=True):
+                item.delete()
+            snapshot.build_snapshot()
+        current = snapshot.current_manifest()
+        self.assertFalse(os.path.exists(snapshot.get_snapshot_dir() / old['formats']['json']['files']['identity']))
+        with mock.patch.object(views, 'current_manifest', side_effect=[old, current]):
+            response = self.client.get('/api/snapshot/menu.json')
+        self.assertEqual(response['ETag'], '"%s"' % current['formats']['json']['etag'])
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))), 1)
+
+    def test_falls_back_when_the_files_are_gone(self):
+        for path in snapshot.get_snapshot_dir().glob('menu-*'):
+            path.unlink()
+        response = self.client.get('/api/snapshot/menu.csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, snapshot.render('csv')[0])
+        # Rebuilt on the next read
+        with mock.patch.object(snapshot, 'start_compression'):
+            response = self.client.get('/api/snapshot/menu.csv')
+        self.assertTrue(response.streaming)
+
+    def test_rebuild_compresses_in_the_background(self):
+        with mock.patch.object(snapshot, 'start_compression') as start_compression:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.items[0].delete()
+            response = self.client.get('/api/snapshot/menu.json', HTTP_ACCEPT_ENCODING='gzip')
+        # Served right away, compressed on the fly until the files are there
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(gzip.decompress(b''.join(response.streaming_content)))), 2)
+        start_compression.assert_called_once_with(snapshot.get_snapshot_dir())
+
+        snapshot.start_compression(snapshot.get_snapshot_dir()).join()
+        response = self.client.get('/api/snapshot/menu.json', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response['ETag'].endswith('-gzip"'))
+        self.assertEqual(len(json.loads(gzip.decompress(b''.join(response.streaming_content)))), 2)
+
+
+class AsyncViewsTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        auth_cache.clear()
+        self.items = self.make_items(3)
+        self.category = self.items[0].category
+
+    def test_same_data_as_sync_views(self):
+        pairs = [
+            ('/api/menu', '/api/async/menu'),
+            ('/api/menu/%d' % self.items[0].pk, '/api/async/menu/%d' % self.items[0].pk),
+            ('/api/menu-items', '/api/async/menu-items'),
+            ('/api/menu-items?page=2', '/api/async/menu-items?page=2'),
+            ('/api/categories', '/api/async/categories'),
+            ('/api/category/%d' % self.category.pk, '/api/async/category/%d' % self.category.pk),
+        ]
+        for sync_url, async_url in pairs:
+            with self.subTest(url=async_url):
+                expected = self.client.get(sync_url, HTTP_ACCEPT='application/json')
+                response = self.client.get(async_url, HTTP_ACCEPT='application/json')
+                self.assertEqual(response.status_code, 200)
+                # Pagination links point back at the async endpoint
+                self.assertEqual(json.loads(response.content.decode().replace('/api/async/', '/api/')),
+                                 expected.json())
+
+    def test_pages_an_ordered_queryset(self):
+        for url in ['/api/menu-items?page=2', '/api/async/menu-items?page=2']:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error', UnorderedObjectListWarning)
+                self.assertEqual(self.client.get(url).status_code, 200, url)
+
+    def test_missing_objects(self):
+        response = self.client.get('/api/async/menu/999')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'detail': 'No MenuItem matches the given query.'})
+        self.assertEqual(self.client.get('/api/async/category/999').status_code, 404)
+        self.assertEqual(self.client.get('/api/async/menu-items?page=9').status_code, 404)
+        self.assertEqual(self.client.post('/api/async/menu').status_code, 405)
+
+    async def test_asgi_renderers_cache_and_conditional_get(self):
+        response = await self.async_client.get('/api/async/menu', headers={'accept': 'application/msgpack'})
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(len(msgpack.unpackb(response.content)), 3)
+
+        response = await self.async_client.get('/api/async/menu')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual((await self.async_client.get('/api/async/menu'))['X-Cache'], 'HIT')
+        response = await self.async_client.get('/api/async/menu', headers={'if-none-match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_async_token_and_jwt_authentication(self):
+        user = await User.objects.acreate(username='alice')
+        token = await Token.objects.acreate(user=user)
+        response = await self.async_client.get('/api/async/menu/%d' % self.items[0].pk,
+                                               headers={'authorization': 'Token %s' % token.key})
+        self.assertEqual(response.status_code, 200)
+        user_cached, _ = auth_cache.get(('token', token.key))
+        self.assertEqual(user_cached.username, 'alice')
+        self.assertEqual(user_cached._group_names, frozenset())
+
+        # Cached responses are served before authentication, as on the sync views
+        response = await self.async_client.get('/api/async/menu/%d' % self.items[1].pk,
+                                               headers={'authorization': 'Token wrong'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+        access = (await sync_to_async(RefreshToken.for_user)(user)).access_token
+        response = await self.async_client.get('/api/async/categories',
+                                               headers={'authorization': 'Bearer %s' % access})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(auth_cache.get(('jwt', access['user_id'])).username, 'alice')
+
+    def test_async_throttle_uses_shared_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(THROTTLE_STORE=os.path.join(directory, 'throttle.sqlite3')):
+                statuses = [self.client.get('/api/async/throttle-check').status_code for _ in range(3)]
+                self.assertEqual(statuses, [200, 200, 429])
+                self.assertIn('Retry-After', self.client.get('/api/async/throttle-check'))
+
+
+class MetricsTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        metrics.registry.clear()
+        self.items = self.make_items(3)
+        admin = User.objects.create_superuser('admin', password='secret-pass-123')
+        self.admin_auth = {'HTTP_AUTHORIZATION': 'Token %s' % Token.objects.create(user=admin).key}
+
+    def scrape(self):
+        response = self.client.get('/api/metrics', **self.admin_auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        return response.content.decode()
+
+    def sample(self, text, name, route, method='GET', **labels):
+        prefix = '%s{route="%s",method="%s"' % (name, route, method)
+        prefix += ''.join(',%s="%s"' % pair for pair in labels.items())
+        for line in text.splitlines():
+            if line.startswith(prefix + '}'):
+                return float(line.rsplit(' ', 1)[1])
+        return None
+
+    def test_records_per_route(self):
+        for _ in range(2):
+            self.client.get('/api/menu-items')
+        self.client.get('/api/menu/%d' % self.items[0].pk)
+        self.client.get('/api/menu/999')
+        text = self.scrape()
+
+        self.assertIn('# TYPE littlelemon_request_duration_seconds histogram', text)
+        self.assertEqual(self.sample(text, 'littlelemon_request_duration_seconds_count', 'api/menu-items'), 2)
+        self.assertEqual(self.sample(text, 'littlelemon_request_duration_seconds_bucket', 'api/menu-items',
+                                     le='+Inf'), 2)
+        self.assertEqual(self.sample(text, 'littlelemon_responses_total', 'api/menu/<int:id>',
+                                     status='404'), 1)
+        self.assertGreater(self.sample(text, 'littlelemon_request_sql_queries_sum', 'api/menu-items'), 0)
+        self.assertGreater(self.sample(text, 'littlelemon_request_sql_seconds_total', 'api/menu-items'), 0)
+        self.assertGreater(self.sample(text, 'littlelemon_request_serializer_seconds_total', 'api/menu-items'), 0)
+        self.assertGreater(self.sample(text, 'littlelemon_request_renderer_seconds_total', 'api/menu-items'), 0)
+        size = len(self.client.get('/api/menu-items').content)
+        self.assertEqual(self.sample(self.scrape(), 'littlelemon_response_bytes_sum', 'api/menu-items'), 3 * size)
+
+    def test_admin_only(self):
+        response = self.client.get('/api/metrics')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.content, b'Authentication credentials were not provided.\n')
+        user = User.objects.create_user('alice', password='secret-pass-123')
+        auth = {'HTTP_AUTHORIZATION': 'Token %s' % Token.objects.create(user=user).key}
+        response = self.client.get('/api/metrics', **auth)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertEqual(response.content, b'You do not have permission to perform this action.\n')
+
+    @override_settings(METRICS_MAX_ROUTES=1)
+    def test_routes_are_bounded(self):
+        self.client.get('/api/menu-items')
+        self.client.get('/api/categories')
+        self.client.get('/api/nowhere')
+        # The scrape itself is recorded after the export
+        text = self.scrape()
+        self.assertIsNotNone(self.sample(text, 'littlelemon_request_duration_seconds_count', 'api/menu-items'))
+        self.assertEqual(self.sample(text, 'littlelemon_request_duration_seconds_count', 'other'), 2)
+
+    @override_settings(METRICS_MAX_ROUTES=1)
+    def test_methods_are_bounded(self):
+        self.client.generic('BREW', '/api/menu-items')
+        for method in ['BREW', 'PROPFIND', 'X"}\n']:
+            self.client.generic(method, '/api/nowhere')
+        self.client.get('/api/categories')
+        text = self.scrape()
+        # Past the limit neither routes nor methods add series
+        self.assertEqual(self.sample(text, 'littlelemon_request_duration_seconds_count', 'api/menu-items', 'other'), 1)
+        self.assertEqual(self.sample(text, 'littlelemon_request_duration_seconds_count', 'other', 'other'), 3)
+        self.assertEqual(self.sample(text, 'littlelemon_request_duration_seconds_count', 'other'), 1)
+        self.assertNotIn('BREW', text)
+        self.assertNotIn('X"', text)
+
+    def test_overhead_per_request(self):
+        request = RequestFactory().get('/api/menu-items')
+        response = HttpResponse(b'x' * 100)
+        middleware = metrics.MetricsMiddleware(lambda request: response)
+        runs = 2000
+        started = time.perf_counter()
+        for _ in range(runs):
+            middleware(request)
+        # Generous bound so a slow CI machine doesn't fail it
+        self.assertLess((time.perf_counter() - started) / runs, 0.0005)
+
+
+class BenchmarkBaselineTest(TestCase):
+    def result(self, **changes):
+        result = {'rps': 200.0, 'p50': 0.010, 'p99': 0.030, 'queries': 3.0, 'peak_kib': 100, 'errors': 0}
+        result.update(changes)
+        return result
+
+    def test_flags_regressions_beyond_noise(self):
+        from .management.commands.bench_api import Command
+        command = Command(stdout=StringIO())
+        baseline = {'routes': {'menu': self.result(), 'categories': self.result()}}
+        # Within tolerance or under the noise floors
+        self.assertEqual(command.compare(
+            {'menu': self.result(p50=0.011, p99=0.090, rps=150.0, peak_kib=150)}, baseline, 0.5), [])
+        regressions = command.compare({
+            'menu': self.result(queries=4.0, errors=2),
+            'categories': self.result(p50=0.030, peak_kib=400),
+            'new route': self.result(),
+        }, baseline, 0.5)
+        self.assertEqual(sorted(regressions), [
+            ('categories', 'p50'), ('categories', 'peak memory'), ('menu', 'errors'), ('menu', 'queries')])
+
+
+class IndexesAndConstraintsTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        self.items = self.make_items(5)
+        self.category = self.items[0].category
+
+    def plan(self, queryset):
+        return queryset.explain()
+
+    def assertUsesIndex(self, queryset, index):
+        plan = self.plan(queryset)
+        self.assertRegex(plan, r'SEARCH .*USING (COVERING )?INDEX %s' % index, plan)
+
+    def assertOrderedByIndex(self, queryset):
+        plan = self.plan(queryset)
+        self.assertNotIn('TEMP B-TREE', plan)
+        self.assertIn('INDEX', plan)
+
+    def test_filters_use_indexes(self):
+        self.assertUsesIndex(MenuItem.objects.filter(price__lte=5), 'menuitem_price_id_idx')
+        self.assertUsesIndex(MenuItem.objects.filter(category=self.category), 'menuitem_category_price_idx')
+        self.assertUsesIndex(MenuItem.objects.filter(category=self.category, price__lte=5),
+                             'menuitem_category_price_idx')
+        # category__title: the unique index on Category.title, then (category, price)
+        plan = self.plan(MenuItem.objects.filter(category__title='Food'))
+        self.assertRegex(plan, r'SEARCH .*littlelemonAPI_category USING (COVERING )?INDEX', plan)
+        self.assertRegex(plan, r'SEARCH .*USING INDEX menuitem_category_price_idx', plan)
+        self.assertUsesIndex(MenuItem.objects.filter(title='Item 0', price=Decimal('2.50')),
+                             'sqlite_autoindex_littlelemonAPI_menuitem_1')
+
+    def test_orderings_use_indexes(self):
+        self.assertOrderedByIndex(MenuItem.objects.order_by('price', 'id'))
+        self.assertOrderedByIndex(MenuItem.objects.order_by('-inventory', '-id'))
+        self.assertOrderedByIndex(MenuItem.objects.filter(category=self.category).order_by('price'))
+        self.assertOrderedByIndex(MenuItem.objects.filter(price__gt=3).order_by('price', 'id'))
+
+    def test_duplicate_item_is_a_validation_error(self):
+        data = {'title': 'Item 0', 'price': '2.50', 'stock': 1, 'category_id': self.category.pk}
+        category_registry.current()
+        # No SELECT-based uniqueness check before the INSERT (and the tax
+        # rate comes from the category registry)
+        with self.assertNumQueries(5):
+            response = self.client.post('/api/menu-items', {**data, 'title': 'New'})
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/api/menu-items', data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'non_field_errors': ['The fields title, price must make a unique set.']})
+        # An item may keep its own title and price
+        response = self.client.put('/api/menu-items/%d' % self.items[0].pk, {**data, 'stock': 3},
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.put('/api/menu-items/%d' % self.items[1].pk, data, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_duplicate_category_title(self):
+        response = self.client.post('/api/categories', {'slug': 'food-2', 'title': 'Food'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'title': ['category with this title already exists.']})
+
+    def test_bulk_create_race_reports_per_item_errors(self):
+        validate_items = bulk.validate_items
+
+        def racing(data, instances=None):
+            result = validate_items(data, instances)
+            # Another request takes the title/price after the check
+            if not MenuItem.objects.filter(title='Dish').exists():
+                MenuItem.objects.create(title='Dish', price=4, inventory=1, category=self.category)
+            return result
+
+        data = [{'title': 'Other', 'price': '3.00', 'stock': 1, 'category_id': self.category.pk},
+                {'title': 'Dish', 'price': '4.00', 'stock': 1, 'category_id': self.category.pk}]
+        self.client.force_login(User.objects.create_superuser('admin', password='secret-pass-123'))
+        with mock.patch.object(bulk, 'validate_items', racing):
+            response = self.client.post('/api/menu-items/bulk', data, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), [{}, {'non_field_errors': ['The fields title, price must make a unique set.']}])
+        self.assertFalse(MenuItem.objects.filter(title='Other').exists())
+
+    def test_bulk_reraises_other_integrity_errors(self):
+        error = IntegrityError('FOREIGN KEY constraint failed')
+        data = [{'title': 'Other', 'price': '3.00', 'stock': 1, 'category_id': self.category.pk}]
+        with self.assertRaises(IntegrityError) as raised:
+            bulk.raise_conflicts(error, data)
+        self.assertIs(raised.exception, error)
+
+
+class MenuItemQuerySpecTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        self.items = self.make_items(4)
+        drinks = Category.objects.create(slug='drinks', title='Drinks')
+        self.items += self.make_items(3, category=drinks, start=10)
+
+    def ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        data = response.json()
+        if isinstance(data, dict):
+            data = data['results']
+        return [item['id'] for item in data]
+
+    def expected(self, *ordering, **filters):
+        return list(MenuItem.objects.filter(**filters).order_by(*ordering).values_list('id', flat=True))
+
+    def test_orderings(self):
+        for url, ordering in [
+            ('/api/menu-items-des/?perpage=10', ('id',)),
+            ('/api/menu-items-des/?perpage=10&ordering=-inventory', ('-inventory', '-id')),
+            ('/api/menu-items-des/?perpage=10&ordering=price_after_tax', ('price_after_tax', 'id')),
+        ]:
+            self.assertEqual(self.ids(url), self.expected(*ordering), url)
+        # Pages of 2 - the ties on inventory come back in id order
+        self.assertEqual(self.ids('/api/menu-items-view?ordering=inventory&page=2'),
+                         self.expected('inventory', 'id')[2:4])
+        self.assertEqual(self.ids('/api/menu-items-des/?perpage=10&category=Drinks&to_price=13&ordering=-price'),
+                         self.expected('-price', category__title='Drinks', price__lte=13))
+
+    def test_default_ordering(self):
+        cheap = MenuItem.objects.create(title='Bread', price=2, inventory=1, category=self.items[0].category)
+        # Unfiltered: id order, as before the filters were indexed
+        ids = self.ids('/api/menu-items-des/?perpage=10')
+        self.assertEqual(ids, self.expected('id'))
+        self.assertEqual(ids[-1], cheap.pk)
+        # Filtered: the order of the index serving the filter
+        ids = self.ids('/api/menu-items-des/?perpage=10&to_price=100')
+        self.assertEqual(ids, self.expected('price', 'id'))
+        self.assertEqual(ids[0], cheap.pk)
+
+    def test_rejects_params_outside_the_allow_list(self):
+        for url in ['/api/menu-items-des/?ordering=title', '/api/menu-items-des/?ordering=price,inventory',
+                    '/api/menu-items-des/?ordering=category__title', '/api/menu-items-des/?to_price=cheap',
+                    '/api/menu-items-des/?to_price_after_tax=NaN', '/api/menu-items-view?ordering=title',
+                    '/api/menu-items-view?ordering=-updated_at', '/api/menu-items-des/?page=abc',
+                    '/api/menu-items-des/?perpage=abc', '/api/menu-items-des/?perpage=0']:
+            self.assertEqual(self.client.get(url).status_code, 400, url)
+        response = self.client.get('/api/menu-items-des/?to_price=cheap&to_price_after_tax=1')
+        self.assertEqual(response.json(), {'to_price': 'A valid number is required.'})
+        response = self.client.get('/api/menu-items-des/?page=abc&perpage=2')
+        self.assertEqual(response.json(), {'page': 'A valid integer is required.'})
+
+    def test_viewset_shares_the_spec(self):
+        self.assertEqual(MenuItemsViewSet.ordering_fields, menu_item_query.ordering_fields)
+        self.assertEqual(MenuItemsViewSet.search_fields, menu_item_query.search_fields)
+        self.assertEqual(MenuItemKeysetPagination.orderings, menu_item_query.orderings)
+
+    def test_no_accepted_query_scans_the_table(self):
+        values = {'category': 'Food', 'to_price': '5', 'to_price_after_tax': '5'}
+        accepted, rejected = set(), set()
+        for size in range(len(values) + 1):
+            for params in itertools.combinations(sorted(values), size):
+                for ordering in [None, *menu_item_query.orderings]:
+                    query = {param: values[param] for param in params}
+                    if ordering:
+                        query['ordering'] = ordering
+                    try:
+                        queryset = menu_item_query.order_queryset(
+                            menu_item_query.filter_queryset(MenuItem.objects.all(), query), query)
+                    except ValidationError:
+                        rejected.add((params, ordering))
+                        continue
+                    accepted.add((params, ordering))
+                    plan = queryset.explain()
+                    # Neither: the table in rowid (id) order
+                    if params or ordering:
+                        self.assertIn('INDEX', plan, query)
+                    self.assertNotIn('TEMP B-TREE', plan, query)
+                    if params:
+                        # A range of the index, not a walk over all of it
+                        self.assertIn('SEARCH', plan, query)
+        self.assertLessEqual({(('category', 'to_price'), '-price'), (('to_price_after_tax',), None),
+                              ((), 'inventory')}, accepted)
+        self.assertLessEqual({(('to_price',), 'inventory'), (('category',), 'price_after_tax'),
+                              (('category', 'to_price_after_tax'), None)}, rejected)
+
+    def test_combinations(self):
+        response = self.client.get('/api/menu-items-des/?to_price=20&ordering=inventory')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'ordering': "Ordering by inventory can't be combined with filtering by to_price."})
+        response = self.client.get('/api/menu-items-des/?category=Food&to_price_after_tax=20&pagination=keyset')
+        self.assertEqual(response.status_code, 400)
+        # Without ?ordering= the ordering that fits the filters
+        self.assertEqual(self.ids('/api/menu-items-des/?perpage=10&to_price_after_tax=20'),
+                         self.expected('price_after_tax', 'id', price_after_tax__lte=20))
+        # Search narrows the rows first - any combination is fine
+        self.assertEqual(self.ids('/api/menu-items-des/?perpage=10&search=item&to_price=20&ordering=inventory'),
+                         self.expected('inventory', 'id', price__lte=20))
+
+
+@override_settings(ALLOWED_HOSTS=['testserver', 'localhost'])
+class CachedHyperlinkTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        self.items = self.make_items(3)
+        self.make_items(2, category=Category.objects.create(slug='drinks', title='Drinks'), start=3)
+
+    def serialize(self, serializer_class, request):
+        items = MenuItem.objects.for_serializer().order_by('id')
+        return serializer_class(items, many=True, context={'request': request}).data
+
+    def test_same_links_as_reverse(self):
+        class ReverseEveryRow(MenuHyperItemsSerializer):
+            serializer_related_field = HyperlinkedRelatedField
+
+        factory = RequestFactory()
+        for request in [factory.get('/api/menu-items'),
+                        factory.get('/api/menu-items', secure=True, HTTP_HOST='localhost:8443')]:
+            request = Request(request)
+            expected = self.serialize(ReverseEveryRow, request)
+            data = self.serialize(MenuHyperItemsSerializer, request)
+            self.assertEqual(data, expected)
+            self.assertEqual([type(item['category']) for item in data], [Hyperlink] * 5)
+        self.assertEqual(data[0]['category'], 'https://localhost:8443/api/category/%d' % self.items[0].category_id)
+
+    def test_reverses_per_request_not_per_row(self):
+        request = Request(RequestFactory().get('/api/menu-items'))
+        # Fields take reverse from rest_framework.relations when created
+        with mock.patch('rest_framework.relations.reverse', wraps=drf_reverse) as reverse:
+            self.serialize(MenuHyperItemsSerializer, request)
+            self.assertEqual(reverse.call_count, 3)
+            other = Request(RequestFactory().get('/api/menu-items', HTTP_HOST='localhost'))
+            data = self.serialize(MenuHyperItemsSerializer, other)
+            self.assertEqual(reverse.call_count, 6)
+        self.assertTrue(data[0]['category'].startswith('http://localhost/api/category/'))
+
+    def test_template_only_for_patterns_taking_any_integer(self):
+        field = CachedHyperlinkedRelatedField(view_name='category-detail', read_only=True)
+        request = Request(RequestFactory().get('/api/menu-items', HTTP_HOST='localhost:8000'))
+        self.assertEqual(field.build_url_template('category-detail', request, None),
+                         ('http://localhost:8000/api/category/', ''))
+        # A port (or anything else) with the value's digits in it is fine
+        request = Request(RequestFactory().get('/api/menu-items', HTTP_HOST='localhost:1111'))
+        self.assertEqual(field.build_url_template('category-detail', request, None),
+                         ('http://localhost:1111/api/category/', ''))
+        # A pattern taking single digits only
+        with mock.patch.object(field, 'reverse', lambda view_name, kwargs, **extra: (
+                '/one-digit/%s' % kwargs['pk'] if kwargs['pk'] < 10 else '/one-digit/0')):
+            self.assertIsNone(field.build_url_template('one-digit', request, None))
+
+    def test_views_output_unchanged(self):
+        response = self.client.get('/api/menu', HTTP_ACCEPT='application/json')
+        categories = [item['category'] for item in response.json()]
+        self.assertEqual(categories, ['http://testserver/api/category/%d' % item.category_id
+                                      for item in MenuItem.objects.order_by('id')])
+        rows = self.client.get('/api/menu-items-csv-stream')
+        self.assertIn(b'http://testserver/api/category/', b''.join(rows.streaming_content))
+
+
+class CategoryRegistryTest(MenuTestMixin, TestCase):
+    def setUp(self):
+        get_menu_cache().clear()
+        self.items = self.make_items(3)
+        self.category = self.items[0].category
+        self.drinks = Category.objects.create(slug='drinks', title='Drinks')
+        self.make_items(2, category=self.drinks, start=3)
+        category_registry.current()
+
+    def test_reads_without_category_queries(self):
+        for url in ['/api/menu-items', '/api/menu-items-des/?perpage=10&category=Drinks',
+                    '/api/menu-items/%d' % self.items[0].pk]:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertFalse([query['sql'] for query in queries if 'littlelemonAPI_category' in query['sql']], url)
+        data = self.client.get('/api/menu-items-des/?perpage=10&category=Drinks').json()
+        self.assertEqual([item['category'] for item in data],
+                         [{'id': self.drinks.pk, 'slug': 'drinks', 'title': 'Drinks'}] * 2)
+        self.assertEqual(self.client.get('/api/menu-items-des/?category=Desserts').json(), [])
+
+        for url in ['/api/categories', '/api/category/%d' % self.drinks.pk]:
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+        self.assertEqual(response.json(), {'id': self.drinks.pk, 'slug': 'drinks', 'title': 'Drinks'})
+        self.assertEqual(self.client.get('/api/category/999').status_code, 404)
+        # ?ordering= still sorts in SQL
+        titles = [category['title'] for category in self.client.get('/api/categories?ordering=title').json()['results']]
+        self.assertEqual(titles, ['Drinks', 'Food'])
+
+    def test_reads_the_primary_in_replica_requests(self):
+        token = routers._replica.set('replica')
+        try:
+            with mock.patch.object(routers.ReplicaRouter, 'db_for_read') as db_for_read:
+                category_registry.current(verify=True)
+                category_registry.invalidate()
+                self.assertEqual(category_registry.get(self.drinks.pk).title, 'Drinks')
+        finally:
+            routers._replica.reset(token)
+        db_for_read.assert_not_called()
+
+    def test_saves_in_this_process_are_seen_at_once(self):
+        self.drinks.title = 'Beverages'
+        self.drinks.save()
+        data = self.client.get('/api/menu-items-des/?perpage=10&category=Beverages').json()
+        self.assertEqual({item['category']['title'] for item in data}, {'Beverages'})
+        created = Category.objects.create(slug='desserts', title='Desserts')
+        self.assertEqual(self.client.get('/api/category/%d' % created.pk).json()['title'], 'Desserts')
+
+    def test_other_processes_writes_are_seen_after_the_check_interval(self):
+        # A queryset update sends no signal, as if another process wrote it
+        Category.objects.filter(pk=self.drinks.pk).update(title='Beverages', updated_at=timezone.now())
+        self.assertEqual(category_registry.get(self.drinks.pk).title, 'Drinks')
+        with override_settings(CATEGORY_CHECK_INTERVAL=0):
+            self.assertEqual(category_registry.get(self.drinks.pk).title, 'Beverages')
+            # Unchanged - only the version aggregate runs
+            with self.assertNumQueries(1):
+                category_registry.current()
+        # A category this process hasn't seen is looked up right away
+        Category.objects.bulk_create([Category(slug='desserts', title='Desserts')])
+        self.assertIsNotNone(category_registry.id_for_title('Desserts'))
+
+    def test_async_views(self):
+        # Loaded through sync_to_async, off the event loop
+        category_registry.invalidate()
+        response = self.client.get('/api/async/category/%d' % self.drinks.pk, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {'id': self.drinks.pk, 'slug': 'drinks', 'title': 'Drinks'})
+        self.assertEqual(self.client.get('/api/async/category/999').status_code, 404)
+        category_registry.invalidate()
+        response = self.client.get('/api/async/menu-items', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['results'], self.client.get('/api/menu-items').json()['results'])
@@ -1,4 +1,141 @@
-from rest_framework.throttling import UserRateThrottle
+import random
+import sqlite3
+import threading
 
-class TenCallsPerMinute(UserRateThrottle):
-    scope = 'ten'
\ No newline at end of file
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
+
+
+class SlidingWindowStore:
+    """Throttle counters in an SQLite file shared by every worker process on
+    the host.
+
+    Each key keeps two counters (current and previous fixed window), so
+    memory per client is constant. The rate is estimated as a sliding window:
+    previous * (share of the previous window still inside the sliding
+    window) + current.
+    """
+    # Fraction of hits that also prune counters idle for two windows
+    prune_probability = 0.001
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._initialized = False
+
+    def connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # isolation_level=None: transactions are managed explicitly below
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            if not self._initialized:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS throttle ('
+                    ' key TEXT PRIMARY KEY, window INTEGER NOT NULL,'
+                    ' current INTEGER NOT NULL, previous INTEGER NOT NULL)')
+                self._initialized = True
+            self._local.connection = connection
+        return connection
+
+    def hit(self, key, limit, duration, now):
+        """Records a request if it's allowed. Returns (allowed, wait)."""
+        window = int(now // duration)
+        elapsed = (now - window * duration) / duration
+        connection = self.connect()
+        # IMMEDIATE takes the write lock up front, so read + update is atomic
+        # across processes
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT window, current, previous FROM throttle WHERE key = ?', (key,)).fetchone()
+            current, previous = self.shift(row, window)
+            if previous * (1 - elapsed) + current + 1 > limit:
+                connection.execute('COMMIT')
+                return False, self.wait_time(limit, duration, elapsed, current, previous)
+            connection.execute(
+                'INSERT INTO throttle (key, window, current, previous) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET window = excluded.window, '
+                'current = excluded.current, previous = excluded.previous',
+                (key, window, current + 1, previous))
+            if random.random() < self.prune_probability:
+                connection.execute('DELETE FROM throttle WHERE window < ?', (window - 1,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return True, None
+
+    @staticmethod
+    def shift(row, window):
+        if row is None:
+            return 0, 0
+        stored_window, current, previous = row
+        if stored_window == window:
+            return current, previous
+        if stored_window == window - 1:
+            return 0, current
+        return 0, 0
+
+    @staticmethod
+    def wait_time(limit, duration, elapsed, current, previous):
+        # Time until previous * (1 - elapsed) + current drops to limit - 1
+        allowed = limit - 1
+        if current <= allowed and previous:
+            return max(0.0, (1 - (allowed - current) / previous) - elapsed) * duration
+        # The current window alone is over the limit: wait for it to become
+        # the previous window and decay enough
+        remaining = (1 - elapsed) * duration
+        if not current:
+            return remaining
+        return remaining + max(0.0, 1 - allowed / current) * duration
+
+    def clear(self):
+        self.connect().execute('DELETE FROM throttle')
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_throttle_store():
+    path = str(getattr(settings, 'THROTTLE_STORE', settings.BASE_DIR / 'throttle.sqlite3'))
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = SlidingWindowStore(path)
+        return _stores[path]
+
+
+class SharedRateThrottleMixin:
+    """Keeps DRF's rate parsing and cache keys, but counts requests in the
+    shared sliding-window store instead of a per-process history list."""
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        allowed, self._wait = get_throttle_store().hit(
+            self.key, self.num_requests, self.duration, self.timer())
+        return allowed
+
+    async def aallow_request(self, request, view):
+        # The store is a blocking SQLite call; run it in the thread pool so
+        # the event loop keeps serving other requests meanwhile
+        return await sync_to_async(self.allow_request, thread_sensitive=False)(request, view)
+
+    def wait(self):
+        return self._wait
+
+
+class SharedAnonRateThrottle(SharedRateThrottleMixin, AnonRateThrottle):
+    pass
+
+class SharedUserRateThrottle(SharedRateThrottleMixin, UserRateThrottle):
+    pass
+
+class TenCallsPerMinute(SharedRateThrottleMixin, UserRateThrottle):
+    scope = 'ten'
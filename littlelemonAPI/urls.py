@@ -5,8 +5,16 @@ from rest_framework.authtoken.views import obtain_auth_token
 urlpatterns =[
     path('menu-items', views.MenuItemsView.as_view()),
     path('menu-items/<int:pk>', views.SingleMenuItemView.as_view()),
+    path('menu-items/bulk', views.menu_items_bulk),
+    # Inventory reservation
+    path('menu-items/<int:pk>/reserve', views.reserve_item),
+    path('menu-items/<int:pk>/release', views.release_item),
+    path('menu-items/reserve', views.reserve_items),
+    path('menu-items/release', views.release_items),
     path('menu', views.menu_items),
     path('menu/<int:id>', views.single_item),
+    path('menu/batch', views.menu_items_batch),
+    path('menu/changes', views.menu_changes),
     path('categories', views.CategoriesView.as_view()),
     # For hyperlink display
     path('category/<int:pk>', views.category_detail, name='category-detail'),
@@ -15,6 +23,19 @@ urlpatterns =[
     path('welcome', views.welcome),
     path('menu-items-csv', views.menu_items_csv),
     path('menu-items-yaml', views.menu_items_yaml),
+    # Streaming exports
+    path('menu-items-csv-stream', views.menu_items_csv_stream),
+    path('menu-items-yaml-stream', views.menu_items_yaml_stream),
+    path('snapshot/menu.<str:fmt>', views.menu_snapshot),
+    # Async (ASGI) read views
+    path('async/menu', views.amenu_items),
+    path('async/menu/<int:id>', views.asingle_item),
+    path('async/menu-items', views.amenu_items_list),
+    path('async/categories', views.acategories_list),
+    path('async/category/<int:pk>', views.acategory_detail),
+    path('async/throttle-check', views.athrottle_check),
+    # Request metrics (admin only)
+    path('metrics', views.metrics),
     #Viewsets
     path('menu-items-view', views.MenuItemsViewSet.as_view({'get': 'list'})),
     path('menu-items-view/<int:pk>', views.MenuItemsViewSet.as_view({'get': 'retrieve'})),
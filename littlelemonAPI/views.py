@@ -4,9 +4,9 @@ from .models import Category
 from .serializers import MenuItemSerializer, MenuItemsSerializer, CategorySerializer, MenuHyperItemsSerializer
 from rest_framework.decorators import api_view, throttle_classes
 from rest_framework.response import Response
-from django.shortcuts import get_object_or_404
+from django.shortcuts import aget_object_or_404, get_object_or_404
 from rest_framework import status, viewsets
-from .throttles import TenCallsPerMinute
+from .throttles import TenCallsPerMinute, SharedAnonRateThrottle, SharedUserRateThrottle
 
 # TemplateHTMLRenderer & StaticHTMLRenderer
 from rest_framework.renderers import TemplateHTMLRenderer, StaticHTMLRenderer
@@ -20,54 +20,152 @@ from rest_framework_csv.renderers import CSVRenderer
 
 # Pagination
 from django.core.paginator import Paginator, EmptyPage
+from .pagination import MenuItemKeysetPagination, MenuItemPagination
 
 #Token-based authentication
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.decorators import permission_classes
 
-#API Throttling
-from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
+#API Throttling - counters shared by all worker processes, see throttles.py
 
 from django.contrib.auth.models import User, Group
+from .authentication import user_group_names
 
-class MenuItemsView(generics.ListCreateAPIView):
-    queryset = MenuItem.objects.all()
-    serializer_class = MenuItemsSerializer
+# Response cache for menu reads
+from django.utils.decorators import method_decorator
+from .cache import cache_menu_response
+
+# Bulk writes
+from .querybudget import set_query_budget
+from .bulk import BulkError, bulk_create_items, bulk_update_items, bulk_delete_items, bulk_query_budget
+
+# Inventory reservation
+from . import inventory
+from .inventory import InsufficientStock, StockLimitExceeded
+from .serializers import StockChangeSerializer, StockBatchSerializer
+
+# Streaming exports
+from django.http import StreamingHttpResponse
+from .streaming import menu_export_rows, stream_csv, stream_yaml
+
+# Conditional GET (ETag / Last-Modified)
+from .conditional import conditional_get, menu_state, menu_item_state, categories_state, category_state
+
+# Batch lookup by id
+from .batch import menu_items_by_id, parse_ids
+
+# Delta-sync change feed
+from .changes import changes_since, parse_feed_params
+
+# Prebuilt menu snapshots
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_safe
+from .snapshot import choose_encoding, current_manifest, get_snapshot_dir, mark_stale, render as render_snapshot
+
+# Read replicas for menu reads
+from .routers import replica_reads
+
+# Async (ASGI) read views
+from rest_framework.settings import api_settings
+from .asyncapi import apaginate_queryset, async_api_view
+
+# Request metrics
+from .metrics import registry
+from .renderers import PrometheusRenderer
+
+# Full-text search
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.filters import OrderingFilter
+from .search import MenuItemSearchFilter
+
+# Allow-listed filters and orderings for menu item lists
+from .filters import MenuItemOrderingFilter, menu_item_query
 
-class SingleMenuItemView(generics.RetrieveUpdateAPIView, generics.DestroyAPIView):
-    queryset = MenuItem.objects.all()
+# In-process category map
+from .categories import category_registry
+
+# Shared queryset for every MenuItem view (see MenuItemQuerySet.for_serializer)
+class MenuItemQuerysetMixin:
+    # Ordered, so page numbers are stable (?ordering= and search replace it)
+    queryset = MenuItem.objects.for_serializer().order_by('id')
     serializer_class = MenuItemsSerializer
+    pagination_class = MenuItemPagination
+
+@method_decorator([replica_reads, conditional_get(menu_state), cache_menu_response], name='dispatch')
+class MenuItemsView(MenuItemQuerysetMixin, generics.ListCreateAPIView):
+    pass
+
+@method_decorator(conditional_get(menu_item_state), name='dispatch')
+class SingleMenuItemView(MenuItemQuerysetMixin, generics.RetrieveUpdateAPIView, generics.DestroyAPIView):
+    pass
 
 # STEP 1: Implementing a class-based view for filtering, searching and pagination
-class MenuItemsViewSet(viewsets.ModelViewSet):
-    queryset = MenuItem.objects.all()
-    serializer_class = MenuItemsSerializer
-    ordering_fields =  ['price', 'inventory']
-    #search_fields = ['title']
+class MenuItemsViewSet(MenuItemQuerysetMixin, viewsets.ModelViewSet):
+    # Only indexed orderings, shared with menu_items_des (see filters.py)
+    ordering_fields = menu_item_query.ordering_fields
+    # Search runs before ordering so an explicit ?ordering= replaces the rank order
+    filter_backends = [DjangoFilterBackend, MenuItemSearchFilter, MenuItemOrderingFilter]
     # Searching in the related model - food, drinks categories
-    search_fields = ['title', 'category__title']
+    search_fields = menu_item_query.search_fields
 
+@replica_reads
+@conditional_get(menu_state)
+@cache_menu_response
 @api_view()
 def menu_items(request):
-    items = MenuItem.objects.select_related('category').all()
+    items = MenuItem.objects.for_serializer()
     # add context for hyperlinks display
     serialized_item = MenuHyperItemsSerializer(items, many=True, context={'request': request})
     return Response(serialized_item.data)
 
+@conditional_get(menu_item_state)
+@cache_menu_response
 @api_view()
 def single_item(request,id):
-    item = get_object_or_404(MenuItem, pk=id)
+    item = get_object_or_404(MenuItem.objects.for_serializer(), pk=id)
     serialized_item = MenuItemsSerializer(item)
     return Response(serialized_item.data)
 
+# Many items in one request and one query: ?ids=1,2,3. Results follow the
+# order of ids; missing ids get {"id": ..., "detail": "Not found."}
+@conditional_get(menu_state)
+@cache_menu_response
+@api_view()
+def menu_items_batch(request):
+    ids = parse_ids(request.query_params.get('ids'))
+    return Response(menu_items_by_id(ids))
+
+# Delta sync: ?since=<cursor> returns what changed after it, including
+# tombstones for deletes (see changes.py)
+@api_view()
+def menu_changes(request):
+    since, limit = parse_feed_params(request.query_params)
+    return Response(changes_since(since, limit))
+
+@method_decorator([replica_reads, conditional_get(categories_state)], name='dispatch')
 class CategoriesView(generics.ListCreateAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    # As the default (the serializer's fields), without needing a queryset
+    ordering_fields = ['id', 'slug', 'title']
+
+    # Listed from the category registry (see categories.py); ?ordering=
+    # still sorts in SQL
+    def get_queryset(self):
+        if self.request.method == 'GET' and OrderingFilter.ordering_param not in self.request.query_params:
+            return category_registry.all()
+        return super().get_queryset()
 
 #Hyperlink Related field
+@conditional_get(category_state)
+@cache_menu_response
 @api_view()
 def category_detail(request, pk):
-    category = get_object_or_404(Category, pk=pk)
+    category = category_registry.get(pk)
+    if category is None:
+        raise Http404('No Category matches the given query.')
     serialized_category = CategorySerializer(category)
     return Response(serialized_category.data)
 
@@ -75,52 +173,25 @@ def category_detail(request, pk):
 @api_view(['GET', 'POST'])
 def menu_items_des(request):
     if request.method == 'GET':
-        items = MenuItem.objects.select_related('category').all()
-        # Filtering menu items
-        category_name = request.query_params.get('category')
-        to_price = request.query_params.get('to_price')
-
-        # Search menu items
-        search = request.query_params.get('search')
+        items = MenuItem.objects.for_serializer()
+        # Pagination - a non-numeric page or perpage is a 400
+        page, perpage = menu_item_query.get_page(request.query_params)
 
-        # Order menu items
-        ordering = request.query_params.get('ordering')
-
-        # Pagination
-        perpage = request.query_params.get('perpage', default=2)
-        page = request.query_params.get('page', default=1)
-
-# Use 2 underscores -> linked to category model and linked to menu model
-        if category_name:
-            items = items.filter(category__title=category_name)
-        # if price = to_price -> equal price
-        if to_price:
-            items = items.filter(price__lte=to_price)#lte means price is less than or equal to a value
-         
-         # Starts with 
-        """  if search:
-            items = items.filter(title__startswith=search) """
+        # Filters and search from the allow-list in filters.py - a bad
+        # to_price or ordering is a 400, not a database error
+        items = menu_item_query.filter_queryset(items, request.query_params, search_fields=['title'])
         
-         # Starts with - case insensitive
-        """  if search:
-            items = items.filter(title__istartswith=search) """
-
-        # Present anywhere in title
-        """ if search:
-            items = items.filter(title__contains=search) """
-        
-         # Present anywhere in title -case insensitive
-        if search:
-            items = items.filter(title__icontains=search)
-        
-        # Ordering by price only
-        """ if ordering:
-            items = items.order_by(ordering) """
-        
-        # Ordering by price then inventory
-        if ordering:
-            ordering_fields = ordering.split(",")
-            items = items.order_by(*ordering_fields)
+        # Keyset pagination (opt-in with ?pagination=keyset) - no COUNT(*) or OFFSET
+        if MenuItemKeysetPagination.is_requested(request):
+            paginator = MenuItemKeysetPagination()
+            items = paginator.paginate_queryset(items, request)
+            serialized_item = MenuItemsSerializer(items, many=True)
+            return paginator.get_paginated_response(serialized_item.data)
+
+        # Only orderings an index can serve, with id as the tie-breaker.
+        # None given: id order, the index's order when filtering (rank order
+        # when searching)
+        items = menu_item_query.order_queryset(items, request.query_params)
 
         
         # Pagination
@@ -141,11 +212,78 @@ def menu_items_des(request):
         return Response(serialized_item.data, status.HTTP_201_CREATED)
     
 
+# Bulk create (POST), update (PUT) and delete (DELETE, list of ids) in one
+# transaction - nothing is written unless every item is valid. Writes run in
+# batches bounded by SQLite's parameter limit, hence the query budget sized
+# from the number of batches
+@api_view(['POST', 'PUT', 'DELETE'])
+@permission_classes([IsAdminUser])
+def menu_items_bulk(request):
+    set_query_budget(request, bulk_query_budget(request.data))
+    try:
+        if request.method == 'POST':
+            items = bulk_create_items(request.data)
+            return Response(MenuItemsSerializer(items, many=True).data, status.HTTP_201_CREATED)
+        elif request.method == 'PUT':
+            items = bulk_update_items(request.data)
+            return Response(MenuItemsSerializer(items, many=True).data)
+        elif request.method == 'DELETE':
+            deleted = bulk_delete_items(request.data)
+            return Response({"deleted": deleted})
+    except BulkError as exc:
+        return Response(exc.errors, status.HTTP_400_BAD_REQUEST)
+
+# Inventory reservation - atomic conditional updates, see inventory.py.
+# Signed-in users only
+def stock_change_response(change, *args):
+    try:
+        return Response(change(*args))
+    except MenuItem.DoesNotExist:
+        return Response({"detail": "Not found."}, status.HTTP_404_NOT_FOUND)
+    except InsufficientStock as exc:
+        detail = "Stock limit exceeded." if isinstance(exc, StockLimitExceeded) else "Insufficient stock."
+        return Response({"detail": detail, "id": exc.item_id, "requested": exc.requested,
+                         "available": exc.available}, status.HTTP_409_CONFLICT)
+
+def change_item_stock(change, request, pk):
+    serialized = StockChangeSerializer(data=request.data)
+    serialized.is_valid(raise_exception=True)
+    quantity = serialized.validated_data['quantity']
+    return stock_change_response(lambda: {"id": pk, "stock": change(pk, quantity)})
+
+def change_items_stock(change, request):
+    serialized = StockBatchSerializer(data=request.data)
+    serialized.is_valid(raise_exception=True)
+    items = [(item['id'], item['quantity']) for item in serialized.validated_data['items']]
+    return stock_change_response(
+        lambda: {"items": [{"id": pk, "stock": stock} for pk, stock in sorted(change(items).items())]})
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def reserve_item(request, pk):
+    return change_item_stock(inventory.reserve, request, pk)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def release_item(request, pk):
+    return change_item_stock(inventory.release, request, pk)
+
+# Batched - all items or none
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def reserve_items(request):
+    return change_items_stock(inventory.reserve_many, request)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def release_items(request):
+    return change_items_stock(inventory.release_many, request)
+
 # TemplateHTMLRenderer
 @api_view()
 @renderer_classes([TemplateHTMLRenderer])
 def menu(request):
-    items = MenuItem.objects.select_related('category').all()
+    items = MenuItem.objects.for_serializer()
     serialized_item = MenuItemsSerializer(items, many=True)
     return Response({'data': serialized_item.data}, template_name='menu-item.html')
 
@@ -157,23 +295,143 @@ def welcome(request):
     return Response(data)
 
 # CSVRenderer
+@replica_reads
+@cache_menu_response
 @api_view()
 @renderer_classes([CSVRenderer])
 def menu_items_csv(request):
-    items = MenuItem.objects.select_related('category').all()
+    items = MenuItem.objects.for_serializer()
     # add context for hyperlinks display
     serialized_item = MenuHyperItemsSerializer(items, many=True, context={'request': request})
     return Response(serialized_item.data)
 
 # YAMLRenderer
+@replica_reads
+@cache_menu_response
 @api_view()
 @renderer_classes([YAMLRenderer])
 def menu_items_yaml(request):
-    items = MenuItem.objects.select_related('category').all()
+    items = MenuItem.objects.for_serializer()
     # add context for hyperlinks display
     serialized_item = MenuHyperItemsSerializer(items, many=True, context={'request': request})
     return Response(serialized_item.data)
 
+# Streaming CSV - rows are serialized and sent as the queryset is read
+@replica_reads
+@api_view()
+def menu_items_csv_stream(request):
+    rows = menu_export_rows(request)
+    response = StreamingHttpResponse(
+        stream_csv(rows, header=MenuHyperItemsSerializer.Meta.fields), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="menu-items.csv"'
+    return response
+
+# Streaming YAML
+@replica_reads
+@api_view()
+def menu_items_yaml_stream(request):
+    rows = menu_export_rows(request)
+    return StreamingHttpResponse(stream_yaml(rows), content_type='application/yaml; charset=utf-8')
+
+# Whole menu from the prebuilt snapshot files (see snapshot.py): no ORM,
+# serializer or renderer work, and the file is handed to the server as is
+# (sendfile via wsgi.file_wrapper where the server supports it)
+@require_safe
+def menu_snapshot(request, fmt):
+    # A rebuild removes the files of older manifests - if that happens
+    # between reading the manifest and opening the file, read the manifest
+    # again
+    for _ in range(2):
+        entry = current_manifest()['formats'].get(fmt)
+        if entry is None:
+            raise Http404('Unknown format')
+        encoding = choose_encoding(request, entry['files'])
+        etag = quote_etag(entry['etag'] if encoding == 'identity' else '%s-%s' % (entry['etag'], encoding))
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            path = get_snapshot_dir() / entry['files'][encoding]
+            try:
+                file = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            response = FileResponse(file, content_type=entry['content_type'])
+            if encoding != 'identity':
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+    # The current manifest's files are gone too (the directory was cleaned
+    # out) - render this one from the database and rebuild on the next read
+    mark_stale()
+    content, content_type = render_snapshot(fmt)
+    response = HttpResponse(content, content_type=content_type)
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+# Async (ASGI) variants of the main read paths, under /api/async/. Same
+# data, caching and conditional GETs as the sync views; the ORM is awaited
+# (aiterator, aget, acount), so a slow query doesn't hold a worker thread
+@replica_reads
+@conditional_get(menu_state)
+@cache_menu_response
+@async_api_view()
+async def amenu_items(request):
+    items = [item async for item in MenuItem.objects.for_serializer().aiterator()]
+    return MenuHyperItemsSerializer(items, many=True, context={'request': request}).data
+
+@conditional_get(menu_item_state)
+@cache_menu_response
+@async_api_view()
+async def asingle_item(request, id):
+    item = await aget_object_or_404(MenuItem.objects.for_serializer(), pk=id)
+    # The nested category comes from the registry - load it off the event loop
+    await category_registry.acurrent()
+    return MenuItemsSerializer(item).data
+
+@replica_reads
+@conditional_get(menu_state)
+@cache_menu_response
+@async_api_view()
+async def amenu_items_list(request):
+    # Page numbers only; keyset pagination stays on the sync view
+    paginator = MenuItemPagination()
+    paginator.keyset = None
+    # Same rows, in the same order, as the sync MenuItemsView
+    items = await apaginate_queryset(paginator, MenuItemsView.queryset.all(), request)
+    await category_registry.acurrent()
+    return paginator.get_paginated_response(MenuItemsSerializer(items, many=True).data).data
+
+@replica_reads
+@conditional_get(categories_state)
+@async_api_view()
+async def acategories_list(request):
+    paginator = api_settings.DEFAULT_PAGINATION_CLASS()
+    # A page of the registry's list - no queries
+    categories = paginator.paginate_queryset((await category_registry.acurrent()).categories, request)
+    return paginator.get_paginated_response(CategorySerializer(categories, many=True).data).data
+
+@conditional_get(category_state)
+@cache_menu_response
+@async_api_view()
+async def acategory_detail(request, pk):
+    category = await category_registry.aget(pk)
+    if category is None:
+        raise Http404('No Category matches the given query.')
+    return CategorySerializer(category).data
+
+@async_api_view(throttle_classes=[SharedAnonRateThrottle])
+async def athrottle_check(request):
+    return {"message": "successful"}
+
+# Per-route request metrics in the Prometheus text format (see metrics.py)
+@api_view()
+@permission_classes([IsAdminUser])
+@renderer_classes([PrometheusRenderer])
+def metrics(request):
+    return Response(registry.export())
+
 # Protected API endpoint
 @api_view()
 @permission_classes([IsAuthenticated])
@@ -184,14 +442,15 @@ def secret(request):
 @api_view()
 @permission_classes([IsAuthenticated])
 def manager_view(request):
-    if request.user.groups.filter(name='Manager').exists():
+    # Group names are cached with the authenticated user
+    if 'Manager' in user_group_names(request.user):
         return Response({"message": "Only Manager should see this"})
     else:
         return Response({"message": "You are not authorized"}, 403)
     
 # Unauthenticated/anonymous users can call 10 times
 @api_view()
-@throttle_classes([AnonRateThrottle])
+@throttle_classes([SharedAnonRateThrottle])
 def throttle_check(request):
     content ={
         "message": "successful"
@@ -201,7 +460,7 @@ def throttle_check(request):
 #Throttling for authenticated users
 @api_view()
 @permission_classes([IsAuthenticated])
-@throttle_classes([UserRateThrottle])
+@throttle_classes([SharedUserRateThrottle])
 def throttle_check_auth(request):
     return Response({"message": "message for the logged in users only"})
 
@@ -213,15 +472,13 @@ def throttle_check_auth(request):
     return Response({"message": "message for the logged in users only"})
 
 # API Throttling for class-based views
-class MenuItemsViewSetThrottle(viewsets.ModelViewSet):
-    #throttle_classes =[AnonRateThrottle, UserRateThrottle]
-    queryset = MenuItem.objects.all()
-    serializer_class = MenuItemsSerializer
+class MenuItemsViewSetThrottle(MenuItemQuerysetMixin, viewsets.ModelViewSet):
+    #throttle_classes =[SharedAnonRateThrottle, SharedUserRateThrottle]
 
     # Conditional throttling
     def get_throttles(self):
         if self.action == 'create': #POST call, for GET call it's 'list'
-            throttle_classes = [UserRateThrottle]
+            throttle_classes = [SharedUserRateThrottle]
         else:
             throttle_classes = []
 